@@ -1,3 +1,4 @@
+import asyncio
 import gradio as gr
 
 # import essentials
@@ -6,6 +7,7 @@ from kruppe.algorithm.background import BackgroundResearcher
 
 # import librarian
 from block_librarian import get_librarian
+from stream_report import stream_report
 
 bkg_researcher = None
 
@@ -52,10 +54,14 @@ async def execute_background_researcher():
         gr.Warning("BackgroundResearcher not initialized. Please initialize the BackgroundResearcher first.")
         return
 
-    report = await bkg_researcher.execute()
+    # stream the report as it is being compiled
+    task = asyncio.create_task(bkg_researcher.execute())
+    async for report_text in stream_report(bkg_researcher, task):
+        yield report_text, ""
+    report = task.result()
 
     info_history_str = "\n".join([f"Q: {info_request}\nA: {response.text}\n" for info_request, response in bkg_researcher.info_history])
-    return report.text, info_history_str
+    yield report.text, info_history_str
 
 async def refresh_background_researcher():
     global bkg_researcher
@@ -1,3 +1,4 @@
+import asyncio
 import gradio as gr
 
 # import essentials
@@ -7,6 +8,7 @@ from kruppe.algorithm.coordinator import Coordinator
 # import librarian and background researcher
 from block_librarian import get_librarian
 from block_background import get_background_researcher
+from stream_report import stream_report
 
 # global states
 coordinator = None
@@ -84,7 +86,11 @@ async def execute_coordinator():
         gr.Warning("Coordinator not initialized. Please initialize the Coordinator first.")
         return
     
-    results = await coordinator.execute()
+    # stream whichever report is currently being compiled
+    task = asyncio.create_task(coordinator.execute())
+    async for report_text in stream_report(coordinator, task):
+        yield "", "", "", report_text
+    results = task.result()
 
     if len(results) > 3:
         gr.Warning("More than 3 reports generated. Only the first 3 reports are displayed.")
@@ -100,7 +106,7 @@ async def execute_coordinator():
                     + f"**Hypothesis:** {result['hypothesis']}\n\n"
                     + f"---Report---\n{result['report'].text}")
     
-    return format_report(results[0]), format_report(results[1]), format_report(results[2])    
+    yield format_report(results[0]), format_report(results[1]), format_report(results[2]), ""    
 
 def create_coordinator_block():
     with gr.Blocks() as block:
@@ -170,6 +176,7 @@ def create_coordinator_block():
             output_1 = gr.Textbox(label="Report 1", lines=10, interactive=False)
             output_2 = gr.Textbox(label="Report 2", lines=10, interactive=False)
             output_3 = gr.Textbox(label="Report 3", lines=10, interactive=False)
+        output_live = gr.Textbox(label="Report in Progress", lines=10, interactive=False)
 
-        execute_button.click(execute_coordinator, outputs=[output_1, output_2, output_3])
+        execute_button.click(execute_coordinator, outputs=[output_1, output_2, output_3, output_live])
     return block
\ No newline at end of file
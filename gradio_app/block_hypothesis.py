@@ -1,3 +1,4 @@
+import asyncio
 import gradio as gr
 
 # import essentials
@@ -7,6 +8,7 @@ from kruppe.algorithm.agents import Lead
 
 # import librarian
 from block_librarian import get_librarian
+from stream_report import stream_report
 
 # global states
 hyp_researcher = None
@@ -62,11 +64,15 @@ async def execute_hypothesis():
         gr.Warning("HypothesisResearcher not initialized. Please initialize the HypothesisResearcher first.")
         return
 
-    continue_research = await hyp_researcher.research()
+    # stream the report as it is being compiled
+    task = asyncio.create_task(hyp_researcher.research())
+    async for report_text in stream_report(hyp_researcher, task):
+        yield report_text, hyp_researcher.latest_hypothesis, "Compiling report..."
+    continue_research = task.result()
 
     output_status = "Research completed." if continue_research else "Research not completed."
 
-    return hyp_researcher.latest_report, hyp_researcher.latest_hypothesis, output_status
+    yield hyp_researcher.latest_report, hyp_researcher.latest_hypothesis, output_status
 
 def create_hypothesis_block():
     with gr.Blocks() as block:
@@ -4,6 +4,7 @@ import chromadb
 # ----- KRUPPE IMPORTS ----- #
 # import essentials
 from kruppe.llm import OpenAILLM, OpenAIEmbeddingModel
+from kruppe.embedding_cache import CachedEmbeddingModel
 
 # data sources to use
 from kruppe.data_source.news.newshub import NewsHub
@@ -50,7 +51,7 @@ async def initialize_librarian(param_model, param_embed_model, param_retriever,
 
     # initialize the LLM model
     llm = OpenAILLM(model=param_model)
-    embed_model = OpenAIEmbeddingModel(model=param_embed_model)
+    embed_model = CachedEmbeddingModel(embedding_model=OpenAIEmbeddingModel(model=param_embed_model))
 
     # initialize the vectorstore index
     vectorstore = ChromaVectorStore(
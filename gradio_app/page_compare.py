@@ -20,6 +20,11 @@ inmemory_vectorstore_dir = Path("tmp/inmemory")
 (inmemory_vectorstore_dir / "Vectorstore Index").mkdir(parents=True, exist_ok=True)
 (inmemory_vectorstore_dir / "Contextual Index").mkdir(parents=True, exist_ok=True)
 
+# indexes saved before the directory format were pickles; convert them once so the explorer lists them
+for pickle_path in inmemory_vectorstore_dir.rglob("*.pickle"):
+    if not (pickle_path.with_suffix("") / "manifest.json").exists():
+        InMemoryVectorStore.load_pickle(pickle_path).save(pickle_path.with_suffix(""))
+
 embedding_model = OpenAIEmbeddingModel()
 llm = OpenAILLM()
 
@@ -70,7 +75,7 @@ async def build_index_helper(dataset: str, index: BaseIndex):
 
         # save vectorstore
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
-        vectorstore1.save_pickle(inmemory_vectorstore_dir / f"deepseek_news_{timestamp}.pickle")
+        vectorstore1.save(inmemory_vectorstore_dir / f"deepseek_news_{timestamp}")
         gr.Info("Index built successfully", duration=5)
 
         return True # generating a random number to rerender the index_1_state
@@ -90,10 +95,10 @@ async def handle_build_index_1(dataset: str) -> str:
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
 
     # create directory if not exists
-    path = inmemory_vectorstore_dir / "Vectorstore Index" / f"{dataset}_{timestamp}.pickle"
-    vectorstore1.save_pickle(path)
+    path = inmemory_vectorstore_dir / "Vectorstore Index" / f"{dataset}_{timestamp}"
+    vectorstore1.save(path)
 
-    return path.stem
+    return path.name
 
 async def handle_build_index_2(dataset: str) -> str:
     global embedding_model, llm
@@ -108,31 +113,32 @@ async def handle_build_index_2(dataset: str) -> str:
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
 
     # create directory if not exists
-    path = inmemory_vectorstore_dir / "Contextual Index" / f"{dataset}_{timestamp}.pickle"
-    vectorstore2.save_pickle(path)
+    path = inmemory_vectorstore_dir / "Contextual Index" / f"{dataset}_{timestamp}"
+    vectorstore2.save(path)
 
-    return path.stem
+    return path.name
 
 async def handle_select_vectorstore_1(path: str):
     global vectorstore1, index1
 
-    vectorstore1 = InMemoryVectorStore.load_pickle(path=path)
+    # the file explorer selects the manifest.json inside a saved vectorstore directory
+    vectorstore1 = InMemoryVectorStore.load(Path(path).parent, embedding_model=embedding_model)
     index1 = VectorStoreIndex(vectorstore=vectorstore1)
 
     gr.Info("Index built successfully", duration=5)
 
-    return Path(path).stem 
+    return Path(path).parent.name
 
 async def handle_select_vectorstore_2(path: str):
     global vectorstore2, index2
     global llm
 
-    vectorstore2 = InMemoryVectorStore.load_pickle(path=path)
+    vectorstore2 = InMemoryVectorStore.load(Path(path).parent, embedding_model=embedding_model)
     index2 = ContextualVectorStoreIndex(vectorstore=vectorstore2, llm=llm)
 
     gr.Info("Index built successfully", duration=5)
 
-    return Path(path).stem  
+    return Path(path).parent.name
 
 # ---- QUERY HANDLERS ----
 
@@ -257,7 +263,7 @@ with gr.Blocks() as demo:
                 # ===== VECTORSTORE SELECTION =====
                 gr.Markdown("### Option 2: Load past vectorstore")
                 vectorstore_select_1 = gr.FileExplorer(
-                    glob="*.pickle",
+                    glob="*/manifest.json",
                     file_count="single",
                     root_dir=inmemory_vectorstore_dir / "Vectorstore Index",
                     label="Select vectorstore",
@@ -318,7 +324,7 @@ with gr.Blocks() as demo:
                 # ===== VECTORSTORE SELECTION =====
                 gr.Markdown("### Option 2: Load past vectorstore")
                 vectorstore_select_2 = gr.FileExplorer(
-                    glob="*.pickle",
+                    glob="*/manifest.json",
                     file_count="single",
                     root_dir=inmemory_vectorstore_dir / "Contextual Index",
                     label="Select vectorstore",
@@ -0,0 +1,44 @@
+import asyncio
+from typing import AsyncGenerator
+
+from kruppe.algorithm.agents import Researcher
+
+# -------------------------------
+# Stream report text from a running researcher
+# -------------------------------
+
+async def stream_report(researcher: Researcher, task: asyncio.Task) -> AsyncGenerator[str, None]:
+    """
+    Forward the report deltas of `researcher` while `task` runs, yielding the text of the current
+    report so far (a new report replaces the previous one).
+    Call it right after creating the task, so the handler is attached before the task starts.
+    The task's result (or exception) is left for the caller to collect with `task.result()`.
+    """
+    queue = asyncio.Queue()
+    researcher.stream_handler = queue.put_nowait
+    report_text = ""
+
+    def add(delta: str | None) -> str:
+        # None marks the start of a new report
+        return "" if delta is None else report_text + delta
+
+    try:
+        while not task.done():
+            get_delta = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({get_delta, task}, return_when=asyncio.FIRST_COMPLETED)
+            if get_delta not in done:
+                get_delta.cancel()
+                break
+
+            report_text = add(get_delta.result())
+            while not queue.empty():
+                report_text = add(queue.get_nowait())
+            yield report_text
+
+        # anything that arrived right before the task finished
+        if not queue.empty():
+            while not queue.empty():
+                report_text = add(queue.get_nowait())
+            yield report_text
+    finally:
+        researcher.stream_handler = None
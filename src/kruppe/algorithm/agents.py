@@ -1,16 +1,46 @@
 from abc import ABC, abstractmethod
 from pydantic import BaseModel
+from typing import Any, Callable, Dict, List
+import inspect
 from kruppe.llm import BaseLLM
+from kruppe.llm_telemetry import telemetry_tags
+from kruppe.models import Response
 
 
 class Researcher(BaseModel, ABC):
     llm: BaseLLM
     # system_message: str
+    # receives report text deltas as they are generated (sync or async), and None when a new report starts
+    stream_handler: Callable[[str | None], Any] | None = None
 
     @abstractmethod
     async def execute(self):
         raise NotImplementedError
 
+    async def _generate(self, messages: List[Dict[str, str]], template: str | None = None) -> Response:
+        """Generate with the llm. The call is tagged with this researcher and the prompt template in the llm telemetry."""
+        with telemetry_tags(caller=self.__class__.__name__, template=template):
+            return await self.llm.async_generate(messages)
+
+    async def _generate_streamed(self, messages: List[Dict[str, str]], template: str | None = None) -> Response:
+        """Generate with the llm, forwarding text deltas to `stream_handler` if one is set.
+        The handler gets None first, so it can tell reports apart."""
+        if self.stream_handler is None:
+            return await self._generate(messages, template=template)
+
+        deltas = []
+        await self._emit(None)
+        with telemetry_tags(caller=self.__class__.__name__, template=template):
+            async for delta in self.llm.async_stream(messages):
+                deltas.append(delta)
+                await self._emit(delta)
+        return Response(text="".join(deltas))
+
+    async def _emit(self, delta: str | None):
+        result = self.stream_handler(delta)
+        if inspect.isawaitable(result):
+            await result
+
 
 class Lead(BaseModel):
     observation: str # observation that led to the lead/hypothesis, though i don't really use this
@@ -75,7 +75,7 @@ class BackgroundResearcher(Researcher):
             {"role": "user", "content": user_message},
         ]
 
-        llm_response = await self.llm.async_generate(messages)
+        llm_response = await self._generate(messages, template="CREATE_INFO_REQUEST_USER")
         llm_string = llm_response.text
 
         info_requests = re.split(r'\n+', llm_string)
@@ -119,7 +119,7 @@ class BackgroundResearcher(Researcher):
             {"role": "user", "content": user_message},
         ]
 
-        llm_response = await self.llm.async_generate(messages)
+        llm_response = await self._generate(messages, template="ANSWER_INFO_REQUEST_USER")
         llm_response.sources = ret_docs
 
         self.info_history.append((info_request, llm_response))
@@ -147,7 +147,8 @@ class BackgroundResearcher(Researcher):
             {"role": "user", "content": user_message},
         ]
 
-        llm_response = await self.llm.async_generate(messages)
+        # the report is the long generation, so stream it if someone is listening
+        llm_response = await self._generate_streamed(messages, template="COMPILE_REPORT_USER")
 
         return llm_response
 
@@ -190,7 +191,7 @@ class BackgroundResearcher(Researcher):
             {"role": "user", "content": user_message},
         ]
 
-        llm_response = await self.llm.async_generate(messages)
+        llm_response = await self._generate(messages, template="ANALYZE_DOCUMENT_SIMPLE_USER")
         llm_string = llm_response.text
 
         research_result = {
@@ -229,7 +230,7 @@ class BackgroundResearcher(Researcher):
             {"role": "user", "content": user_message},
         ]
 
-        response1 = await self.llm.async_generate(messages)
+        response1 = await self._generate(messages, template="ANALYZE_QUERY_USER_CHAIN[0]")
         messages.append({"role": "assistant", "content": response1.text})
 
         # extract additional information from query
@@ -238,7 +239,7 @@ class BackgroundResearcher(Researcher):
         )
         messages.append({"role": "user", "content": followup_message})
 
-        response2 = await self.llm.async_generate(messages)
+        response2 = await self._generate(messages, template="ANALYZE_QUERY_USER_CHAIN[1]")
         messages.append({"role": "assistant", "content": response2.text})
         
         response_text = response1.text + response2.text
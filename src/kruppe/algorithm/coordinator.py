@@ -58,7 +58,7 @@ class Coordinator(Researcher):
             hyp_researcher = HypothesisResearcher(
                 new_lead=lead,
                 research_question=self.research_question,
-                **self.hyp_researcher_config
+                **{"stream_handler": self.stream_handler, **self.hyp_researcher_config} # forward report streaming
             )
             self._hyp_researchers.append(hyp_researcher)
 
@@ -117,7 +117,7 @@ class Coordinator(Researcher):
             {"role": "user", "content": user_message},
         ]
 
-        llm_response = await self.llm.async_generate(messages)
+        llm_response = await self._generate(messages, template="CREATE_LEAD_USER")
         llm_string = llm_response.text
 
         # -- REGEX TO PARSE LEADS --
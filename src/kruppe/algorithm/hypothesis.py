@@ -14,6 +14,7 @@ from kruppe.prompts.hypothesis import (
     EVALUATE_LEAD_USER,
     UPDATE_LEAD_USER
 )
+from kruppe.llm_history import HistoryBudget
 from kruppe.utils import log_io
 from kruppe.models import Response
 
@@ -26,6 +27,7 @@ class HypothesisResearcher(Researcher):
     init_lead: Lead
     chat_iterations: int = 3 # TODO: currently hardcoded method to stop evaluation, need to change this
     chat_depth: int = 1 # NOTE: number of past chat history to use in next iteration
+    history_budget: HistoryBudget | None = None # token budget for the messages sent each call (see kruppe.llm_history)
     num_info_requests: int = 3 # number of info requests to make per iteration
     verbatim_answer: bool = False # whether to return the raw documents or the processed response
     strict_answer: bool = True # TODO: change from boolean to magnitude so i have varying degree of "strictness". This determines if the system will continue even if no documents are found
@@ -219,7 +221,7 @@ class HypothesisResearcher(Researcher):
             {"role": "user", "content": user_message},
         ]
 
-        llm_response = await self.llm.async_generate(messages)
+        llm_response = await self._generate(messages, template="CREATE_INFO_REQUEST_USER")
         llm_string = llm_response.text
 
         info_requests = re.split(r'\n+', llm_string)
@@ -249,7 +251,7 @@ class HypothesisResearcher(Researcher):
                 {"role": "user", "content": user_message},
             ]
 
-            llm_response = await self.llm.async_generate(messages)
+            llm_response = await self._generate(messages, template="ANSWER_INFO_REQUEST_USER")
             llm_response.sources = ret_docs
 
             return llm_response
@@ -268,16 +270,16 @@ class HypothesisResearcher(Researcher):
 
         user_message = COMPILE_REPORT_USER.format(
             research_question=self.research_question,
-            lead=self.lateset_lead.lead,
-            hypothesis=self.lateset_lead.hypothesis,
-            observation=self.lateset_lead.observation,
+            lead=self.latest_lead.lead,
+            hypothesis=self.latest_lead.hypothesis,
+            observation=self.latest_lead.observation,
             info_responses=new_info_responses,
         )
 
         messages.append({"role": "user", "content": user_message})
 
-        # llm compile report, as Response object
-        report_response = await self.__send_messages_with_history(messages)
+        # llm compile report, as Response object (streamed to `stream_handler` if set)
+        report_response = await self.__send_messages_with_history(messages, template="COMPILE_REPORT_USER", stream=True)
 
         # append llm response to chat history
         messages.append({"role": "assistant", "content": report_response.text})
@@ -295,7 +297,7 @@ class HypothesisResearcher(Researcher):
         # append user message to chat history
         messages.append({"role": "user", "content": user_message})  
 
-        eval_response = await self.__send_messages_with_history(messages)
+        eval_response = await self.__send_messages_with_history(messages, template="EVALUATE_LEAD_USER")
 
         # append llm response to chat history
         messages.append({"role": "assistant", "content": eval_response.text})
@@ -315,7 +317,7 @@ class HypothesisResearcher(Researcher):
         user_message = UPDATE_LEAD_USER
         messages.append({"role": "user", "content": user_message})
 
-        update_response = await self.__send_messages_with_history(messages)
+        update_response = await self.__send_messages_with_history(messages, template="UPDATE_LEAD_USER")
         messages.append({"role": "assistant", "content": update_response.text})
 
         # regex parse the response to extract Lead
@@ -339,11 +341,22 @@ class HypothesisResearcher(Researcher):
                 "Assuming the lead is rejected.")
             return None
     
-    async def __send_messages_with_history(self, curr_messages: List[Dict[str, str]]):
-        """Send messages to the LLM with the history of messages."""
+    async def __send_messages_with_history(self, curr_messages: List[Dict[str, str]], template: str | None = None, stream: bool = False):
+        """Send messages to the LLM with the history of messages.
+        
+        Layout is system message, then history, then the current chain. The chain is append-only,
+        so the report, evaluation and lead update calls of an iteration each extend the previous
+        prompt, and the provider's prompt cache serves the shared prefix. With `history_budget`
+        set, the history is trimmed to the budget first.
+        """
         messages = ([{"role": "system", "content": self.system_message}] # system message
                     + self._messages_history # past messages, for a chosen number of iterations
                     + curr_messages # current messages
                     )
+        if self.history_budget is not None:
+            # drops (or summarizes) the oldest turns first, keeping the system message and the latest request
+            messages = self.history_budget.trim(messages)
         
-        return await self.llm.async_generate(messages)
+        if stream:
+            return await self._generate_streamed(messages, template=template)
+        return await self._generate(messages, template=template)
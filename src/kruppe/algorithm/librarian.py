@@ -128,7 +128,7 @@ class Librarian(Researcher):
             {"role": "system", "content": self.system_message},
             {"role": "user", "content": REQUEST_TO_QUERY_USER.format(info_request=info_request)},
         ]
-        llm_response = await self.llm.async_generate(messages)
+        llm_response = await self._generate(messages, template="REQUEST_TO_QUERY_USER")
         llm_string = llm_response.text # info request, except more concise
         logger.debug("LLM Query\nSYSTEM=%s\nUSER=%s", messages[0]["content"], messages[1]["content"])
         logger.debug("LLM Response\nASSISTANT=%s", llm_string)
@@ -162,7 +162,7 @@ class Librarian(Researcher):
                     {"role": "system", "content": self.system_message},
                     {"role": "user", "content": user_message},
                 ]
-                llm_response = await self.llm.async_generate(messages)
+                llm_response = await self._generate(messages, template="LIBRARIAN_CONTEXT_RELEVANCE_USER")
                 llm_string = llm_response.text
                 logger.debug("LLM Query\nSYSTEM=%s\nUSER=%s", messages[0]["content"], messages[1]["content"])
                 logger.debug("LLM Response\nASSISTANT=%s", llm_string)
@@ -264,7 +264,7 @@ class Librarian(Researcher):
                 {"role": "user", "content": user_message},
             ]
 
-            llm_response = await self.llm.async_generate(messages)
+            llm_response = await self._generate(messages, template="LIBRARIAN_TIME_USER")
             llm_string = llm_response.text
             logger.debug("LLM Query\nSYSTEM=%s\nUSER=%s", messages[0]["content"], messages[1]["content"])
             logger.debug("LLM Response\nASSISTANT=%s", llm_string)
@@ -356,7 +356,7 @@ class Librarian(Researcher):
             {"role": "user", "content": user_message},
         ]
 
-        llm_response = await self.llm.async_generate(messages)
+        llm_response = await self._generate(messages, template="CHOOSE_RESOURCE_USER")
         llm_string = llm_response.text
         logger.debug("LLM Query\nSYSTEM=%s\nUSER=%s", messages[0]["content"], messages[1]["content"])
         logger.debug("LLM Response\nASSISTANT=%s", llm_string)
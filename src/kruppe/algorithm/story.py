@@ -1,5 +1,4 @@
 from typing import List
-import asyncio
 from kruppe.embeddings import BaseEmbeddingModel, OpenAIEmbeddingModel
 from kruppe.functional.rag.text_splitters import RecursiveTextSplitter
 from kruppe.vector_storages import BaseVectorStorage, NumPyVectorStorage
@@ -146,14 +145,15 @@ class StoryWriter:
             system_prompt="You extract relevance from a story given a text.",
             prompt_template=RELEVANCE_PROMPT,
         )
-        tasks = []
+        messages_list = []
         for document in documents:
             messages = relevance_prompt_formatter.format_messages(
                 text=document.text, story="\n\n".join(self.stories)
             )
-            tasks.append(self.llm.async_generate(messages))
+            messages_list.append(messages)
 
-        relevance_results = await asyncio.gather(*tasks)
+        # one bulk job, so a BatchLLM can send it through the provider batch api
+        relevance_results = await self.llm.batch_async_generate(messages_list)
         relevant_documents = [
             doc for doc, relevance in zip(documents, relevance_results) 
             if relevance.startswith("Yes") or relevance.startswith("yes")
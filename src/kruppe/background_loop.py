@@ -0,0 +1,104 @@
+import atexit
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Coroutine, List, Any, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class BackgroundLoop:
+    """
+    An event loop running forever on a daemon thread, for sync wrappers of async APIs.
+
+    `run(coro)` submits the coroutine to the loop and blocks until it finishes. Unlike
+    `asyncio.run`, the loop (and everything bound to it, like the shared NYU connection pools)
+    outlives the call, so sync callers keep warm connections. It also works when the calling
+    thread already has a running loop (notebooks, gradio), so nest_asyncio isn't needed.
+
+    Context variables (telemetry tags, the current llm call) are carried over from the caller.
+    """
+
+    def __init__(self, name: str = "kruppe-background-loop"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._shutdown_callbacks: List[Callable[[], Awaitable[None]]] = []
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """the loop, started on first use"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name=self.name, daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def in_loop_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def run(self, coro: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+        """run `coro` on the background loop and wait for its result"""
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError("Sync API called from inside the background loop; await the async version instead")
+
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            # e.g. KeyboardInterrupt or a timeout in the calling thread: don't leave the task running
+            future.cancel()
+            raise
+
+    def on_shutdown(self, callback: Callable[[], Awaitable[None]]) -> None:
+        """register a coroutine function to await on the loop before it stops (e.g. closing connection pools)"""
+        self._shutdown_callbacks.append(callback)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """run the shutdown callbacks, cancel what is left, and stop the loop. the next `run` starts a new one"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None or loop.is_closed():
+            return
+
+        async def shutdown():
+            for callback in self._shutdown_callbacks:
+                try:
+                    await callback()
+                except Exception as e:
+                    logger.debug("Background loop shutdown callback failed: %s", e)
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await loop.shutdown_asyncgens()
+
+        if loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout)
+            except Exception as e:
+                logger.debug("Background loop did not shut down cleanly: %s", e)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout)
+        if not loop.is_running():
+            loop.close()
+
+
+# the loop every sync wrapper in kruppe submits to
+BACKGROUND_LOOP = BackgroundLoop()
+atexit.register(BACKGROUND_LOOP.stop)
+
+
+def get_background_loop() -> BackgroundLoop:
+    return BACKGROUND_LOOP
+
+
+def run_sync(coro: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+    """run `coro` on the shared background loop and wait for the result (the replacement for `asyncio.run` in sync wrappers)"""
+    return BACKGROUND_LOOP.run(coro, timeout)
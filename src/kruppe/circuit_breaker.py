@@ -0,0 +1,134 @@
+import time
+import logging
+import threading
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """raised when every backend's circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a backend that keeps failing.
+
+    closed -> open after `failure_threshold` consecutive failures. While open, `allow()` is False.
+    After `cooldown` seconds the circuit is half open: one trial request is let through. If it
+    succeeds the circuit closes, if it fails the circuit opens again for another cooldown.
+
+    Like the rate limiter, a breaker keeps no loop-bound state and can be shared across event loops.
+    """
+
+    def __init__(self, name: str = "", failure_threshold: int = 5, cooldown: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_started: float | None = None
+        # counters, for metrics
+        self._successes = 0
+        self._failures = 0
+        self._rejected = 0
+        self._times_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.cooldown:
+            self._state = HALF_OPEN
+            self._trial_started = None
+        return self._state
+
+    def allow(self) -> bool:
+        """True if a request may be sent now. in the half open state, only one trial at a time"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return True
+            # a trial that never reported back (e.g. it was cancelled) doesn't block the backend forever
+            if state == HALF_OPEN and (self._trial_started is None or now - self._trial_started >= self.cooldown):
+                self._trial_started = now
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._successes += 1
+            self._consecutive_failures = 0
+            if self._state != CLOSED:
+                logger.info("Circuit %s closed", self.name)
+            self._state = CLOSED
+            self._trial_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._consecutive_failures += 1
+            state = self._current_state(time.monotonic())
+            if state == HALF_OPEN or (state == CLOSED and self._consecutive_failures >= self.failure_threshold):
+                self._open()
+
+    def _open(self):
+        logger.warning("Circuit %s opened after %d consecutive failures; retrying in %.0fs",
+                       self.name, self._consecutive_failures, self.cooldown)
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._trial_started = None
+        self._times_opened += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._state = CLOSED
+            self._consecutive_failures = 0
+            self._trial_started = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self._current_state(time.monotonic()),
+                "consecutive_failures": self._consecutive_failures,
+                "successes": self._successes,
+                "failures": self._failures,
+                "rejected": self._rejected,
+                "times_opened": self._times_opened,
+            }
+
+
+# process-wide registry, so every FallbackLLM routing to the same backend sees the same outage
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_circuit_breaker(key: str, **kwargs) -> CircuitBreaker:
+    """returns the shared breaker for `key` (e.g. "nyu:gpt-4o-mini"), creating it on first use"""
+    with _registry_lock:
+        if key not in _breakers:
+            _breakers[key] = CircuitBreaker(name=key, **kwargs)
+        return _breakers[key]
+
+
+def configure_circuit_breaker(key: str, **kwargs) -> CircuitBreaker:
+    """replace the shared breaker for `key` with one built from `kwargs` (failure_threshold, cooldown)"""
+    with _registry_lock:
+        _breakers[key] = CircuitBreaker(name=key, **kwargs)
+        return _breakers[key]
+
+
+def circuit_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """stats of every shared breaker, by key"""
+    with _registry_lock:
+        breakers = dict(_breakers)
+    return {key: breaker.stats() for key, breaker in sorted(breakers.items())}
@@ -0,0 +1,284 @@
+import os
+import re
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Dict, Any, Tuple
+from pydantic import BaseModel, Field, PrivateAttr, ConfigDict, computed_field
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # windows: appends are only serialized within this process
+    fcntl = None
+
+from kruppe.llm import BaseEmbeddingModel
+from kruppe.models import Embeddable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "kruppe", "embeddings")
+
+
+def make_embedding_key(model: str, text: str) -> str:
+    """content address of an embedding: sha256 over model name and text"""
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class _VectorFile:
+    """append-only float32 file of fixed-size rows, read through a memory map"""
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self._map: np.memmap | None = None
+
+    def __len__(self) -> int:
+        return os.path.getsize(self.path) // self.row_bytes if os.path.exists(self.path) else 0
+
+    def append(self, vectors: np.ndarray, on_written: Callable[[int], None]) -> int:
+        """append rows, returns the row number of the first one. holds an exclusive lock on the file
+        until `on_written(first row)` returns, so other caches and processes writing to the same
+        file can't be handed the same rows before they are indexed"""
+        with open(self.path, "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX) # released when the file is closed
+            size = os.fstat(f.fileno()).st_size
+            if size % self.row_bytes:
+                # a crash mid-append left a partial row (writers hold the lock, so it isn't in flight); drop it
+                size -= size % self.row_bytes
+                f.truncate(size)
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+            start = size // self.row_bytes
+            on_written(start)
+        return start
+
+    def read(self, rows: List[int]) -> np.ndarray:
+        if self._map is None or max(rows) >= self._map.shape[0]:
+            # the file grew since it was mapped
+            self._map = np.memmap(self.path, dtype=np.float32, mode="r", shape=(len(self), self.dim))
+        return np.array(self._map[rows])
+
+
+class EmbeddingCache(BaseModel):
+    """
+    Persistent embedding cache, keyed by `make_embedding_key` (model name + text).
+
+    Vectors are appended to one float32 file per (model, dimension) in `directory` and read back
+    through a memory map. A sqlite index maps keys to rows. Recently used vectors are also kept
+    in an in-memory LRU of `lru_size` entries, for hot queries. Caches in other threads or
+    processes can share the directory: appends take a file lock until their rows are indexed.
+    Within a process, use `get_embedding_cache` to share one instance per directory.
+
+    Nothing is ever evicted from disk; delete the directory to start over. Setting `bypass` (or
+    env var KRUPPE_EMBEDDING_CACHE_BYPASS=1) skips lookups, but new embeddings are still written.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    directory: str = Field(default_factory=lambda: os.getenv("KRUPPE_EMBEDDING_CACHE_DIR", DEFAULT_EMBEDDING_CACHE_DIR))
+    lru_size: int = 10_000
+    bypass: bool = Field(default_factory=lambda: os.getenv("KRUPPE_EMBEDDING_CACHE_BYPASS", "") == "1")
+    _conn: sqlite3.Connection = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _files: Dict[Tuple[str, int], _VectorFile] = PrivateAttr(default_factory=dict)
+    _lru: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context):
+        os.makedirs(self.directory, exist_ok=True)
+        # embeddings can come from different threads (gradio, the background loop), so guard with our own lock
+        self._conn = sqlite3.connect(os.path.join(self.directory, "index.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                row INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    @computed_field
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @computed_field
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @computed_field
+    @property
+    def hit_rate(self) -> float:
+        total = self._hits + self._misses
+        return self._hits / total if total else 0.0
+
+    def _file(self, model: str, dim: int) -> _VectorFile:
+        if (model, dim) not in self._files:
+            name = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+            self._files[(model, dim)] = _VectorFile(os.path.join(self.directory, f"{name}-{dim}.f32"), dim)
+        return self._files[(model, dim)]
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def get_many(self, model: str, texts: List[str]) -> List[np.ndarray | None]:
+        """cached vectors for `texts`, None for misses"""
+        if self.bypass:
+            return [None] * len(texts)
+
+        keys = [make_embedding_key(model, text) for text in texts]
+        results: List[np.ndarray | None] = [None] * len(texts)
+        with self._lock:
+            on_disk = {}
+            for i, key in enumerate(keys):
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    results[i] = self._lru[key]
+                else:
+                    on_disk.setdefault(key, []).append(i)
+
+            # sqlite caps the number of parameters per statement, so look keys up in chunks
+            found = []
+            disk_keys = list(on_disk)
+            for j in range(0, len(disk_keys), 500):
+                chunk = disk_keys[j : j + 500]
+                found.extend(self._conn.execute(
+                    f"SELECT key, dim, row FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+
+            by_dim: Dict[int, List[Tuple[str, int]]] = {}
+            for key, dim, row in found:
+                by_dim.setdefault(dim, []).append((key, row))
+            for dim, entries in by_dim.items():
+                vectors = self._file(model, dim).read([row for _, row in entries])
+                for (key, _), vector in zip(entries, vectors):
+                    self._remember(key, vector)
+                    for i in on_disk[key]:
+                        results[i] = vector
+
+            hits = sum(r is not None for r in results)
+            self._hits += hits
+            self._misses += len(texts) - hits
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(texts):
+            return
+
+        keys = [make_embedding_key(model, text) for text in texts]
+        def index(start: int):
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, dim, row) VALUES (?, ?, ?, ?)",
+                [(key, model, vectors.shape[1], start + i) for i, key in enumerate(keys)],
+            )
+            self._conn.commit()
+
+        with self._lock:
+            # vectors go to disk before their index rows, so a crash leaves unused rows, never dangling keys
+            self._file(model, vectors.shape[1]).append(vectors, on_written=index)
+            for key, vector in zip(keys, vectors):
+                self._remember(key, vector)
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self.hit_rate,
+            "size": self.size(),
+            "lru_entries": len(self._lru),
+        }
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self._files.clear()
+
+
+# process-wide registry, so every CachedEmbeddingModel on the same directory shares one cache (and its LRU)
+_embedding_caches: Dict[str, EmbeddingCache] = {}
+_registry_lock = threading.Lock()
+
+
+def get_embedding_cache(directory: str | None = None) -> EmbeddingCache:
+    """returns the shared cache for `directory` (default: KRUPPE_EMBEDDING_CACHE_DIR or
+    DEFAULT_EMBEDDING_CACHE_DIR), opening it on first use"""
+    directory = os.path.abspath(directory or os.getenv("KRUPPE_EMBEDDING_CACHE_DIR", DEFAULT_EMBEDDING_CACHE_DIR))
+    with _registry_lock:
+        cache = _embedding_caches.get(directory)
+        if cache is None or cache._conn is None: # closed
+            cache = _embedding_caches[directory] = EmbeddingCache(directory=directory)
+        return cache
+
+
+class CachedEmbeddingModel(BaseEmbeddingModel):
+    """
+    Wraps any embedding model with an EmbeddingCache. Only texts that aren't cached are sent to
+    `embedding_model`, once each, so re-indexing an unchanged corpus makes no API calls.
+    """
+    embedding_model: BaseEmbeddingModel
+    cache: EmbeddingCache = Field(default_factory=get_embedding_cache)
+    model: str = None # taken from `embedding_model`
+
+    def model_post_init(self, __context):
+        if self.model is None:
+            self.model = self.embedding_model.model
+
+    @property
+    def embedding_dim(self) -> int | None:
+        return self.embedding_model.embedding_dim
+
+    @property
+    def output_space(self) -> str:
+        return self.embedding_model.output_space
+
+    def _lookup(self, text: List[str] | List[Embeddable]) -> Tuple[List[str], List[np.ndarray | None], List[str]]:
+        texts = [x.text if isinstance(x, Embeddable) else x for x in text]
+        cached = self.cache.get_many(self.output_space, texts)
+        missing = list(dict.fromkeys(t for t, vector in zip(texts, cached) if vector is None))
+        if missing:
+            logger.debug("Embedding cache: %d hits, embedding %d new texts", len(texts) - len(missing), len(missing))
+        return texts, cached, missing
+
+    def _fill(self, texts: List[str], cached: List[np.ndarray | None], missing: List[str], new_embeddings) -> np.ndarray:
+        if missing:
+            self.cache.put_many(self.output_space, missing, new_embeddings)
+            fresh = dict(zip(missing, np.asarray(new_embeddings, dtype=np.float32)))
+            cached = [vector if vector is not None else fresh[t] for t, vector in zip(texts, cached)]
+        return np.stack(cached)
+
+    def _empty(self) -> np.ndarray:
+        return np.empty((0, self.embedding_dim or 0), dtype=np.float32)
+
+    async def async_embed(self, text: List[str] | List[Embeddable]) -> np.ndarray:
+        if not text:
+            return self._empty()
+        texts, cached, missing = self._lookup(text)
+        new_embeddings = await self.embedding_model.async_embed(missing) if missing else []
+        return self._fill(texts, cached, missing, new_embeddings)
+
+    def embed(self, text: List[str] | List[Embeddable]) -> np.ndarray:
+        if not text:
+            return self._empty()
+        texts, cached, missing = self._lookup(text)
+        new_embeddings = self.embedding_model.embed(missing) if missing else []
+        return self._fill(texts, cached, missing, new_embeddings)
@@ -0,0 +1,91 @@
+import logging
+from typing import List
+from pydantic import PrivateAttr
+import numpy as np
+
+from kruppe.llm import BaseEmbeddingModel
+from kruppe.models import Embeddable
+
+logger = logging.getLogger(__name__)
+
+
+class PCAEmbeddingModel(BaseEmbeddingModel):
+    """
+    Wraps any embedding model with a PCA projection down to `dimensions`, fitted locally on a
+    sample of the corpus. Projected vectors are L2 normalized, so they can go in the same stores.
+
+    Works for models that can't shorten their own vectors (hashing, older api models). For
+    text-embedding-3 models the api's `dimensions` is cheaper and usually as good; see
+    `kruppe.vector_benchmark` to compare the two on your own data.
+
+    Call `fit` (or `load` a saved projection) before embedding.
+    """
+    embedding_model: BaseEmbeddingModel
+    dimensions: int = 256
+    model: str = None # taken from `embedding_model`
+    _mean: np.ndarray = PrivateAttr(default=None)
+    _components: np.ndarray = PrivateAttr(default=None) # (dimensions, input dim)
+
+    def model_post_init(self, __context):
+        if self.model is None:
+            self.model = self.embedding_model.model
+
+    @property
+    def output_space(self) -> str:
+        return f"{self.embedding_model.output_space}@pca{self.dimensions}"
+
+    @property
+    def fitted(self) -> bool:
+        return self._components is not None
+
+    def fit(self, text: List[str] | List[Embeddable] | np.ndarray) -> "PCAEmbeddingModel":
+        """fit the projection on texts, or on vectors already embedded by `embedding_model`"""
+        vectors = text if isinstance(text, np.ndarray) else self.embedding_model.embed(text)
+        return self._fit(vectors)
+
+    async def async_fit(self, text: List[str] | List[Embeddable] | np.ndarray) -> "PCAEmbeddingModel":
+        vectors = text if isinstance(text, np.ndarray) else await self.embedding_model.async_embed(text)
+        return self._fit(vectors)
+
+    def _fit(self, vectors: np.ndarray) -> "PCAEmbeddingModel":
+        vectors = np.asarray(vectors, dtype=np.float64)
+        if self.dimensions > min(vectors.shape):
+            raise ValueError(
+                f"can't fit {self.dimensions} components on {vectors.shape[0]} vectors of dim {vectors.shape[1]}"
+            )
+        self._mean = vectors.mean(axis=0)
+        # rows of vt are the principal directions, by decreasing variance
+        _, singular_values, vt = np.linalg.svd(vectors - self._mean, full_matrices=False)
+        self._components = np.ascontiguousarray(vt[: self.dimensions], dtype=np.float32)
+        kept = (singular_values[: self.dimensions] ** 2).sum() / (singular_values ** 2).sum()
+        logger.info("Fitted %d-dim PCA on %d vectors, keeping %.1f%% of the variance", self.dimensions, len(vectors), 100 * kept)
+        return self
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        """project vectors from `embedding_model` and L2 normalize them"""
+        if not self.fitted:
+            raise RuntimeError("PCAEmbeddingModel is not fitted; call fit() or load() first")
+        projected = (np.asarray(vectors, dtype=np.float32) - self._mean.astype(np.float32)) @ self._components.T
+        norms = np.linalg.norm(projected, axis=1, keepdims=True)
+        np.divide(projected, norms, out=projected, where=norms > 0)
+        return np.ascontiguousarray(projected, dtype=np.float32)
+
+    def save(self, path: str) -> None:
+        if not self.fitted:
+            raise RuntimeError("PCAEmbeddingModel is not fitted; nothing to save")
+        np.savez(path, mean=self._mean, components=self._components, space=self.embedding_model.output_space)
+
+    def load(self, path: str) -> "PCAEmbeddingModel":
+        data = np.load(path)
+        if str(data["space"]) != self.embedding_model.output_space:
+            logger.warning("Projection at %s was fitted on %s, not %s", path, data["space"], self.embedding_model.output_space)
+        self._mean = data["mean"]
+        self._components = data["components"]
+        self.dimensions = self._components.shape[0]
+        return self
+
+    def embed(self, text: List[str] | List[Embeddable]) -> np.ndarray:
+        return self.transform(self.embedding_model.embed(text))
+
+    async def async_embed(self, text: List[str] | List[Embeddable]) -> np.ndarray:
+        return self.transform(await self.embedding_model.async_embed(text))
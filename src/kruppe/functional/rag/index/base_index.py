@@ -33,6 +33,14 @@ class BaseIndex(ABC, BaseModel):
         """Query the index asynchronously."""
         pass
 
+    def query_batch(self, queries: List[Query | str], top_k: int = 3, filter: Dict[str, Any] = None) -> List[List[Chunk]]:
+        """Query the index with several queries at once. one result list per query"""
+        return [self.query(query, top_k, filter) for query in queries]
+
+    async def async_query_batch(self, queries: List[Query | str], top_k: int = 3, filter: Dict[str, Any] = None) -> List[List[Chunk]]:
+        """Query the index with several queries at once, asynchronously."""
+        return [await self.async_query(query, top_k, filter) for query in queries]
+
     @abstractmethod
     def generate(self, query: Query, top_k: int = 3, filter: Dict[str, Any] = None) -> Response:
         """Generate a response based on the query."""
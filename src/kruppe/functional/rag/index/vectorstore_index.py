@@ -1,9 +1,10 @@
 from typing import List, Dict, Any
 import logging
 from pydantic import PrivateAttr
-import asyncio
 
 from kruppe.llm import BaseEmbeddingModel
+from kruppe.background_loop import run_sync
+from kruppe.llm_telemetry import telemetry_tags
 from kruppe.functional.rag.index.base_index import BaseIndex
 from kruppe.models import Chunk, Document, Query, Response
 from kruppe.functional.rag.vectorstore.base_store import BaseVectorStore
@@ -59,6 +60,15 @@ class VectorStoreIndex(BaseIndex):
 
         return ret_chunks
     
+    def query_batch(self, queries: List[Query | str], top_k: int = 3, filter: Dict[str, Any] = None) -> List[List[Chunk]]:
+        # one embed call and one search call for all queries
+        query_vectors = self._embedder.embed(queries)
+        return self.vectorstore.search_batch(query_vectors, top_k=top_k, filter=filter)
+
+    async def async_query_batch(self, queries: List[Query | str], top_k: int = 3, filter: Dict[str, Any] = None) -> List[List[Chunk]]:
+        query_vectors = await self._embedder.async_embed(queries)
+        return await self.vectorstore.async_search_batch(query_vectors, top_k=top_k, filter=filter)
+
     async def async_generate(self, query: Query, top_k: int = 3, filter: Dict[str, Any] = None) -> Response:
         # retrieve relevant documents
         ret_chunks = await self.async_query(query, top_k=top_k, filter=filter)
@@ -69,10 +79,11 @@ class VectorStoreIndex(BaseIndex):
         messages = prompt_formatter.format_messages(user_prompt=query)
 
         # generate response and add sources
-        response = await self.llm.async_generate(messages)
+        with telemetry_tags(caller=self.__class__.__name__, template="rag_system_standard"):
+            response = await self.llm.async_generate(messages)
         response.sources = ret_chunks
 
         return response
     
     def generate(self, query: Query, top_k: int = 3, filter: Dict[str, Any] = None) -> Response:
-        return asyncio.run(self.async_generate(query, top_k=top_k, filter=filter))
\ No newline at end of file
+        return run_sync(self.async_generate(query, top_k=top_k, filter=filter))
\ No newline at end of file
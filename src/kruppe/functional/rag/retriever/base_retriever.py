@@ -17,4 +17,12 @@ class BaseRetriever(ABC, BaseModel):
     @abstractmethod
     async def async_retrieve(self, query: Query, filter: Dict[str, Any] = None) -> List[Document]:
         """Retrieve documents based on the query asynchronously."""
-        pass
\ No newline at end of file
+        pass
+
+    def retrieve_batch(self, queries: List[Query | str], filter: Dict[str, Any] = None) -> List[List[Document]]:
+        """Retrieve documents for several queries. one result list per query"""
+        return [self.retrieve(query, filter) for query in queries]
+
+    async def async_retrieve_batch(self, queries: List[Query | str], filter: Dict[str, Any] = None) -> List[List[Document]]:
+        """Retrieve documents for several queries asynchronously."""
+        return [await self.async_retrieve(query, filter) for query in queries]
\ No newline at end of file
@@ -4,6 +4,7 @@ import asyncio
 import re
 
 from kruppe.llm import BaseLLM
+from kruppe.llm_telemetry import telemetry_tags
 from kruppe.functional.rag.retriever.base_retriever import BaseRetriever
 from kruppe.models import Chunk, Query, Document
 from kruppe.prompts.rag import FUSION_GENERATE_QUERIES_USER, FUSION_GENERATE_QUERIES_SYSTEM
@@ -33,17 +34,15 @@ class QueryFusionRetriever(BaseRetriever):
             {"role": "user", "content": FUSION_GENERATE_QUERIES_USER.format(query=query, n=self.num_queries)},
             {"role": "system", "content": FUSION_GENERATE_QUERIES_SYSTEM}
         ]
-        llm_response = self.llm.generate(messages)
+        with telemetry_tags(caller=self.__class__.__name__, template="FUSION_GENERATE_QUERIES_USER"):
+            llm_response = self.llm.generate(messages)
         queries = re.split(r'\n+', llm_response.text.strip())
 
         assert len(queries) == self.num_queries
 
-        # retrieve chunks (list of list of chunks)
-        retrieved_chunks = [
-            retriever.retrieve(query=gen_query, filter=filter)
-            for gen_query in queries
-            for retriever in self.retrievers
-        ]
+        # retrieve chunks (list of list of chunks), all generated queries in one batch per retriever
+        per_retriever = [retriever.retrieve_batch(queries, filter=filter) for retriever in self.retrievers]
+        retrieved_chunks = [results[i] for i in range(len(queries)) for results in per_retriever]
         return self.fusion_method(retrieved_chunks)[:self.top_k]
     
     async def async_retrieve(self, query: Query | str, filter: Dict[str, Any] = None) -> List[Document]:
@@ -55,19 +54,20 @@ class QueryFusionRetriever(BaseRetriever):
             {"role": "user", "content": FUSION_GENERATE_QUERIES_USER.format(query=query, n=self.num_queries)},
             {"role": "system", "content": FUSION_GENERATE_QUERIES_SYSTEM}
         ]
-        llm_response = await self.llm.async_generate(messages)
+        with telemetry_tags(caller=self.__class__.__name__, template="FUSION_GENERATE_QUERIES_USER"):
+            llm_response = await self.llm.async_generate(messages)
         queries = re.split(r'\n+', llm_response.text.strip())
 
         assert len(queries) == self.num_queries
 
-        # retrieve documents
+        # retrieve documents, all generated queries in one batch per retriever
         async with asyncio.TaskGroup() as tg:
             tasks = [
-                tg.create_task(retriever.async_retrieve(query=gen_query, filter=filter))
-                for gen_query in queries
+                tg.create_task(retriever.async_retrieve_batch(queries, filter=filter))
                 for retriever in self.retrievers
             ]
-        retrieved_chunks = [t.result() for t in tasks]
+        per_retriever = [t.result() for t in tasks]
+        retrieved_chunks = [results[i] for i in range(len(queries)) for results in per_retriever]
         
         # rerank documents
         return self.fusion_method(retrieved_chunks)[:self.top_k]
@@ -13,4 +13,10 @@ class SimpleRetriever(BaseRetriever):
         return self.index.query(query, self.top_k, filter)
 
     async def async_retrieve(self, query: Query, filter: Dict[str, Any] = None) -> List[Document]:
-        return await self.index.async_query(query, self.top_k, filter)
\ No newline at end of file
+        return await self.index.async_query(query, self.top_k, filter)
+
+    def retrieve_batch(self, queries: List[Query | str], filter: Dict[str, Any] = None) -> List[List[Document]]:
+        return self.index.query_batch(queries, self.top_k, filter)
+
+    async def async_retrieve_batch(self, queries: List[Query | str], filter: Dict[str, Any] = None) -> List[List[Document]]:
+        return await self.index.async_query_batch(queries, self.top_k, filter)
\ No newline at end of file
@@ -1,13 +1,18 @@
-import asyncio
 from pydantic import BaseModel, PrivateAttr
 from abc import ABC, abstractmethod
 from typing import List
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from kruppe.llm import BaseLLM
+from kruppe.background_loop import run_sync
+from kruppe.llm_batch import BatchLLM
+from kruppe.llm_telemetry import telemetry_tags
 from kruppe.models import Document, Chunk
-from kruppe.prompt_formatter import CustomPromptFormatter
-from kruppe.prompts.rag import SPLITTER_CONTEXTUALIZE_USER
+from kruppe.prompts.rag import (
+    SPLITTER_CONTEXTUALIZE_SYSTEM,
+    SPLITTER_CONTEXTUALIZE_DOCUMENT,
+    SPLITTER_CONTEXTUALIZE_CHUNK,
+)
 
 
 class BaseTextSplitter(ABC, BaseModel):
@@ -77,6 +82,7 @@ class RecursiveTextSplitter(BaseTextSplitter):
 class ContextualTextSplitter(BaseTextSplitter):
     """defunct - add context using ContextualVectorStoreIndex instead"""
     llm: BaseLLM
+    warm_prompt_cache: bool = True # contextualize the first chunk of each document before the rest
     _text_splitter = PrivateAttr()
 
     def model_post_init(self, __context):
@@ -100,36 +106,55 @@ class ContextualTextSplitter(BaseTextSplitter):
         Returns:
             List[ContextualizedChunk]: the list of chunked texts
         """
-        # create a prompt formatter to format the messages for the llm
-        prompt_formatter = CustomPromptFormatter(
-            prompt_template=SPLITTER_CONTEXTUALIZE_USER
-        )
-         
-        # for document in documents:
-        
-        async def split_document_helper(document: Document) -> List[Chunk]:
-            document_chunks = []  # list of Chunk objects, each representing a chunk of the document
-
-            chunked_texts = self._text_splitter.split_text(document.text)
-
-            # generate the message to contextualize the chunks using llm
-            messages_list = []
+        # generate the message to contextualize every chunk of every document, so the llm
+        # gets all of them in one batch (one provider batch job when llm is a BatchLLM).
+        # instructions and whole document go first, so all chunks of a document share a prompt prefix
+        chunked_texts_list = [self._text_splitter.split_text(document.text) for document in documents]
+        messages_list = []
+        first_chunk_idx = [] # index of the first request of each document
+        for document, chunked_texts in zip(documents, chunked_texts_list):
+            first_chunk_idx.append(len(messages_list))
+            document_message = {
+                "role": "user",
+                "content": SPLITTER_CONTEXTUALIZE_DOCUMENT.format(WHOLE_DOCUMENT=document.text),
+            }
             for chunked_text in chunked_texts:
-                messages = prompt_formatter.format_messages(
-                    WHOLE_DOCUMENT=document.text,
-                    CHUNK_CONTENT=chunked_text,
-                )
+                messages = [
+                    {"role": "system", "content": SPLITTER_CONTEXTUALIZE_SYSTEM},
+                    document_message,
+                    {"role": "user", "content": SPLITTER_CONTEXTUALIZE_CHUNK.format(CHUNK_CONTENT=chunked_text)},
+                ]
                 messages_list.append(messages)
 
-            # generate the context for each chunk using the llm
-            contexts_list = await self.llm.batch_async_generate(messages_list)
-
-            # create a Chunk object for each chunked text and link them together
+        # generate the context for each chunk using the llm
+        with telemetry_tags(caller=self.__class__.__name__, template="SPLITTER_CONTEXTUALIZE"):
+            if self.warm_prompt_cache and not isinstance(self.llm, BatchLLM):
+                # the provider only caches a prefix once a request with it has finished, so send the
+                # first chunk of each document ahead of the rest (batch jobs are discounted anyway)
+                warm_idx = set(first_chunk_idx[i] for i, texts in enumerate(chunked_texts_list) if texts)
+                rest_idx = [i for i in range(len(messages_list)) if i not in warm_idx]
+                warm_idx = sorted(warm_idx)
+
+                contexts_list = [None] * len(messages_list)
+                for indices in (warm_idx, rest_idx):
+                    if not indices:
+                        continue
+                    responses = await self.llm.batch_async_generate([messages_list[i] for i in indices])
+                    for i, response in zip(indices, responses):
+                        contexts_list[i] = response
+            else:
+                contexts_list = await self.llm.batch_async_generate(messages_list)
+
+        # create a Chunk object for each chunked text and link them together
+        new_chunks = []
+        context_idx = 0
+        for document, chunked_texts in zip(documents, chunked_texts_list):
             prev_chunk = None
-            for i in range(0, len(chunked_texts)):
-                context_text = contexts_list[i].text
+            for chunked_text in chunked_texts:
+                context_text = contexts_list[context_idx].text
+                context_idx += 1
                 curr_chunk = Chunk(
-                    text= "-CONTEXT-\n"+context_text+"\n-TEXT-\n"+chunked_texts[i], # NOTE: THIS STEP COMBINES CONTEXT WITH CHUNK
+                    text= "-CONTEXT-\n"+context_text+"\n-TEXT-\n"+chunked_text, # NOTE: THIS STEP COMBINES CONTEXT WITH CHUNK
                     metadata=document.metadata,
                     document_id=document.id,
                     prev_chunk_id=prev_chunk.id if prev_chunk is not None else None,
@@ -139,13 +164,8 @@ class ContextualTextSplitter(BaseTextSplitter):
                 if prev_chunk is not None:
                     prev_chunk.next_chunk_id = curr_chunk.id
                 prev_chunk = curr_chunk
-                document_chunks.append(curr_chunk)
-            return document_chunks
-
-        # NOTE: i'm not sure doing it this way is actually faster, but eh it's worth a shot
-        new_chunks = await asyncio.gather(*[split_document_helper(document) for document in documents])
-        new_chunks = [chunk for sublist in new_chunks for chunk in sublist] # flatten the list of lists
+                new_chunks.append(curr_chunk)
         return new_chunks
     
     def split_documents(self, documents: List[Document]) -> List[Chunk]:
-        return asyncio.run(self.async_split_documents(documents))
\ No newline at end of file
+        return run_sync(self.async_split_documents(documents))
\ No newline at end of file
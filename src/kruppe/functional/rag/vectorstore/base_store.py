@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 from pydantic import BaseModel, ConfigDict
 from typing import List, Dict, Any
+import numpy as np
 
 from kruppe.models import Document, Chunk
 from kruppe.llm import BaseEmbeddingModel
@@ -11,6 +12,20 @@ class BaseVectorStore(ABC, BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True)
 
     embedding_model: BaseEmbeddingModel
+    dimension: int | None = None # size of the stored vectors, recorded on the first insert
+
+    def _check_dimension(self, embeddings: np.ndarray) -> None:
+        """record the dimension of the first vectors inserted, and refuse vectors of any other size"""
+        dim = np.shape(embeddings)[-1] if len(embeddings) else None
+        if dim is None:
+            return
+        if self.dimension is None:
+            self.dimension = dim
+        elif dim != self.dimension:
+            raise ValueError(
+                f"{self.__class__.__name__} holds {self.dimension}-dim vectors, "
+                f"got {dim}-dim vectors from {self.embedding_model.output_space}"
+            )
 
     @abstractmethod
     def size(self) -> int:
@@ -28,15 +43,22 @@ class BaseVectorStore(ABC, BaseModel):
         pass
 
     @abstractmethod
-    def search(self, vector: List[float], top_k: int = 3, filter: Dict[str, Any] = None) -> List[Chunk]:
-        """given vector, return top_k relevant results"""
+    def search(self, vector: List[float] | np.ndarray, top_k: int = 3, filter: Dict[str, Any] = None) -> List[Chunk]:
+        """given vector (a list or a float32 array from the embedding model), return top_k relevant results"""
         pass
 
     @abstractmethod
-    async def async_search(self, vector: List[float], top_k: int = 3, filter: Dict[str, Any] = None) -> List[Chunk]:
+    async def async_search(self, vector: List[float] | np.ndarray, top_k: int = 3, filter: Dict[str, Any] = None) -> List[Chunk]:
         """given query, asynchronously return top_k relevant results"""
         pass
 
+    def search_batch(self, vectors: List[List[float]] | np.ndarray, top_k: int = 3, filter: Dict[str, Any] = None) -> List[List[Chunk]]:
+        """top_k results for each of several query vectors. stores override this with one native call"""
+        return [self.search(vector, top_k, filter) for vector in vectors]
+
+    async def async_search_batch(self, vectors: List[List[float]] | np.ndarray, top_k: int = 3, filter: Dict[str, Any] = None) -> List[List[Chunk]]:
+        return self.search_batch(vectors, top_k, filter)
+
     @abstractmethod
     def remove_documents(self, ids: List[int]) -> int:
         """remove documents by their ids"""
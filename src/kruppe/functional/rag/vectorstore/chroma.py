@@ -1,6 +1,6 @@
 import numpy as np
 from uuid import UUID
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any
 from pydantic import Field, PrivateAttr, model_validator
 from typing import Optional
 import chromadb
@@ -59,6 +59,7 @@ class ChromaVectorStore(BaseVectorStore):
                 [document.text for document in documents]
             ),
         }
+        self._check_dimension(data["embeddings"])
 
         for document in documents:
             # unique id for each document/chunk
@@ -91,6 +92,7 @@ class ChromaVectorStore(BaseVectorStore):
         embeddings = await self.embedding_model.async_embed(
             [document.text for document in documents]
         )
+        self._check_dimension(embeddings)
 
         # insert data into chromadb
         data = {
@@ -129,20 +131,30 @@ class ChromaVectorStore(BaseVectorStore):
 
         return data["ids"]
 
-    def search(self, vector: List[float], top_k: int = 3, filter: Dict[str, Any] = None) -> Tuple[List[Chunk], List[int]]:
+    def search(self, vector: List[float], top_k: int = 3, filter: Dict[str, Any] = None) -> List[Chunk]:
+        return self.search_batch([vector], top_k=top_k, filter=filter)[0]
+
+    def search_batch(self, vectors: List[List[float]], top_k: int = 3, filter: Dict[str, Any] = None) -> List[List[Chunk]]:
+        """all query vectors in one chroma query"""
         if filter == {}: 
             # apparently chroma doesn't like empty filters
             filter = None
 
         results = self._collection.query(
-            query_embeddings=[vector],
+            query_embeddings=list(vectors),
             n_results=top_k,
             where=filter
         )
 
+        return [
+            self._to_chunks(texts, ids, metadatas, distances)
+            for texts, ids, metadatas, distances in zip(results["documents"], results["ids"], results["metadatas"], results["distances"])
+        ]
+
+    def _to_chunks(self, texts: List[str], ids: List[str], metadatas: List[Dict[str, Any]], distances: List[float]) -> List[Chunk]:
         retrieved_docs = [] # chunks, really - im treating docs like chunks
-        similarity_scores = distance_to_similarity(results["distances"][0]) # NOTE: chroma by default returns L2 norm or euclidean distance
-        for res_text, res_id, res_metadata, res_score in zip(results["documents"][0], results["ids"][0], results["metadatas"][0], similarity_scores):
+        similarity_scores = distance_to_similarity(distances) # NOTE: chroma by default returns L2 norm or euclidean distance
+        for res_text, res_id, res_metadata, res_score in zip(texts, ids, metadatas, similarity_scores):
             document_id = res_metadata.pop("document_id", res_id) # if no document_id, then chunk_id is document_id
             
             # get prev_chunk_id and next_chunk_id if they exist
@@ -170,6 +182,10 @@ class ChromaVectorStore(BaseVectorStore):
         """Falls back to synchronous search"""
         return self.search(vector=vector, top_k=top_k, filter=filter)
 
+    async def async_search_batch(self, vectors: List[List[float]], top_k: int = 3, filter: Dict[str, Any] = None) -> List[List[Chunk]]:
+        """Falls back to synchronous search_batch"""
+        return self.search_batch(vectors=vectors, top_k=top_k, filter=filter)
+
     def remove_documents(self, ids):
         # TODO: update text hashes
 
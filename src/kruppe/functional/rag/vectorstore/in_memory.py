@@ -1,12 +1,18 @@
-import asyncio
+import os
 import numpy as np
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Any
 import logging
 from pydantic import Field, PrivateAttr
 import pickle
 
-from kruppe.llm import OpenAIEmbeddingModel
+from kruppe import llm as llm_module
+from kruppe.llm import BaseEmbeddingModel, OpenAIEmbeddingModel
+from kruppe.background_loop import run_sync
 from kruppe.functional.rag.vectorstore.base_store import BaseVectorStore
+from kruppe.functional.rag.vectorstore.metadata_columns import MetadataColumns
+from kruppe.functional.rag.vectorstore.ivf import IVFIndex
+from kruppe.functional.rag.vectorstore.quantization import BaseQuantizer
+from kruppe.functional.rag.vectorstore import store_directory
 from kruppe.models import Chunk, Document
 
 logger = logging.getLogger(__name__)
@@ -20,49 +26,274 @@ def cosine_similarity(a: np.ndarray, b: np.ndarray):
     return np.dot(a, b.T) / norm_product
 
 
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2 normalize rows in place (zero rows stay zero) and return them"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def scored_chunk(document: Document, score: float) -> Chunk:
+    """copy of a stored document as a Chunk with `score` set (a whole document is its own chunk)"""
+    if isinstance(document, Chunk):
+        return document.model_copy(update={"score": score})
+    return Chunk(text=document.text, id=document.id, metadata=document.metadata, document_id=document.id, score=score)
+
+
+class StackedRows:
+    """
+    Read-only rows of `base` followed by the rows of `tail`, without copying them into one array.
+    A store opened with `load` keeps its loaded rows memory-mapped (`base`) and new rows in
+    memory (`tail`). Supports what the store, IVFIndex and the quantizers need: len/shape,
+    slices and row-index arrays (both return arrays), and np.asarray (a full copy).
+    """
+
+    def __init__(self, base: np.ndarray, tail: np.ndarray):
+        self.base, self.tail = base, tail
+        self.shape = (len(base) + len(tail), base.shape[1])
+        self.dtype = base.dtype
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    @property
+    def segments(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.base, self.tail
+
+    def __getitem__(self, index) -> np.ndarray:
+        n = len(self.base)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1 and stop <= n:
+                return self.base[start:stop]
+            if step == 1 and start >= n:
+                return self.tail[start - n : stop - n]
+            index = np.arange(start, stop, step)
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+        rows = np.empty((len(index), self.shape[1]), dtype=self.dtype)
+        in_base = index < n
+        rows[in_base] = self.base[index[in_base]]
+        rows[~in_base] = self.tail[index[~in_base] - n]
+        return rows
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        return np.concatenate(self.segments).astype(dtype or self.dtype, copy=False)
+
+
 class InMemoryVectorStore(BaseVectorStore):
+    """
+    Keeps embeddings in one float32 buffer whose capacity doubles as it fills, so inserting
+    documents one at a time is amortized O(1). Rows are normalized once on insert, so a search is
+    a single matrix-vector product plus an O(n) top-k selection.
+
+    Metadata is also kept as columns (see MetadataColumns), so Mongo-style filters such as
+    `{"publication_time": {"$gte": t}}` are a boolean mask applied before the top-k selection.
+
+    For large stores, pass an IVFIndex as `ivf` to search only the nearest clusters instead of
+    every row (approximate; tune its `nlist`/`nprobe`). It is trained in the background once the
+    store is big enough, and exact search is used until then.
+
+    To cut memory, pass a `quantizer` (ScalarQuantizer: int8, 4x smaller; ProductQuantizer: 32x
+    smaller by default). Once the store reaches its `min_train_size`, every row is also kept as a
+    compressed code and searches score the codes directly. With `rerank`, that many of the best
+    candidates are rescored with the full-precision rows. The codes are kept on top of those rows,
+    so a store built in this process holds more memory, not less, until its rows are on disk:
+    open it with `load(..., mmap=True)` or call `save(..., release=True)`, and only the codes
+    (plus rows inserted since) stay resident.
+
+    `save` writes a directory (see store_directory) that `load` opens memory-mapped, so loading
+    is near-instant and documents are parsed when first returned. The loaded rows stay on disk:
+    documents inserted afterwards go to an in-memory buffer after them, and saving again to the
+    same directory only appends those. Removing documents copies the remaining rows into memory.
+    """
     documents: List[Document] = Field(default=[])
-    _embeddings_matrix: np.ndarray = PrivateAttr(default=None)
+    initial_capacity: int = 1024
+    ivf: IVFIndex | None = None # approximate search; not saved, retrained after `load`
+    quantizer: BaseQuantizer | None = None # compressed codes; not saved, re-encoded on `load`
+    rerank: int = 0 # candidates rescored with full-precision rows when quantized
+    _base: np.ndarray | None = PrivateAttr(default=None) # rows memory-mapped by `load`, read-only
+    _buffer: np.ndarray = PrivateAttr(default=None) # (capacity, dim), rows after `_base`; rows past `size()` are unused
+    _codes: np.ndarray | None = PrivateAttr(default=None) # (capacity, code size), rows past `_coded` are unused
+    _coded: int = PrivateAttr(default=0)
+    _metadata: MetadataColumns = PrivateAttr(default_factory=MetadataColumns)
+    _saved: Tuple[str, int] | None = PrivateAttr(default=None) # (directory, count) this store matches on disk
+
+    def size(self) -> int:
+        return len(self.documents)
+
+    @property
+    def _base_rows(self) -> int:
+        return 0 if self._base is None else len(self._base)
+
+    @property
+    def _embeddings_matrix(self) -> np.ndarray | StackedRows | None:
+        """normalized embeddings of `documents`: a view into the buffer, or the memory-mapped rows
+        from `load` stacked with the buffer"""
+        tail = None if self._buffer is None else self._buffer[: len(self.documents) - self._base_rows]
+        if self._base is None:
+            return tail
+        if tail is None or len(tail) == 0:
+            return self._base
+        return StackedRows(self._base, tail)
+
+    def _segments(self) -> List[np.ndarray]:
+        """the embeddings as consecutive arrays, to score without concatenating them"""
+        matrix = self._embeddings_matrix
+        return list(matrix.segments) if isinstance(matrix, StackedRows) else [matrix]
+
+    def clear(self) -> None:
+        self.documents = []
+        self._base = None
+        self._buffer = None
+        self._metadata.clear()
+        self.dimension = None
+        self._saved = None
+        self._codes, self._coded = None, 0
+        if self.ivf is not None:
+            self.ivf.clear()
+        if self.quantizer is not None:
+            self.quantizer.clear()
+
+    def _append(self, embeddings: np.ndarray, documents: List[Document]) -> List[int]:
+        """add documents with their embeddings (normalized into the buffer, which grows if needed)
+        and metadata columns, returns their ids"""
+        self._check_dimension(embeddings)
+        start = len(self.documents)
+        end = start + len(embeddings)
+        # buffer rows come after the memory-mapped ones, which are never copied in
+        offset = self._base_rows
+        if self._buffer is None or end - offset > self._buffer.shape[0]:
+            capacity = max(self.initial_capacity, end - offset, 0 if self._buffer is None else 2 * self._buffer.shape[0])
+            buffer = np.empty((capacity, embeddings.shape[1]), dtype=np.float32)
+            if self._buffer is not None:
+                buffer[: start - offset] = self._buffer[: start - offset]
+            self._buffer = buffer
+        self._buffer[start - offset : end - offset] = embeddings
+        normalize_rows(self._buffer[start - offset : end - offset])
+        self._metadata.reserve(offset + self._buffer.shape[0])
+        self._metadata.append([document.metadata for document in documents])
+        self.documents.extend(documents)
+        self._encode_new_rows()
+        if self.ivf is not None:
+            self.ivf.add(self._embeddings_matrix)
+        return list(range(start, end))
+
+    def _encode_new_rows(self):
+        """train the quantizer once there are enough rows, then keep the codes up to date"""
+        quantizer, size = self.quantizer, len(self.documents)
+        if quantizer is None or size == self._coded:
+            return
+        if not quantizer.trained:
+            if size < quantizer.min_train_size:
+                return
+            quantizer.fit(self._embeddings_matrix)
+            logger.info("Trained %s on %d rows", quantizer.__class__.__name__, size)
+        codes = quantizer.encode(self._embeddings_matrix[self._coded :])
+        if self._codes is None or size > self._codes.shape[0]:
+            capacity = max(self.initial_capacity, size, 0 if self._codes is None else 2 * self._codes.shape[0])
+            grown = np.empty((capacity, codes.shape[1]), dtype=codes.dtype)
+            if self._codes is not None:
+                grown[: self._coded] = self._codes[: self._coded]
+            self._codes = grown
+        self._codes[self._coded : size] = codes
+        self._coded = size
+
+    @property
+    def _quantized(self) -> bool:
+        return self.quantizer is not None and self.quantizer.trained and self._coded == len(self.documents)
 
     def insert_documents(self, documents: List[Document]):
-        return asyncio.run(self.async_insert_documents(documents))
+        return run_sync(self.async_insert_documents(documents))
 
     async def async_insert_documents(self, documents: List[Document]):
-        embeddings = await self.embedding_model.async_embed(documents)
-        if self._embeddings_matrix is None:
-            self._embeddings_matrix = np.array(embeddings)
-            ids = list(range(len(documents)))
+        if not documents:
+            return []
+        embeddings = np.asarray(await self.embedding_model.async_embed(documents), dtype=np.float32)
+        return self._append(embeddings, documents)
+
+    def _top_k(self, vectors: np.ndarray, top_k: int, filter: Dict[str, Any] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(indices, scores) of the top_k rows matching `filter` for each query, best first,
+        both (n queries, k); k can be less than top_k if few rows match"""
+        n_queries = len(vectors)
+        mask = self._metadata.mask(filter) if filter else None
+        top_k = min(top_k, len(self.documents) if mask is None else int(mask.sum()))
+        if top_k == 0:
+            return np.empty((n_queries, 0), dtype=np.int64), np.empty((n_queries, 0), dtype=np.float32)
+
+        # rows are unit length, so cosine similarity is a dot product with the normalized queries
+        queries = normalize_rows(np.array(vectors, dtype=np.float32).reshape(n_queries, -1))
+        final_k = top_k
+        prepared, score = None, None
+        if self._quantized:
+            # score the compressed codes (query kept full precision), keeping extra candidates to rerank
+            top_k = min(max(top_k, self.rerank), len(self.documents) if mask is None else int(mask.sum()))
+            prepared = self.quantizer.prepare(queries)
+            score = lambda rows, i: self.quantizer.scores(self._codes[rows], prepared[i : i + 1])[0]
+
+        approximate = self.ivf.search(self._embeddings_matrix, queries, top_k, mask, score=score) if self.ivf is not None else None
+        if approximate is None:
+            top_indices, top_scores = self._exact_top_k(queries, top_k, mask, prepared)
         else:
-            self._embeddings_matrix = np.concatenate(
-                (self._embeddings_matrix, np.array(embeddings)), axis=0
-            )
-            ids = list(range(len(self.documents), len(documents) + len(self.documents)))
+            top_indices = np.empty((n_queries, top_k), dtype=np.int64)
+            top_scores = np.empty((n_queries, top_k), dtype=np.float32)
+            for i, (rows, scores) in enumerate(approximate):
+                if rows is None:
+                    # too few matching rows in the probed lists (a selective filter); search this one exactly
+                    one = None if prepared is None else prepared[i : i + 1]
+                    rows, scores = (a[0] for a in self._exact_top_k(queries[i : i + 1], top_k, mask, one))
+                top_indices[i], top_scores[i] = rows, scores
 
-        self.documents.extend(documents)
-        return ids
+        if prepared is not None and self.rerank:
+            return self._rerank(queries, top_indices, final_k)
+        return top_indices, top_scores
 
-    def search(self, vector: List[float], top_k: int = 3) -> Tuple[List[Chunk], List[int]]:
-        top_k = min(top_k, len(self.documents))
-        if top_k == 0:
-            return []
+    def _rerank(self, queries: np.ndarray, candidates: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """rescore candidate rows with the full-precision rows (read from disk if memory-mapped)"""
+        top_indices = np.empty((len(queries), top_k), dtype=np.int64)
+        top_scores = np.empty((len(queries), top_k), dtype=np.float32)
+        for i, (query, rows) in enumerate(zip(queries, candidates)):
+            rows = np.sort(rows) # sequential reads
+            scores = self._embeddings_matrix[rows] @ query
+            order = np.argsort(-scores)[:top_k]
+            top_indices[i], top_scores[i] = rows[order], scores[order]
+        return top_indices, top_scores
 
-        # Convert input vector to a numpy array if needed
-        vector = np.array(vector).reshape(1, -1)
+    def _exact_top_k(self, queries: np.ndarray, top_k: int, mask: np.ndarray | None,
+                     prepared: np.ndarray | None = None) -> Tuple[np.ndarray, np.ndarray]:
+        """top_k over every row; from the codes when `prepared` queries are given"""
+        if prepared is None:
+            # memory-mapped and in-memory rows scored separately, never concatenated
+            scores = np.concatenate([queries @ segment.T for segment in self._segments()], axis=1)
+        else:
+            scores = self.quantizer.scores(self._codes[: self._coded], prepared)
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+        top_indices = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        top_scores = np.take_along_axis(scores, top_indices, axis=1)
+        order = np.argsort(-top_scores, axis=1) # only the top k need sorting
+        return np.take_along_axis(top_indices, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
 
-        similarity_scores = cosine_similarity(vector, self._embeddings_matrix)[0]
-        similarity_scores = np.nan_to_num(
-            similarity_scores, nan=-np.inf
-        )  # treat nan values as -inf
-        sorted_indices = np.argsort(similarity_scores)[::-1]  # sort in descending order
-        top_indices = sorted_indices[:top_k]  # get top k indices
+    def search(self, vector: List[float] | np.ndarray, top_k: int = 3, filter: Dict[str, Any] = None) -> List[Chunk]:
+        return self.search_batch([vector], top_k, filter)[0]
 
-        documents = [self.documents[index] for index in top_indices]
-        # NOTE: not sure if the next line is right, double check
-        distances = [similarity_scores[index] for index in top_indices] 
-        return documents, distances
+    async def async_search(self, vector: List[float] | np.ndarray, top_k: int = 3, filter: Dict[str, Any] = None) -> List[Chunk]:
+        return self.search(vector, top_k, filter)
 
-    async def async_search(self, vector: List[float], top_k: int = 3) -> Tuple[List[Chunk], List[int]]:
-        return self.search(vector, top_k)
+    def search_batch(self, vectors: List[List[float]] | np.ndarray, top_k: int = 3, filter: Dict[str, Any] = None) -> List[List[Chunk]]:
+        """all queries scored in one matrix multiply; results are copies of the documents with `score` set"""
+        if len(vectors) == 0 or not self.documents:
+            return [[] for _ in vectors]
+
+        top_indices, top_scores = self._top_k(vectors, top_k, filter)
+        return [
+            [scored_chunk(self.documents[index], float(score)) for index, score in zip(indices, scores)]
+            for indices, scores in zip(top_indices, top_scores)
+        ]
+
+    async def async_search_batch(self, vectors: List[List[float]] | np.ndarray, top_k: int = 3, filter: Dict[str, Any] = None) -> List[List[Chunk]]:
+        return self.search_batch(vectors, top_k, filter)
 
     def remove_documents(self, ids: List[int]):
         # TODO: update text hashes
@@ -70,17 +301,106 @@ class InMemoryVectorStore(BaseVectorStore):
         mask = np.ones(len(self.documents), dtype=bool)
         mask[ids] = False
         original_size = len(self.documents)
+        kept = self._embeddings_matrix[mask]
         self.documents = [doc for doc, keep in zip(self.documents, mask) if keep]
-        self._embeddings_matrix = self._embeddings_matrix[mask]
+        if self._base is None:
+            self._buffer[: len(kept)] = kept # compact in place, capacity is kept
+        else:
+            # the memory-mapped rows are read-only: the remaining rows move into memory
+            self._base, self._buffer = None, np.asarray(kept)
+        self._metadata.compact(mask)
+        if self._coded:
+            self._codes[: len(self.documents)] = self._codes[: self._coded][mask]
+            self._coded = len(self.documents)
+        self._saved = None
+        if self.ivf is not None:
+            self.ivf.compact(mask)
         return original_size - len(self.documents)
 
+    def save(self, directory: str, release: bool = False) -> None:
+        """write the store to `directory`; appends only the new documents if it was last saved
+        to (or loaded from) the same directory and nothing was removed since. with `release`, the
+        rows are then memory-mapped from the file and the in-memory buffer is freed, as after `load`"""
+        directory = os.path.abspath(directory)
+        os.makedirs(directory, exist_ok=True)
+        count = len(self.documents)
+        embeddings_path = os.path.join(directory, store_directory.EMBEDDINGS)
+
+        if self._saved is not None and self._saved[0] == directory and self._saved[1] <= count:
+            saved = self._saved[1]
+            if count > saved:
+                store_directory.append_npy(embeddings_path, self._embeddings_matrix[saved:])
+                store_directory.append_documents(directory, self.documents[saved:count], saved)
+        else:
+            # fresh files; unlink first so anything still memory-mapping the old ones keeps them
+            for name in (store_directory.EMBEDDINGS, store_directory.DOCUMENTS, store_directory.OFFSETS):
+                if os.path.exists(os.path.join(directory, name)):
+                    os.remove(os.path.join(directory, name))
+            matrix = self._embeddings_matrix
+            store_directory.write_npy(embeddings_path, matrix if matrix is not None else np.empty((0, self.dimension or 0)))
+            store_directory.append_documents(directory, self.documents[:count], 0)
+
+        metadata_path = os.path.join(directory, store_directory.METADATA)
+        with open(metadata_path + ".tmp", "wb") as f:
+            np.savez(f, **self._metadata.to_arrays())
+        os.replace(metadata_path + ".tmp", metadata_path)
+        store_directory.write_manifest(directory, {
+            "count": count,
+            "dimension": self.dimension,
+            "embedding_model": self.embedding_model.__class__.__name__,
+            "output_space": self.embedding_model.output_space,
+        })
+        self._saved = (directory, count)
+        if release and count:
+            self._base, self._buffer = np.load(embeddings_path, mmap_mode="r")[:count], None
+
+    @classmethod
+    def load(cls, directory: str, embedding_model: BaseEmbeddingModel = None, mmap: bool = True, ivf: IVFIndex = None,
+             quantizer: BaseQuantizer = None, rerank: int = 0) -> "InMemoryVectorStore":
+        """open a store written by `save`. with `mmap`, embeddings are paged in from disk on demand
+        (and stay there: new documents are held in memory after them). codes aren't saved: a
+        `quantizer` is trained (unless it already is) and encodes the rows here.
+        without `embedding_model`, the recorded kruppe.llm model class is rebuilt with its defaults;
+        raises ValueError if that can't be done, or if the model doesn't embed into the store's space"""
+        directory = os.path.abspath(directory)
+        manifest = store_directory.read_manifest(directory)
+        if embedding_model is None:
+            # only the class name is recorded, not its settings (e.g. `dimensions`), so the space is checked below
+            embedding_class = getattr(llm_module, manifest["embedding_model"], None)
+            if not (isinstance(embedding_class, type) and issubclass(embedding_class, BaseEmbeddingModel)):
+                raise ValueError(f"Can't rebuild {manifest['embedding_model']} for {directory}, pass `embedding_model`")
+            embedding_model = embedding_class()
+        if embedding_model.output_space != manifest["output_space"]:
+            raise ValueError(
+                f"{directory} holds {manifest['output_space']} embeddings, {embedding_model.output_space} can't query it. "
+                "Pass a matching `embedding_model`"
+            )
+        if None not in (embedding_model.embedding_dim, manifest["dimension"]) and embedding_model.embedding_dim != manifest["dimension"]:
+            raise ValueError(f"{directory} holds {manifest['dimension']}-dim embeddings, {embedding_model.output_space} returns {embedding_model.embedding_dim}")
+
+        count = manifest["count"]
+        vs = cls(embedding_model=embedding_model, dimension=manifest["dimension"], ivf=ivf, quantizer=quantizer, rerank=rerank)
+        if count:
+            embeddings = np.load(os.path.join(directory, store_directory.EMBEDDINGS), mmap_mode="r" if mmap else None)
+            if mmap:
+                vs._base = embeddings[:count]
+            else:
+                vs._buffer = embeddings[:count]
+        vs.documents = store_directory.LazyDocuments(directory, count)
+        with np.load(os.path.join(directory, store_directory.METADATA)) as arrays:
+            vs._metadata = MetadataColumns.from_arrays(arrays, count)
+        vs._saved = (directory, count)
+        vs._encode_new_rows()
+        return vs
+
     def save_pickle(self, path: str):
         with open(path, "wb") as f:
             pickle.dump(
                 {
                     "documents": self.documents,
-                    "embeddings_matrix": self._embeddings_matrix,
+                    "embeddings_matrix": None if self._embeddings_matrix is None else np.asarray(self._embeddings_matrix),
                     "embedding_model": self.embedding_model.__class__.__name__,
+                    "dimension": self.dimension,
                 },
                 f,
             )
@@ -93,10 +413,12 @@ class InMemoryVectorStore(BaseVectorStore):
         embedding_class = globals().get(data["embedding_model"]) or OpenAIEmbeddingModel
 
         vs = cls(
-            documents=data["documents"],
             embedding_model=embedding_class(),
+            dimension=data.get("dimension"),
         )
-        vs._embeddings_matrix=data["embeddings_matrix"]
+        if data["embeddings_matrix"] is not None:
+            # older pickles hold unnormalized rows; normalizing again is harmless
+            vs._append(np.asarray(data["embeddings_matrix"], dtype=np.float32), data["documents"])
         return vs
 
     # def clear(self):
@@ -0,0 +1,241 @@
+import logging
+import threading
+from typing import List, Tuple, Callable
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def minibatch_kmeans(vectors: np.ndarray, k: int, batch_size: int = 4096, n_iter: int = 50,
+                     seed: int = 0, spherical: bool = True) -> np.ndarray:
+    """
+    mini-batch k-means (Sculley, 2010), returns (k, dim) centroids. each step assigns a random
+    batch and moves every centroid towards the mean of its batch members, with a step size that
+    shrinks as the centroid sees more points. `spherical` (for unit vectors) assigns by dot product
+    and keeps the centroids unit length; otherwise it's plain euclidean k-means
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    centroids = np.array(vectors[rng.choice(n, k, replace=False)], dtype=np.float32)
+    seen = np.zeros(k, dtype=np.int64)
+
+    for _ in range(n_iter):
+        batch = np.asarray(vectors[rng.choice(n, min(batch_size, n), replace=False)], dtype=np.float32)
+        if spherical:
+            labels = np.argmax(batch @ centroids.T, axis=1)
+        else:
+            # nearest by euclidean distance: |x - c|^2 = |x|^2 - 2 x.c + |c|^2, and |x|^2 doesn't matter
+            labels = np.argmax(batch @ centroids.T - 0.5 * np.einsum("ij,ij->i", centroids, centroids), axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, batch)
+
+        hit = counts > 0
+        seen[hit] += counts[hit]
+        centroids[hit] += (sums[hit] - counts[hit, None] * centroids[hit]) / seen[hit, None]
+        # centroids nobody picked restart at random points
+        dead = seen == 0
+        if dead.any():
+            centroids[dead] = batch[rng.choice(len(batch), int(dead.sum()))]
+
+        if spherical:
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            np.divide(centroids, norms, out=centroids, where=norms > 0)
+    return centroids
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+    """nearest centroid (by dot product) of every row, in batches to bound memory"""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch_size):
+        labels[start : start + batch_size] = np.argmax(vectors[start : start + batch_size] @ centroids.T, axis=1)
+    return labels
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest neighbour index over the rows of a store's (normalized)
+    embedding matrix. Rows are clustered into `nlist` lists with mini-batch k-means; a query
+    scores the centroids, then only the rows in its `nprobe` nearest lists. More `nprobe` means
+    better recall and slower queries; nprobe == nlist is exact search.
+
+    The index doesn't hold vectors, only row ids: the store passes its matrix in on every call.
+    New rows are assigned to their nearest list as they are added. Once the matrix has grown by
+    `retrain_growth` since the last training, new centroids are trained in a background thread
+    and swapped in on the next call. Until the first training finishes, `search` returns None and
+    the store falls back to exact search.
+    """
+
+    def __init__(self, nlist: int = 1024, nprobe: int = 16, min_train_size: int = 50_000,
+                 train_sample: int = 100_000, batch_size: int = 4096, n_iter: int = 50,
+                 retrain_growth: float = 2.0, background: bool = True, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size # below this many rows, exact search is fast enough
+        self.train_sample = train_sample
+        self.batch_size = batch_size
+        self.n_iter = n_iter
+        self.retrain_growth = retrain_growth
+        self.background = background
+        self.seed = seed
+
+        self._centroids: np.ndarray | None = None
+        self._labels = np.empty(0, dtype=np.int32) # list of every row
+        self._order = np.empty(0, dtype=np.int64) # rows sorted by list...
+        self._offsets = np.zeros(1, dtype=np.int64) # ...list i is _order[_offsets[i]:_offsets[i + 1]]
+        self._indexed = 0 # rows covered by _order; later rows are scanned from _labels
+        self._trained_size = 0
+        self._generation = 0 # bumped when rows are removed, so an in-flight training is discarded
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._pending: Tuple[int, int, np.ndarray, np.ndarray] | None = None
+
+    @property
+    def trained(self) -> bool:
+        return self._centroids is not None
+
+    def _train(self, matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rng = np.random.default_rng(self.seed)
+        sample = matrix if len(matrix) <= self.train_sample else matrix[np.sort(rng.choice(len(matrix), self.train_sample, replace=False))]
+        nlist = min(self.nlist, len(sample))
+        centroids = minibatch_kmeans(sample, nlist, self.batch_size, self.n_iter, self.seed)
+        return centroids, assign(matrix, centroids)
+
+    def fit(self, matrix: np.ndarray) -> "IVFIndex":
+        """train on `matrix` now, blocking"""
+        self.wait()
+        with self._lock:
+            self._pending = None
+        centroids, labels = self._train(matrix)
+        self._install(centroids, labels)
+        self._trained_size = len(matrix)
+        return self
+
+    def _install(self, centroids: np.ndarray, labels: np.ndarray):
+        self._centroids = centroids
+        self._labels = labels
+        self._rebuild_lists()
+
+    def _rebuild_lists(self):
+        self._order = np.argsort(self._labels, kind="stable").astype(np.int64)
+        counts = np.bincount(self._labels, minlength=len(self._centroids))
+        self._offsets = np.concatenate(([0], np.cumsum(counts)))
+        self._indexed = len(self._labels)
+
+    def _train_in_background(self, matrix: np.ndarray):
+        generation, size = self._generation, len(matrix)
+
+        def run():
+            try:
+                centroids, labels = self._train(matrix)
+                with self._lock:
+                    self._pending = (generation, size, centroids, labels)
+                logger.info("Retrained IVF index: %d lists over %d rows", len(centroids), size)
+            except Exception:
+                logger.exception("IVF retraining failed")
+
+        self._trained_size = size # don't start another one for the same growth
+        self._thread = threading.Thread(target=run, name="ivf-train", daemon=True)
+        self._thread.start()
+
+    def wait(self):
+        """block until a background training (if any) is done"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _sync(self, matrix: np.ndarray):
+        """swap in finished training, assign rows added since, and start training if it's time"""
+        with self._lock:
+            pending, self._pending = self._pending, None
+        if pending is not None:
+            generation, size, centroids, labels = pending
+            if generation == self._generation and size <= len(matrix):
+                if size < len(matrix):
+                    labels = np.concatenate((labels, assign(matrix[size:], centroids)))
+                self._install(centroids, labels)
+            elif not self.trained:
+                self._trained_size = 0 # rows were removed mid-training; train again on what's left
+
+        if self.trained and len(self._labels) < len(matrix):
+            self._labels = np.concatenate((self._labels, assign(matrix[len(self._labels) :], self._centroids)))
+            # unindexed rows are scanned on every query; fold them in once they are a tenth of the total
+            if len(self._labels) - self._indexed > len(self._labels) // 10:
+                self._rebuild_lists()
+
+        busy = self._thread is not None and self._thread.is_alive()
+        due = len(matrix) >= self.min_train_size and (
+            not self.trained or len(matrix) >= self.retrain_growth * self._trained_size
+        )
+        if due and not busy:
+            if self.background:
+                self._train_in_background(matrix)
+            else:
+                self.fit(matrix)
+
+    def add(self, matrix: np.ndarray):
+        """call after rows were appended to `matrix`"""
+        self._sync(matrix)
+
+    def compact(self, keep: np.ndarray):
+        """call after the store dropped the rows where `keep` is False"""
+        self._generation += 1
+        if self.trained:
+            self._labels = self._labels[keep[: len(self._labels)]]
+            self._rebuild_lists()
+
+    def clear(self):
+        self._generation += 1
+        self._centroids = None
+        self._labels = np.empty(0, dtype=np.int32)
+        self._indexed = self._trained_size = 0
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """row ids in the `nprobe` lists nearest to `query`"""
+        centroid_scores = self._centroids @ query
+        nprobe = min(nprobe, len(self._centroids))
+        probed = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        parts = [self._order[self._offsets[i] : self._offsets[i + 1]] for i in probed]
+        if self._indexed < len(self._labels):
+            tail = self._labels[self._indexed :]
+            parts.append(self._indexed + np.flatnonzero(np.isin(tail, probed)))
+        return np.concatenate(parts)
+
+    def search(self, matrix: np.ndarray, queries: np.ndarray, top_k: int, mask: np.ndarray | None = None,
+               nprobe: int | None = None, score: Callable[[np.ndarray, int], np.ndarray] | None = None
+               ) -> List[Tuple[np.ndarray, np.ndarray]] | None:
+        """
+        (row ids, scores) of the approximate top_k rows for each (normalized) query, best first,
+        or None if the index isn't trained yet. a query whose probed lists hold fewer than top_k
+        rows matching `mask` gets (None, None), for the caller to search exactly.
+        `score(rows, i)` scores rows against query i instead of `matrix` (e.g. from compressed codes)
+        """
+        self._sync(matrix)
+        if not self.trained:
+            return None
+
+        results = []
+        for i, query in enumerate(queries):
+            rows = self.candidates(query, nprobe or self.nprobe)
+            if mask is not None:
+                rows = rows[mask[rows]]
+            if len(rows) < top_k:
+                results.append((None, None))
+                continue
+            scores = matrix[rows] @ query if score is None else score(rows, i)
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+            top = top[np.argsort(-scores[top])]
+            results.append((rows[top], scores[top]))
+        return results
+
+    def stats(self) -> dict:
+        sizes = np.diff(self._offsets) if self.trained else np.empty(0)
+        return {
+            "trained": self.trained,
+            "nlist": len(self._centroids) if self.trained else 0,
+            "nprobe": self.nprobe,
+            "rows": len(self._labels),
+            "unindexed_rows": len(self._labels) - self._indexed,
+            "largest_list": int(sizes.max()) if len(sizes) else 0,
+            "training": self._thread is not None and self._thread.is_alive(),
+        }
@@ -0,0 +1,219 @@
+import json
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Any, Callable
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# a compiled filter: takes the number of rows, returns a boolean mask over them
+CompiledFilter = Callable[[int], np.ndarray]
+
+_COMPARISONS = {
+    "$gt": np.greater,
+    "$gte": np.greater_equal,
+    "$lt": np.less,
+    "$lte": np.less_equal,
+}
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float, np.integer, np.floating))
+
+
+class _Column:
+    """
+    one metadata key, stored two ways: numbers as float64 (nan if missing or not a number; exact
+    for integers below 2**53, so unix timestamps are fine) and strings as int32 category codes
+    (-1 if missing or not a string)
+    """
+
+    def __init__(self, capacity: int):
+        self.numbers = np.full(capacity, np.nan)
+        self.codes = np.full(capacity, -1, dtype=np.int32)
+        self.categories: Dict[str, int] = {}
+
+    def grow(self, capacity: int, size: int):
+        numbers, codes = np.full(capacity, np.nan), np.full(capacity, -1, dtype=np.int32)
+        numbers[:size], codes[:size] = self.numbers[:size], self.codes[:size]
+        self.numbers, self.codes = numbers, codes
+
+    def set(self, row: int, value: Any):
+        if isinstance(value, str):
+            self.codes[row] = self.categories.setdefault(value, len(self.categories))
+        elif _is_number(value): # bools too
+            self.numbers[row] = value
+
+    def clear_rows(self, start: int, end: int):
+        self.numbers[start:end] = np.nan
+        self.codes[start:end] = -1
+
+    def equals(self, value: Any, n: int) -> np.ndarray:
+        if isinstance(value, str):
+            code = self.categories.get(value)
+            return self.codes[:n] == code if code is not None else np.zeros(n, dtype=bool)
+        if _is_number(value):
+            return self.numbers[:n] == value
+        raise ValueError(f"can't filter on {type(value).__name__} value {value!r}")
+
+    def isin(self, values: List[Any], n: int) -> np.ndarray:
+        strings = [self.categories[v] for v in values if isinstance(v, str) and v in self.categories]
+        numbers = [v for v in values if _is_number(v)]
+        mask = np.isin(self.codes[:n], strings) if strings else np.zeros(n, dtype=bool)
+        if numbers:
+            mask |= np.isin(self.numbers[:n], numbers)
+        return mask
+
+
+class MetadataColumns:
+    """
+    Document metadata kept as columns next to an embedding matrix, so Mongo-style filters
+    (`{"publication_time": {"$gte": t}}`, `$and`, `$or`, `$in`, ...) become numpy boolean masks.
+
+    Rows line up with the embedding rows; the caller grows, compacts and clears both together.
+    Filters are compiled once and cached by their json form. A missing field matches only
+    `$ne` and `$nin`, as in Mongo.
+    """
+
+    def __init__(self, capacity: int = 0, max_compiled: int = 256):
+        self.capacity = capacity
+        self.size = 0
+        self.max_compiled = max_compiled
+        self._columns: Dict[str, _Column] = {}
+        self._compiled: OrderedDict[str, CompiledFilter] = OrderedDict()
+
+    def reserve(self, capacity: int):
+        if capacity > self.capacity:
+            for column in self._columns.values():
+                column.grow(capacity, self.size)
+            self.capacity = capacity
+
+    def append(self, metadatas: List[Dict[str, Any]]):
+        start = self.size
+        self.reserve(start + len(metadatas))
+        for row, metadata in enumerate(metadatas, start):
+            for key, value in metadata.items():
+                if key not in self._columns:
+                    self._columns[key] = _Column(self.capacity)
+                self._columns[key].set(row, value)
+        self.size += len(metadatas)
+
+    def compact(self, keep: np.ndarray):
+        """drop the rows where `keep` is False, in place"""
+        kept = int(keep.sum())
+        for column in self._columns.values():
+            column.numbers[:kept] = column.numbers[: self.size][keep]
+            column.codes[:kept] = column.codes[: self.size][keep]
+            column.clear_rows(kept, self.size)
+        self.size = kept
+
+    def clear(self):
+        self._columns.clear()
+        self.size = 0
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """the first `size` rows of every column, for np.savez"""
+        arrays = {"names": np.array(json.dumps(list(self._columns)))}
+        for i, column in enumerate(self._columns.values()):
+            arrays[f"numbers_{i}"] = column.numbers[: self.size]
+            arrays[f"codes_{i}"] = column.codes[: self.size]
+            arrays[f"categories_{i}"] = np.array(json.dumps(list(column.categories)))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], size: int) -> "MetadataColumns":
+        """inverse of `to_arrays`, keeping the first `size` rows"""
+        columns = cls(capacity=size)
+        for i, name in enumerate(json.loads(str(arrays["names"]))):
+            column = _Column(size)
+            column.numbers[:] = arrays[f"numbers_{i}"][:size]
+            column.codes[:] = arrays[f"codes_{i}"][:size]
+            column.categories = {value: code for code, value in enumerate(json.loads(str(arrays[f"categories_{i}"])))}
+            columns._columns[name] = column
+        columns.size = size
+        return columns
+
+    def mask(self, filter: Dict[str, Any]) -> np.ndarray:
+        """boolean mask of the rows matching `filter`"""
+        key = json.dumps(filter, sort_keys=True, default=str)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = self._compiled[key] = self._compile(filter)
+            while len(self._compiled) > self.max_compiled:
+                self._compiled.popitem(last=False)
+        else:
+            self._compiled.move_to_end(key)
+        return compiled(self.size)
+
+    def _column(self, field: str) -> _Column | None:
+        return self._columns.get(field)
+
+    def _compile(self, filter: Dict[str, Any]) -> CompiledFilter:
+        """filter dict -> function of the row count. columns are looked up at call time, so
+        compiled filters stay valid as documents are added"""
+        parts: List[CompiledFilter] = []
+        for key, value in filter.items():
+            if key == "$and":
+                parts.append(self._combine([self._compile(sub) for sub in value], np.logical_and))
+            elif key == "$or":
+                parts.append(self._combine([self._compile(sub) for sub in value], np.logical_or))
+            elif key == "$not":
+                inner = self._compile(value)
+                parts.append(lambda n, inner=inner: ~inner(n))
+            elif key.startswith("$"):
+                raise ValueError(f"Unsupported operator: {key}")
+            elif isinstance(value, dict):
+                parts.extend(self._compile_field(key, op, operand) for op, operand in value.items())
+            else:
+                parts.append(self._compile_field(key, "$eq", value))
+        return self._combine(parts, np.logical_and)
+
+    @staticmethod
+    def _combine(parts: List[CompiledFilter], op) -> CompiledFilter:
+        if len(parts) == 1:
+            return parts[0]
+
+        def combined(n: int) -> np.ndarray:
+            if not parts:
+                return np.ones(n, dtype=bool) # empty filter / $and: everything matches
+            mask = parts[0](n)
+            for part in parts[1:]:
+                mask = op(mask, part(n))
+            return mask
+
+        return combined
+
+    def _compile_field(self, field: str, op: str, operand: Any) -> CompiledFilter:
+        if op in _COMPARISONS:
+            if not _is_number(operand):
+                raise ValueError(f"{op} needs a number, got {operand!r} for {field}")
+            compare = _COMPARISONS[op]
+
+            def compiled(n: int) -> np.ndarray:
+                column = self._column(field)
+                if column is None:
+                    return np.zeros(n, dtype=bool)
+                with np.errstate(invalid="ignore"): # nan (missing) compares False
+                    return compare(column.numbers[:n], operand)
+
+        elif op in ("$eq", "$ne"):
+            negate = op == "$ne"
+
+            def compiled(n: int) -> np.ndarray:
+                column = self._column(field)
+                mask = np.zeros(n, dtype=bool) if column is None else column.equals(operand, n)
+                return ~mask if negate else mask
+
+        elif op in ("$in", "$nin"):
+            if not isinstance(operand, (list, tuple, set)):
+                raise ValueError(f"{op} needs a list, got {operand!r} for {field}")
+            negate, values = op == "$nin", list(operand)
+
+            def compiled(n: int) -> np.ndarray:
+                column = self._column(field)
+                mask = np.zeros(n, dtype=bool) if column is None else column.isin(values, n)
+                return ~mask if negate else mask
+
+        else:
+            raise ValueError(f"Unsupported operator: {op}")
+        return compiled
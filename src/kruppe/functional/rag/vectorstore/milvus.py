@@ -36,16 +36,24 @@ class MilvusVectorStore(BaseVectorStore):
             self.client.drop_collection(self.collection_name)
         if not self.client.has_collection(self.collection_name):
             self._create_schema_and_collection()
+        elif self.dimension is None:
+            # existing collection: take the dimension from its schema
+            for field in self.client.describe_collection(self.collection_name)["fields"]:
+                if field["name"] == "vector":
+                    self.dimension = int(field["params"]["dim"])
 
     
     def _create_schema_and_collection(self):
+        # size the vector field for the embedding model in use (e.g. reduced `dimensions`)
+        self.dimension = self.dimension or self.embedding_model.embedding_dim or OPENAI_TEXT_EMBEDDING_SMALL_DIM
+
         # create fields
         schema = MilvusClient.create_schema(auto_id=True, enable_dynamic_field=True)
         schema.add_field(field_name="id", datatype=DataType.INT64, is_primary=True)
         schema.add_field(
             field_name="vector",
             datatype=DataType.FLOAT_VECTOR,
-            dim=OPENAI_TEXT_EMBEDDING_SMALL_DIM,
+            dim=self.dimension,
         )
         schema.add_field(
             field_name="text", datatype=DataType.VARCHAR, max_length=2048
@@ -92,12 +100,16 @@ class MilvusVectorStore(BaseVectorStore):
             documents: List of Documents that will be indexed
         """
 
+        # one embedding call for all documents. rows of the float32 array go straight to pymilvus
+        vectors = self.embedding_model.embed([document.text for document in documents])
+        self._check_dimension(vectors)
+
         data = []
-        for document in documents:
+        for document, vector in zip(documents, vectors):
             # required fields
             entry = {
                 "text": document.text,
-                "vector": self.embedding_model.embed([document.text])[0],
+                "vector": vector,
                 "uuid": str(document.uuid),
             }
 
@@ -115,19 +127,23 @@ class MilvusVectorStore(BaseVectorStore):
         return self.insert_documents(documents)
 
     def search(self, vector: List[float], top_k: int = 3, filter: Dict[str, Any] = None) -> List[Document]:
-        
+        return self.search_batch([vector], top_k=top_k, filter=filter)[0]
+
+    def search_batch(self, vectors: List[List[float]], top_k: int = 3, filter: Dict[str, Any] = None) -> List[List[Document]]:
+        """all query vectors in one milvus search request"""
         milvus_filter = convert_filter_to_milvus(filter) if filter else ""
 
         retrieved_data = self.client.search(
             collection_name=self.collection_name,
-            data=[vector],
+            data=list(vectors),
             limit=top_k,
             search_params={"metric_type": "IP", "params": {}},
             output_fields=["id", "text", "uuid", "datasource"], # + ["db_id"],
             filter=milvus_filter
         )
-        top_results = retrieved_data[0]
+        return [self._to_documents(top_results) for top_results in retrieved_data]
 
+    def _to_documents(self, top_results: List[Dict[str, Any]]) -> List[Document]:
         top_documents = []
         for result in top_results:
             entity = result["entity"]
@@ -151,6 +167,10 @@ class MilvusVectorStore(BaseVectorStore):
         # TODO: use async client for async search
         return self.search(vector=vector, top_k=top_k, filter=filter)
 
+    async def async_search_batch(self, vectors: List[List[float]], top_k: int = 3, filter: Dict[str, Any] = None) -> List[List[Document]]:
+        """falls back to synchronous search_batch"""
+        return self.search_batch(vectors=vectors, top_k=top_k, filter=filter)
+
     
     def remove_documents(self, ids: List[Any]) -> int:
         """delete document based on primary id in milvus. returns deleted count"""
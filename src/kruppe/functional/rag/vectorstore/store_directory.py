@@ -0,0 +1,163 @@
+"""
+On-disk directory format for InMemoryVectorStore:
+
+    manifest.json     embedding model, dimension and document count (written last, so it is the commit point)
+    embeddings.npy    normalized float32 rows, opened with mmap_mode so pages load on demand
+    documents.jsonl   one json document per line, append-only
+    documents.idx     int64 byte offset of each line in documents.jsonl, append-only
+    metadata.npz      metadata columns for filtering (small, rewritten on every save)
+
+Rows past the manifest's count (left by a crash mid-save) are ignored on load.
+"""
+import os
+import ast
+import json
+import threading
+from collections.abc import Sequence
+from typing import List, Dict, Any
+import numpy as np
+
+from kruppe.models import Document, Chunk
+
+MANIFEST = "manifest.json"
+EMBEDDINGS = "embeddings.npy"
+DOCUMENTS = "documents.jsonl"
+OFFSETS = "documents.idx"
+METADATA = "metadata.npz"
+FORMAT_VERSION = 1
+
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+_NPY_HEADER_BYTES = 128 # fixed size (room for any shape), so appends only rewrite the row count
+_DOCUMENT_TYPES = {"Document": Document, "Chunk": Chunk}
+
+
+def _npy_header(rows: int, dim: int) -> bytes:
+    header = repr({"descr": "<f4", "fortran_order": False, "shape": (rows, dim)})
+    length = _NPY_HEADER_BYTES - len(_NPY_MAGIC) - 2
+    return _NPY_MAGIC + length.to_bytes(2, "little") + header.ljust(length - 1).encode("latin1") + b"\n"
+
+
+def npy_shape(path: str) -> tuple:
+    with open(path, "rb") as f:
+        header = f.read(_NPY_HEADER_BYTES)
+    if not header.startswith(_NPY_MAGIC):
+        raise ValueError(f"{path} is not a kruppe embeddings file")
+    return ast.literal_eval(header[len(_NPY_MAGIC) + 2 :].decode("latin1").strip())["shape"]
+
+
+def write_npy(path: str, vectors: np.ndarray) -> None:
+    """write float32 rows as a .npy that `append_npy` can grow in place"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    with open(path, "wb") as f:
+        f.write(_npy_header(*vectors.shape))
+        f.write(vectors.tobytes())
+
+
+def append_npy(path: str, vectors: np.ndarray) -> None:
+    """append rows, then bump the row count in the header"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    rows, dim = npy_shape(path)
+    if vectors.shape[1] != dim:
+        raise ValueError(f"can't append {vectors.shape[1]}-dim rows to {dim}-dim {path}")
+    with open(path, "r+b") as f:
+        f.seek(_NPY_HEADER_BYTES + rows * dim * 4)
+        f.write(vectors.tobytes())
+        f.truncate()
+        f.seek(0)
+        f.write(_npy_header(rows + len(vectors), dim))
+
+
+def _dump_document(document: Document) -> bytes:
+    record = document.model_dump(mode="json")
+    record["_type"] = document.__class__.__name__
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _load_document(line: bytes) -> Document:
+    record = json.loads(line)
+    return _DOCUMENT_TYPES.get(record.pop("_type", "Document"), Document).model_validate(record)
+
+
+def append_documents(directory: str, documents: List[Document], count: int) -> None:
+    """append documents after the first `count` lines (dropping anything a failed save left behind)"""
+    offsets_path = os.path.join(directory, OFFSETS)
+    offsets = np.fromfile(offsets_path, dtype=np.int64, count=count) if count else np.empty(0, dtype=np.int64)
+    with open(os.path.join(directory, DOCUMENTS), "r+b" if count else "wb") as f:
+        if count:
+            f.seek(int(offsets[-1]))
+            f.readline()
+        position = f.tell()
+        new_offsets = []
+        for document in documents:
+            line = _dump_document(document)
+            new_offsets.append(position)
+            f.write(line)
+            position += len(line)
+        f.truncate()
+    with open(offsets_path, "r+b" if count else "wb") as f:
+        f.seek(count * 8)
+        f.write(np.asarray(new_offsets, dtype=np.int64).tobytes())
+        f.truncate()
+
+
+def write_manifest(directory: str, manifest: Dict[str, Any]) -> None:
+    # write-then-rename, so a crash leaves the previous manifest
+    path = os.path.join(directory, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"format": FORMAT_VERSION, **manifest}, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def read_manifest(directory: str) -> Dict[str, Any]:
+    with open(os.path.join(directory, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_VERSION:
+        raise ValueError(f"unsupported vector store format {manifest.get('format')} in {directory}")
+    return manifest
+
+
+class LazyDocuments(Sequence):
+    """
+    documents.jsonl as a read-only list: a document is parsed the first time it is accessed.
+    Documents added after loading are kept in memory (`extend`) until the store is saved again.
+    """
+
+    def __init__(self, directory: str, count: int):
+        self.path = os.path.join(directory, DOCUMENTS)
+        self._offsets = np.fromfile(os.path.join(directory, OFFSETS), dtype=np.int64, count=count)
+        self._parsed: Dict[int, Document] = {}
+        self._added: List[Document] = []
+        self._file = open(self.path, "rb")
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._offsets) + len(self._added)
+
+    def _read(self, i: int) -> Document:
+        if i not in self._parsed:
+            with self._lock:
+                self._file.seek(int(self._offsets[i]))
+                line = self._file.readline()
+            self._parsed[i] = _load_document(line)
+        return self._parsed[i]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._read(i) if i < len(self._offsets) else self._added[i - len(self._offsets)]
+
+    def extend(self, documents: List[Document]) -> None:
+        self._added.extend(documents)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __del__(self):
+        if getattr(self, "_file", None) is not None:
+            self._file.close()
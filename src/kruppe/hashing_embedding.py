@@ -0,0 +1,167 @@
+import re
+import zlib
+import asyncio
+import logging
+import itertools
+from typing import List, Tuple
+from pydantic import PrivateAttr
+import numpy as np
+
+from kruppe.llm import BaseEmbeddingModel
+from kruppe.models import Embeddable
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+")
+_SEPARATOR = "\x00"
+_TOKEN_OR_SEPARATOR_RE = re.compile(r"\w+|\x00")
+_SEPARATOR_HASH = zlib.crc32(_SEPARATOR.encode("utf-8"))
+_FNV_PRIME = np.uint64(0x01000193)
+_MASK32 = np.uint64(0xFFFFFFFF)
+
+
+class _TokenHashes(dict):
+    """memo of token -> crc32, filled on first lookup (so `map(memo.__getitem__, tokens)` stays in C)"""
+
+    def __missing__(self, token: str) -> int:
+        value = self[token] = zlib.crc32(token.encode("utf-8"))
+        return value
+
+
+class HashingEmbeddingModel(BaseEmbeddingModel):
+    """
+    Local embedding model: word n-grams hashed into `dim` buckets (the hashing trick), no network
+    and no training needed. Vectors are L2 normalized, so cosine/inner product search works as
+    with the api models. Useful as a cheap first-stage index, for dedupe, and for offline
+    development and tests.
+
+    Hashes are crc32, so vectors are stable across processes. The sign of each feature comes from
+    another bit of the hash, so collisions tend to cancel out instead of piling up.
+
+    With `tfidf=True`, call `fit` (or `partial_fit`) on the corpus first; bucket weights are then
+    scaled by their inverse document frequency. Before fitting, plain term counts are used.
+    """
+    model: str = None # defaults to "hashing-{dim}"
+    dim: int = 1024
+    ngram_range: Tuple[int, int] = (1, 2) # word n-gram sizes, inclusive
+    lowercase: bool = True
+    signed: bool = True
+    tfidf: bool = False
+    batch_size: int = 4096 # texts hashed per numpy pass (bounds the memory of the scatter)
+    max_memo_size: int = 1_000_000 # cached token hashes before the memo is reset
+    _memo: _TokenHashes = PrivateAttr(default_factory=_TokenHashes)
+    _df: np.ndarray = PrivateAttr(default=None)
+    _n_docs: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context):
+        if self.model is None:
+            self.model = f"hashing-{self.dim}"
+        self._df = np.zeros(self.dim, dtype=np.int64)
+
+    @property
+    def embedding_dim(self) -> int:
+        return self.dim
+
+    def _token_hashes(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(row, token hash) for every token of every text, in order"""
+        # one regex pass over the whole batch, with NUL between texts, is much faster than one per text
+        joined = _SEPARATOR.join(texts)
+        if self.lowercase:
+            joined = joined.lower()
+        tokens = _TOKEN_OR_SEPARATOR_RE.findall(joined)
+        hashes = np.fromiter(map(self._memo.__getitem__, tokens), dtype=np.uint64, count=len(tokens))
+        is_separator = hashes == _SEPARATOR_HASH
+        if np.count_nonzero(is_separator) == len(texts) - 1:
+            rows = np.cumsum(is_separator)
+            return rows[~is_separator], hashes[~is_separator]
+
+        # some text contains a NUL itself; tokenize text by text
+        docs = [_TOKEN_RE.findall(text.lower() if self.lowercase else text) for text in texts]
+        lengths = np.fromiter(map(len, docs), dtype=np.int64, count=len(docs))
+        tokens = list(itertools.chain.from_iterable(docs))
+        hashes = np.fromiter(map(self._memo.__getitem__, tokens), dtype=np.uint64, count=len(tokens))
+        return np.repeat(np.arange(len(texts), dtype=np.int64), lengths), hashes
+
+    def _features(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(row, feature hash) for every n-gram of every text"""
+        if len(self._memo) > self.max_memo_size:
+            self._memo.clear()
+
+        rows, hashes = self._token_hashes(texts)
+
+        min_n, max_n = self.ngram_range
+        feature_rows, feature_hashes = [], []
+        if min_n <= 1:
+            feature_rows.append(rows)
+            feature_hashes.append(hashes)
+        for n in range(max(2, min_n), max_n + 1):
+            if len(hashes) < n:
+                break
+            # n-grams that don't cross a text boundary
+            valid = rows[: len(rows) - n + 1] == rows[n - 1 :]
+            combined = hashes[: len(hashes) - n + 1].copy()
+            for k in range(1, n):
+                combined = ((combined * _FNV_PRIME) ^ hashes[k : len(hashes) - n + 1 + k]) & _MASK32
+            feature_rows.append(rows[: len(rows) - n + 1][valid])
+            feature_hashes.append(combined[valid])
+
+        if not feature_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64)
+        return np.concatenate(feature_rows), np.concatenate(feature_hashes)
+
+    def _buckets(self, hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        columns = (hashes % np.uint64(self.dim)).astype(np.int64)
+        if not self.signed:
+            return columns, np.ones(len(hashes), dtype=np.float64)
+        return columns, np.where(hashes & np.uint64(0x80000000), 1.0, -1.0)
+
+    def partial_fit(self, text: List[str] | List[Embeddable]) -> "HashingEmbeddingModel":
+        """add `text` to the document frequencies used for tf-idf weighting"""
+        texts = [x.text if isinstance(x, Embeddable) else x for x in text]
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start : start + self.batch_size]
+            rows, hashes = self._features(batch)
+            columns, _ = self._buckets(hashes)
+            present = np.unique(rows * self.dim + columns) % self.dim
+            self._df += np.bincount(present, minlength=self.dim)
+            self._n_docs += len(batch)
+        return self
+
+    def fit(self, text: List[str] | List[Embeddable]) -> "HashingEmbeddingModel":
+        """reset the document frequencies and fit them on `text`"""
+        self._df = np.zeros(self.dim, dtype=np.int64)
+        self._n_docs = 0
+        return self.partial_fit(text)
+
+    @property
+    def idf(self) -> np.ndarray | None:
+        """smoothed inverse document frequency per bucket, None until fitted"""
+        if self._n_docs == 0:
+            return None
+        return (np.log((1 + self._n_docs) / (1 + self._df)) + 1).astype(np.float32)
+
+    def embed(self, text: List[str] | List[Embeddable]) -> np.ndarray:
+        texts = [x.text if isinstance(x, Embeddable) else x for x in text]
+        idf = self.idf if self.tfidf else None
+        if self.tfidf and idf is None:
+            logger.warning("tfidf is on but the model isn't fitted; using plain term counts")
+
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start : start + self.batch_size]
+            rows, hashes = self._features(batch)
+            columns, signs = self._buckets(hashes)
+            counts = np.bincount(rows * self.dim + columns, weights=signs, minlength=len(batch) * self.dim)
+            out[start : start + len(batch)] = counts.reshape(len(batch), self.dim)
+
+        if idf is not None:
+            out *= idf
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+    async def async_embed(self, text: List[str] | List[Embeddable]) -> np.ndarray:
+        # cpu bound; big batches go to a thread so the event loop isn't blocked
+        if len(text) > self.batch_size:
+            return await asyncio.to_thread(self.embed, text)
+        return self.embed(text)
@@ -0,0 +1,171 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Dict, Any, TypeVar
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """latencies of the last `window` successful requests"""
+
+    def __init__(self, window: int = 1000):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, q: float) -> float | None:
+        """q in [0, 1]. None until there is at least one sample"""
+        with self._lock:
+            if not self._latencies:
+                return None
+            return float(np.quantile(np.fromiter(self._latencies, dtype=float), q))
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+
+class Hedger:
+    """
+    Hedged requests: if a request hasn't answered by the `percentile` latency of recent requests,
+    send a duplicate and take whichever succeeds first (the other one is cancelled). If one of them
+    fails, the other can still win.
+
+    Hedges are capped by a budget: every request earns `budget` hedge credits (so budget=0.05
+    allows at most ~5% extra requests), up to `max_burst` saved credits. Nothing is hedged until
+    `min_samples` latencies have been observed.
+
+    Like the rate limiter, a Hedger keeps no loop-bound state and can be shared across event loops.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        budget: float = 0.05,
+        max_burst: float = 10.0,
+        min_samples: int = 20,
+        min_delay: float = 0.05,
+        max_delay: float | None = None,
+        window: int = 1000,
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.max_burst = max_burst
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.tracker = LatencyTracker(window)
+
+        self._lock = threading.Lock()
+        self._credits = 0.0
+        self._requests = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._over_budget = 0
+
+    def hedge_delay(self) -> float | None:
+        """seconds to wait before hedging, or None while there are too few samples"""
+        if len(self.tracker) < max(1, self.min_samples):
+            return None
+        delay = max(self.min_delay, self.tracker.percentile(self.percentile))
+        return min(delay, self.max_delay) if self.max_delay is not None else delay
+
+    def _take_credit(self) -> bool:
+        with self._lock:
+            if self._credits >= 1.0:
+                self._credits -= 1.0
+                self._hedged += 1
+                return True
+            self._over_budget += 1
+            return False
+
+    async def run(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """run `fn`, hedging it with a second call to `fn` if it is slow. `fn` must be safe to call twice"""
+        with self._lock:
+            self._requests += 1
+            self._credits = min(self.max_burst, self._credits + self.budget)
+
+        delay = self.hedge_delay()
+        start = time.monotonic()
+        primary = asyncio.ensure_future(fn())
+        started = {primary: start}
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done and self._take_credit():
+                    logger.debug("Hedging request after %.2fs", delay)
+                    hedge = asyncio.ensure_future(fn())
+                    started[hedge] = time.monotonic()
+                    return await self._first_success(started, hedge)
+
+            result = await primary
+            self.tracker.record(time.monotonic() - start)
+            return result
+        finally:
+            for task in started:
+                if not task.done():
+                    task.cancel()
+
+    async def _first_success(self, started: Dict[asyncio.Future, float], hedge: asyncio.Future):
+        pending = set(started)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.cancelled():
+                    continue
+                if task.exception() is not None:
+                    error = error or task.exception()
+                    continue
+
+                self.tracker.record(time.monotonic() - started[task])
+                if task is hedge:
+                    with self._lock:
+                        self._hedge_wins += 1
+                return task.result()
+
+        if error is None:
+            raise asyncio.CancelledError()
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "hedged": self._hedged,
+                "hedge_wins": self._hedge_wins,
+                "over_budget": self._over_budget,
+                "hedge_rate": self._hedged / self._requests if self._requests else 0.0,
+                "credits": self._credits,
+                "hedge_delay": self.hedge_delay(),
+                "samples": len(self.tracker),
+            }
+
+
+# process-wide registry, so every model instance hitting the same endpoint shares its latency history
+_hedgers: Dict[str, Hedger] = {}
+_registry_lock = threading.Lock()
+
+
+def get_hedger(key: str, **kwargs) -> Hedger:
+    """returns the shared hedger for `key` (e.g. "nyu:gpt-4o-mini"), creating it on first use"""
+    with _registry_lock:
+        if key not in _hedgers:
+            _hedgers[key] = Hedger(**kwargs)
+        return _hedgers[key]
+
+
+def configure_hedger(key: str, **kwargs) -> Hedger:
+    """replace the shared hedger for `key` with one built from `kwargs` (percentile, budget, ...)"""
+    with _registry_lock:
+        _hedgers[key] = Hedger(**kwargs)
+        return _hedgers[key]
@@ -1,34 +1,305 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Literal
+from typing import List, Dict, Literal, ClassVar, Callable, Awaitable, Tuple, Any, AsyncGenerator
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
 import os
+import json
+import base64
+import time
+import atexit
 import asyncio
-from openai import OpenAI, AsyncOpenAI
+import hashlib
+import weakref
+import functools
+import inspect
+import importlib.util
+from openai import OpenAI, AsyncOpenAI, RateLimitError, APIConnectionError, InternalServerError
 import logging
 from pydantic import BaseModel, Field, PrivateAttr, ConfigDict, computed_field
 import httpx
+import numpy as np
 
-from kruppe.models import Embeddable, Response
+from kruppe.models import Embeddable, Response, EMBEDDING_DIMS
 from kruppe.utils import log_io
+from kruppe.llm_cache import LLMCache, make_cache_key
+from kruppe.rate_limit import RateLimiter, RateLimitSlot, get_rate_limiter, estimate_tokens
+from kruppe.llm_telemetry import track_llm_call, current_llm_call, price_for
+from kruppe.hedge import Hedger, get_hedger
+from kruppe.llm_history import HistoryBudget
+from kruppe.background_loop import get_background_loop, run_sync
 
 HTTPX_CONNECTION_LIMITS = httpx.Limits(max_keepalive_connections=50, max_connections=400)
 HTTPX_TIMEOUT = httpx.Timeout(5.0, read=60.0) # high read timeout cuz nyu api is slow (i keep getting read timeout error)
 
-def init_httpx_client() -> httpx.AsyncClient:
+def init_httpx_client(http2: bool = False, event_hooks: Dict[str, List[Callable]] = None,
+                      transport: httpx.AsyncBaseTransport = None) -> httpx.AsyncClient:
     return httpx.AsyncClient(
             limits=HTTPX_CONNECTION_LIMITS,
             timeout=HTTPX_TIMEOUT,
+            http2=http2,
+            event_hooks=event_hooks,
+            transport=transport, # if given, it brings its own limits and http2 setting
         )
         # event_hooks={"response": lambda r: r.release()},
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARNING)
 
+class HTTPPoolStats:
+    """request/connection counters for the shared NYU connection pools, collected by the pools'
+    transport (see `transport`) and httpcore's trace extension (a new tcp connection means the pool
+    had nothing to reuse)"""
+    def __init__(self):
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.connections_opened = 0
+        self.pools_created = 0
+
+    def _on_request(self, request: httpx.Request):
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        request.extensions["trace"] = self._trace
+
+    async def _trace(self, event_name: str, info: Dict):
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    def transport(self, http2: bool = False) -> httpx.AsyncHTTPTransport:
+        """a pool transport that counts its requests"""
+        return _CountingTransport(self, limits=HTTPX_CONNECTION_LIMITS, http2=http2)
+
+    def snapshot(self) -> Dict[str, Any]:
+        pools = [client for clients in _nyu_clients.values() for client in clients.values() if not client.is_closed]
+        # httpx doesn't expose pool state publicly; this is best effort
+        open_connections = sum(
+            len(getattr(getattr(client._transport, "_pool", None), "connections", []))
+            for client in pools
+        )
+        return {
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "connections_opened": self.connections_opened,
+            "connection_reuse_rate": 1 - self.connections_opened / self.requests if self.requests else 0.0,
+            "pools_created": self.pools_created,
+            "pools_open": len(pools),
+            "open_connections": open_connections,
+        }
+
+class _CountingTransport(httpx.AsyncHTTPTransport):
+    """a request is in flight until its response headers arrive, or it fails (connect errors,
+    timeouts, cancellation), so the count can't leak the way a response hook alone would"""
+    def __init__(self, stats: HTTPPoolStats, **kwargs):
+        super().__init__(**kwargs)
+        self._stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._stats._on_request(request)
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self._stats.in_flight -= 1
+
+NYU_POOL_STATS = HTTPPoolStats()
+
+# one pool per (event loop, http2), shared by every NYU model. httpx clients can't be used across loops
+_nyu_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[bool, httpx.AsyncClient]]" = weakref.WeakKeyDictionary()
+
+def get_nyu_client(http2: bool = False) -> httpx.AsyncClient:
+    """returns the shared connection pool for the running event loop, creating it on first use"""
+    loop = asyncio.get_running_loop()
+    clients = _nyu_clients.setdefault(loop, {})
+    client = clients.get(http2)
+    if client is None or client.is_closed:
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 requested but the `h2` package is not installed (pip install httpx[http2]). Using HTTP/1.1")
+            http2 = False
+        client = init_httpx_client(http2=http2, transport=NYU_POOL_STATS.transport(http2))
+        clients[http2] = client
+        NYU_POOL_STATS.pools_created += 1
+    return client
+
+async def aclose_nyu_clients() -> None:
+    """close the shared pools that belong to the running event loop"""
+    clients = _nyu_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
+# pools on the background loop used by the sync wrappers are closed when that loop stops
+get_background_loop().on_shutdown(aclose_nyu_clients)
+
+@atexit.register
+def _close_nyu_clients_at_exit():
+    # loops that are still usable get their pools closed properly. pools on closed loops are
+    # already unusable and their sockets go with the process
+    for loop, clients in list(_nyu_clients.items()):
+        if loop.is_closed() or loop.is_running():
+            continue
+        for client in clients.values():
+            if not client.is_closed:
+                try:
+                    loop.run_until_complete(client.aclose())
+                except Exception as e:
+                    logger.debug("Failed to close NYU connection pool at exit: %s", e)
+    _nyu_clients.clear()
+
+# keys the current task is already leading, so a call can't end up waiting on itself (e.g. retries)
+_leading_flights: ContextVar[frozenset] = ContextVar("_leading_flights", default=frozenset())
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller for a key runs the call, and everyone
+    who asks for the same key while it is in flight awaits that same result (or exception).
+    Nothing is remembered once the call finishes - that is what LLMCache is for.
+    """
+    def __init__(self):
+        self._calls: Dict[Tuple[int, str], asyncio.Task] = {}
+        self._coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """returns (result, is_leader)"""
+        if key in _leading_flights.get():
+            return await fn(), True
+
+        # futures belong to a loop, so flights are per event loop
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), key)
+
+        task = self._calls.get(call_key)
+        is_leader = task is None
+        if is_leader:
+            task = loop.create_task(self._lead(key, fn))
+            self._calls[call_key] = task
+            task.add_done_callback(functools.partial(self._finish, call_key))
+        else:
+            self._coalesced += 1
+
+        # shield so one caller being cancelled doesn't cancel the call for everyone else
+        return await asyncio.shield(task), is_leader
+
+    async def _lead(self, key: str, fn: Callable[[], Awaitable[Any]]):
+        _leading_flights.set(_leading_flights.get() | {key})
+        return await fn()
+
+    def _finish(self, call_key: Tuple[int, str], task: asyncio.Task):
+        if self._calls.get(call_key) is task:
+            del self._calls[call_key]
+        if not task.cancelled():
+            task.exception() # mark as retrieved, in case every caller was cancelled
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._calls), "coalesced": self._coalesced}
+
+_generate_flights = SingleFlight()
+_embed_flights = SingleFlight()
+
+def single_flight_generate(func):
+    """share one upstream call between concurrent identical `async_generate` calls (not in keep_history mode)"""
+    @functools.wraps(func)
+    async def wrapper(self, messages: List[Dict], max_tokens=2000, *args, **kwargs):
+        if self.keep_history or not self.coalesce:
+            return await func(self, messages, max_tokens, *args, **kwargs)
+
+        # scoped to the backend: another provider or endpoint serving the same model name can fail differently
+        key = make_cache_key(f"{self.flight_scope}/{self.model}", messages, max_tokens)
+        response, is_leader = await _generate_flights.do(
+            key, lambda: func(self, messages, max_tokens, *args, **kwargs)
+        )
+        # callers attach sources to the response, so don't hand out the same object twice
+        return response if is_leader else response.model_copy()
+    return wrapper
+
+def single_flight_embed(func):
+    """share one upstream call between concurrent `async_embed` calls on the same texts"""
+    @functools.wraps(func)
+    async def wrapper(self, text, *args, **kwargs):
+        if not self.coalesce or not text:
+            return await func(self, text, *args, **kwargs)
+
+        texts = [x.text if isinstance(x, Embeddable) else x for x in text]
+        # output_space, not just the model: models returning different dimensions can't share a call
+        key = hashlib.sha256("\x00".join([self.flight_scope, self.output_space, *texts]).encode("utf-8")).hexdigest()
+        embeddings, is_leader = await _embed_flights.do(key, lambda: func(self, text, *args, **kwargs))
+        return embeddings if is_leader else embeddings.copy()
+    return wrapper
+
+def track_generate(func):
+    """report every `generate`/`async_generate`/`async_stream` call to the llm telemetry (see
+    kruppe.llm_telemetry). goes under single_flight_generate, so coalesced followers aren't counted"""
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            with track_llm_call(self, kind="stream"):
+                async for delta in func(self, *args, **kwargs):
+                    yield delta
+    elif inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            with track_llm_call(self):
+                return await func(self, *args, **kwargs)
+    else:
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with track_llm_call(self):
+                return func(self, *args, **kwargs)
+    return wrapper
+
 class BaseNYUModel(BaseModel):
     # TODO: deal with (read) timeout error
     api_key: str = Field(default_factory=lambda: os.getenv("NYU_API_KEY"))
     project_id: str = Field(default_factory=lambda: os.getenv("NYU_PROJECT_ID"))
     net_id: str = Field(default_factory=lambda: os.getenv("NYU_NET_ID"))
-    _httpx_client: httpx.AsyncClient = PrivateAttr(default=None)
+    http2: bool = False # needs the `h2` package
+    hedge: bool = True # send a duplicate of requests slower than the endpoint's p95 (see kruppe.hedge)
+    _httpx_client: httpx.AsyncClient = PrivateAttr(default=None) # optional client to use instead of the shared pool
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """the client to send requests with: `_httpx_client` if one was set, otherwise the shared pool"""
+        return self._httpx_client or get_nyu_client(http2=self.http2)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """close this model's own `_httpx_client`, if it has one. the shared pool is used by every
+        NYU model on the loop, so it stays open (see `aclose_nyu_clients`)"""
+        if self._httpx_client is not None:
+            await self._httpx_client.aclose()
+            self._httpx_client = None
+
+    @staticmethod
+    def pool_stats() -> Dict[str, Any]:
+        return NYU_POOL_STATS.snapshot()
+
+    def _endpoint_scope(self) -> str:
+        """the endpoint, credentials and client requests go to (see `flight_scope`)"""
+        client = "pool" if self._httpx_client is None else id(self._httpx_client)
+        return f"nyu:{self.endpoint_url}:{self.project_id}:{self.api_key}:{client}"
+
+    @property
+    def hedger(self) -> Hedger | None:
+        """the hedger shared by every model instance using the same NYU model"""
+        if not self.hedge:
+            return None
+        return get_hedger(f"nyu:{self.model}")
+
+    async def _post(self, client: httpx.AsyncClient, body: Dict[str, Any]) -> httpx.Response:
+        """POST `body` to the endpoint, hedged if enabled. raises on error status codes"""
+        async def send() -> httpx.Response:
+            response = await client.post(self.endpoint_url, headers=self.headers, json=body)
+            response.raise_for_status()
+            return response
+
+        hedger = self.hedger
+        if hedger is None:
+            return await send()
+        return await hedger.run(send)
 
     @computed_field
     @property
@@ -40,14 +311,29 @@ class BaseNYUModel(BaseModel):
             "AUTHORIZATION_KEY": self.api_key,
         }
 
+def cached_prompt_tokens(usage: Any) -> int:
+    """prompt tokens the provider served from its prompt cache (usage.prompt_tokens_details.cached_tokens).
+    works on openai usage objects and on plain json usage dicts"""
+    details = usage.get("prompt_tokens_details") if isinstance(usage, dict) else getattr(usage, "prompt_tokens_details", None)
+    if not details:
+        return 0
+    cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+    return cached or 0
+
 class BaseLLM(ABC, BaseModel):
     """Custom generator interface"""
     model_config = ConfigDict(arbitrary_types_allowed=True)
     keep_history: bool = False
     messages: List[Dict] = []
+    history_budget: HistoryBudget | None = None # keep_history mode: bound what is resent each call (see kruppe.llm_history)
+    cache: LLMCache | None = None # opt-in on-disk response cache
+    rate_limit: bool = True # share the provider's process-wide RPM/TPM budget (see kruppe.rate_limit)
+    coalesce: bool = True # concurrent identical requests share one upstream call
+    provider: ClassVar[str] = "openai"
     _session_token_usage: int = PrivateAttr(default=0)
     _input_token_usage: int = PrivateAttr(default=0)
     _output_token_usage: int = PrivateAttr(default=0)
+    _cached_token_usage: int = PrivateAttr(default=0) # prompt tokens served from the provider's prompt cache
 
     # @abstractmethod
     # def generate(self) -> str:
@@ -61,27 +347,136 @@ class BaseLLM(ABC, BaseModel):
     def generate(self, messages: List[Dict], max_tokens=2000) -> Response:
         raise NotImplementedError
     
+    async def async_stream(self, messages: List[Dict], max_tokens=2000) -> AsyncGenerator[str, None]:
+        """yields the completion as text deltas. token usage is recorded once the stream ends.
+        models without a streaming implementation yield the whole completion at once"""
+        response = await self.async_generate(messages, max_tokens=max_tokens)
+        yield response.text
+    
     async def async_tool_call(self, messages: List[Dict]):
         raise NotImplementedError
 
     async def batch_async_generate(self, messages_list: List[List[Dict]], max_tokens=2000) -> List[Response]:
+        # the gather is unbounded, but every async_generate waits on the shared rate limiter for a slot
         return await asyncio.gather(*(self.async_generate(messages=messages, max_tokens=max_tokens) for messages in messages_list))
     
+    @property
+    def flight_scope(self) -> str:
+        """what decides the response besides the request (provider, endpoint, credentials). concurrent
+        identical requests are coalesced only within one scope; by default, within this instance"""
+        return f"{self.provider}:{id(self)}"
+
+    @property
+    def rate_limiter(self) -> RateLimiter | None:
+        """the limiter shared by every llm instance using the same provider and model"""
+        if not self.rate_limit:
+            return None
+        return get_rate_limiter(f"{self.provider}:{self.model}")
+
+    @asynccontextmanager
+    async def _rate_limited(self, messages: List[Dict], max_tokens: int):
+        """hold a rate limiter slot around an upstream call. call `slot.record(total_tokens)` inside"""
+        self._count_attempt()
+        limiter = self.rate_limiter
+        if limiter is None:
+            yield RateLimitSlot(None, 0)
+            return
+
+        async with limiter.limit(estimate_tokens(messages, max_tokens)) as slot:
+            yield slot
+
+    @contextmanager
+    def _rate_limited_sync(self, messages: List[Dict], max_tokens: int):
+        self._count_attempt()
+        limiter = self.rate_limiter
+        if limiter is None:
+            yield RateLimitSlot(None, 0)
+            return
+
+        with limiter.limit_sync(estimate_tokens(messages, max_tokens)) as slot:
+            yield slot
+
+    def _extend_history(self, messages: List[Dict]) -> List[Dict]:
+        """keep_history mode: add `messages` to the history, trim it to `history_budget`, and return what to send"""
+        self.messages.extend(messages)
+        if self.history_budget is not None:
+            self.messages = self.history_budget.trim(self.messages)
+        return self.messages
+
+    def _record_usage(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> None:
+        self._session_token_usage += prompt_tokens + completion_tokens
+        self._input_token_usage += prompt_tokens
+        self._output_token_usage += completion_tokens
+        self._cached_token_usage += cached_tokens
+        record = current_llm_call(self)
+        if record is not None:
+            record.prompt_tokens += prompt_tokens
+            record.completion_tokens += completion_tokens
+            record.cached_tokens += cached_tokens
+        logger.debug("Total tokens used: %d (%d input tokens, %d cached, %d output tokens)", prompt_tokens + completion_tokens, prompt_tokens, cached_tokens, completion_tokens)
+
+    def _count_attempt(self) -> None:
+        """one upstream request for the call being tracked (retries show up as extra attempts)"""
+        record = current_llm_call(self)
+        if record is not None:
+            record.attempts += 1
+
+    def _cache_lookup(self, messages: List[Dict], max_tokens: int) -> Response | None:
+        """returns the cached response for this request, if caching is enabled and there is one"""
+        if self.cache is None:
+            return None
+
+        text = self.cache.get(make_cache_key(self.model, messages, max_tokens))
+        if text is None:
+            return None
+
+        if self.keep_history:
+            self.messages.append({"role": "assistant", "content": text})
+        logger.debug("LLM cache hit (model=%s)", self.model)
+        return Response(text=text)
+
+    def _cache_store(self, messages: List[Dict], max_tokens: int, response: Response) -> None:
+        if self.cache is None or response.text is None:
+            return
+        self.cache.set(make_cache_key(self.model, messages, max_tokens), response.text, model=self.model)
+
     def price(self):
-        if self.model == "gpt-4o":
-            return (self._input_token_usage * 2.5 + self._output_token_usage * 10) / 1_000_000
-        elif self.model == "gpt-4o-mini":
-            return (self._input_token_usage * 0.15 + self._output_token_usage * 0.075) / 1_000_000
-        else:
-            return 0
+        """session cost in USD, from the price catalog in kruppe.llm_telemetry"""
+        return price_for(self.model, self._input_token_usage, self._output_token_usage, self._cached_token_usage)
+
+# openai errors worth retrying: 429s, 5xx, timeouts and connection errors
+OPENAI_RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APIConnectionError)
 
 class OpenAILLM(BaseLLM):
     model: Literal["gpt-4o", "gpt-4o-mini"] = "gpt-4o-mini"
     api_key: str = Field(default_factory=lambda: os.getenv("OPENAI_API_KEY"))
-    sync_client: OpenAI = Field(default_factory=lambda: OpenAI(api_key=os.getenv("OPENAI_API_KEY")))
-    async_client: AsyncOpenAI = Field(default_factory=lambda: AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")))
+    base_url: str | None = Field(default_factory=lambda: os.getenv("OPENAI_BASE_URL")) # e.g. a kruppe.mock_server
+    sync_client: OpenAI = None
+    async_client: AsyncOpenAI = None
+    max_retries: int = 2 # on OPENAI_RETRYABLE_ERRORS
+    backoff_factor: float = 0.3
+
+    def model_post_init(self, __context):
+        # the sdk's own retries would happen inside a rate limiter slot and hide 429s from it,
+        # so the clients don't retry and every attempt takes its own slot (see `_retry_delay`)
+        if self.sync_client is None:
+            self.sync_client = OpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        if self.async_client is None:
+            self.async_client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+
+    @property
+    def flight_scope(self) -> str:
+        return f"openai:{self.async_client.base_url}:{self.async_client.api_key}"
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float | None:
+        """seconds to wait before retrying after `error`, or None to give up"""
+        if attempt >= self.max_retries or not isinstance(error, OPENAI_RETRYABLE_ERRORS):
+            return None
+        logger.warning("OpenAI request failed (%s), retrying", type(error).__name__)
+        return self.backoff_factor * 2 ** attempt
     
     @log_io
+    @track_generate
     def generate(
         self, messages: List[Dict], max_tokens=2000
     ) -> Response:
@@ -89,25 +484,31 @@ class OpenAILLM(BaseLLM):
 
         # if we want to keep history, add messages to history
         if self.keep_history:
-            self.messages.extend(messages)
-            messages = self.messages
+            messages = self._extend_history(messages)
 
-        completion = self.sync_client.chat.completions.create(
-            model=self.model, messages=messages, max_tokens=max_tokens
-        )
+        cached_response = self._cache_lookup(messages, max_tokens)
+        if cached_response is not None:
+            return cached_response
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._rate_limited_sync(messages, max_tokens) as slot:
+                    completion = self.sync_client.chat.completions.create(
+                        model=self.model, messages=messages, max_tokens=max_tokens
+                    )
+                    slot.record(completion.usage.total_tokens)
+                break
+            except Exception as e:
+                delay = self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
 
         if self.keep_history:
             self.messages.append(completion.choices[0].message)
 
-        # TODO: add logger to track openai response, token usage here
         # https://platform.openai.com/docs/api-reference/introduction
-        total_tokens = completion.usage.total_tokens
-        self._session_token_usage += total_tokens
-        self._input_token_usage += completion.usage.prompt_tokens
-        self._output_token_usage += completion.usage.completion_tokens
-
-        # log token usages
-        logger.debug("Total tokens used: %d (%d input tokens, %d output tokens)", total_tokens, completion.usage.prompt_tokens, completion.usage.completion_tokens)
+        self._record_usage(completion.usage.prompt_tokens, completion.usage.completion_tokens, cached_prompt_tokens(completion.usage))
         
         # log llm output
         if logger.isEnabledFor(logging.INFO):
@@ -115,33 +516,44 @@ class OpenAILLM(BaseLLM):
             log_messages.append(f"[assistant] {completion.choices[0].message.content}")
             logger.info("\n".join(log_messages))
 
-        return Response(text=completion.choices[0].message.content)
+        response = Response(text=completion.choices[0].message.content)
+        self._cache_store(messages, max_tokens, response)
+        return response
 
     @log_io
+    @single_flight_generate
+    @track_generate
     async def async_generate(
         self, messages: List[Dict], max_tokens=2000
     ) -> Response:
         """returns openai response based on given messages"""
 
         if self.keep_history:
-            self.messages.extend(messages)
-            messages = self.messages
+            messages = self._extend_history(messages)
+
+        cached_response = self._cache_lookup(messages, max_tokens)
+        if cached_response is not None:
+            return cached_response
 
         # TODO: add try/except for openai api key errors
-        completion = await self.async_client.chat.completions.create(
-            model=self.model, messages=messages, max_tokens=max_tokens
-        )
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._rate_limited(messages, max_tokens) as slot:
+                    completion = await self.async_client.chat.completions.create(
+                        model=self.model, messages=messages, max_tokens=max_tokens
+                    )
+                    slot.record(completion.usage.total_tokens)
+                break
+            except Exception as e:
+                delay = self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
 
         if self.keep_history:
             self.messages.append(completion.choices[0].message)
 
-        total_tokens = completion.usage.total_tokens
-        self._session_token_usage += total_tokens
-        self._input_token_usage += completion.usage.prompt_tokens
-        self._output_token_usage += completion.usage.completion_tokens
-
-        # log token usages
-        logger.debug("Total tokens used: %d (%d input tokens, %d output tokens)", total_tokens, completion.usage.prompt_tokens, completion.usage.completion_tokens)
+        self._record_usage(completion.usage.prompt_tokens, completion.usage.completion_tokens, cached_prompt_tokens(completion.usage))
         
         # log llm output
         if logger.isEnabledFor(logging.INFO):
@@ -149,84 +561,207 @@ class OpenAILLM(BaseLLM):
             log_messages.append(f"[assistant] {completion.choices[0].message.content}")
             logger.info("\n".join(log_messages))
 
-        return Response(text=completion.choices[0].message.content)
+        response = Response(text=completion.choices[0].message.content)
+        self._cache_store(messages, max_tokens, response)
+        return response
+
+    @track_generate
+    async def async_stream(
+        self, messages: List[Dict], max_tokens=2000
+    ) -> AsyncGenerator[str, None]:
+        """streams openai response deltas based on given messages"""
+
+        if self.keep_history:
+            messages = self._extend_history(messages)
+
+        cached_response = self._cache_lookup(messages, max_tokens)
+        if cached_response is not None:
+            yield cached_response.text
+            return
+
+        deltas = []
+        usage = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._rate_limited(messages, max_tokens) as slot:
+                    stream = await self.async_client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        max_tokens=max_tokens,
+                        stream=True,
+                        stream_options={"include_usage": True}, # usage comes in the last chunk
+                    )
+                    async for chunk in stream:
+                        if chunk.usage is not None:
+                            usage = chunk.usage
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            delta = chunk.choices[0].delta.content
+                            deltas.append(delta)
+                            yield delta
+                    if usage is not None:
+                        slot.record(usage.total_tokens)
+                break
+            except Exception as e:
+                # once deltas went out, a retry would repeat them
+                delay = None if deltas else self._retry_delay(attempt, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+        content = "".join(deltas)
+        if self.keep_history:
+            self.messages.append({"role": "assistant", "content": content})
+        if usage is not None:
+            self._record_usage(usage.prompt_tokens, usage.completion_tokens, cached_prompt_tokens(usage))
+
+        self._cache_store(messages, max_tokens, Response(text=content))
 
 class NYUOpenAILLM(BaseLLM, BaseNYUModel):
     model: Literal["gpt-4o-mini"] = "gpt-4o-mini"
+    provider: ClassVar[str] = "nyu"
     endpoint_url: str = Field(default_factory=lambda: os.getenv("NYU_ENDPOINT_URL_CHAT"))
 
+    @property
+    def flight_scope(self) -> str:
+        return self._endpoint_scope()
+
     @log_io
+    @single_flight_generate
+    @track_generate
     async def async_generate(self, messages: List[Dict], max_tokens=2000, retries=3, backoff_factor=0.3) -> Response:
         if self.keep_history:
-            self.messages.extend(messages)
-            messages = self.messages
+            messages = self._extend_history(messages)
+
+        cached_response = self._cache_lookup(messages, max_tokens)
+        if cached_response is not None:
+            return cached_response
         
         body = {
             "messages": messages,
             "openai_parameters": {"max_tokens": max_tokens},
         }
-        # init httpx client if not initialized in the model
-        client = self._httpx_client or init_httpx_client()
-        
-        try:
-            response = await client.post(
-                self.endpoint_url,
-                headers=self.headers,
-                json=body,
-            )
-            response.raise_for_status()
+        client = self.client
 
-            completion = response.json()
-            content = completion["choices"][0]["message"]["content"]
+        # retries resend the same request; `messages` already went through history and cache
+        for attempt in range(retries + 1):
+            try:
+                async with self._rate_limited(messages, max_tokens) as slot:
+                    response = await self._post(client, body)
+                    completion = response.json()
+                    slot.record(completion["usage"]["total_tokens"])
+                break
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 429 or attempt >= retries:
+                    logger.error(f"HTTP error: {e.response}")
+                    if e.response.status_code == 401:
+                        logger.warning(f"Double check your auth key: {self.api_key[:10]}...")
+                    raise e
+                # the shared rate limiter has already backed off, so retrying here won't pile on
+                logger.warning("Rate limited by NYU API, retrying")
+            except httpx.ReadTimeout as e:
+                if attempt >= retries:
+                    raise e
+            except (httpx.ConnectTimeout, httpx.ConnectError) as e:
+                logger.error("Connection error to NYU API: %s", e)
+                # logger.error(f"Error: {e}")
+                logger.warning("Did you connect to NYU's VPN?")
+                raise e
+            await asyncio.sleep(backoff_factor * 2 ** attempt)
 
-            if self.keep_history:
-                self.messages.append({"role": "assistant", "content": content})
-            
-            total_tokens = completion["usage"]["total_tokens"]
-            self._session_token_usage += total_tokens
-            self._input_token_usage += completion["usage"]["prompt_tokens"]
-            self._output_token_usage += completion["usage"]["completion_tokens"]
+        content = completion["choices"][0]["message"]["content"]
 
-            # log token usages
-            logger.debug("Total tokens used: %d (%d input tokens, %d output tokens)", total_tokens, completion["usage"]["prompt_token"], completion["usage"]["completion_token"])
-            
-            # log llm output
-            if logger.isEnabledFor(logging.INFO):
-                log_messages = [f"[{message['role']}] {message['content']}" for message in messages]
-                log_messages.append(f"[assistant] {completion["choices"][0]["message"]["content"]}")
-                logger.info("\n".join(log_messages))
+        if self.keep_history:
+            self.messages.append({"role": "assistant", "content": content})
+
+        self._record_usage(completion["usage"]["prompt_tokens"], completion["usage"]["completion_tokens"], cached_prompt_tokens(completion["usage"]))
+
+        # log llm output
+        if logger.isEnabledFor(logging.INFO):
+            log_messages = [f"[{message['role']}] {message['content']}" for message in messages]
+            log_messages.append(f"[assistant] {completion["choices"][0]["message"]["content"]}")
+            logger.info("\n".join(log_messages))
 
+        llm_response = Response(text=content)
+        self._cache_store(messages, max_tokens, llm_response)
+        return llm_response
+    
+    @track_generate
+    async def async_stream(self, messages: List[Dict], max_tokens=2000) -> AsyncGenerator[str, None]:
+        """streams the completion from the NYU endpoint as server-sent events. if the endpoint
+        answers with a plain JSON completion instead, the whole content is yielded at once"""
+        if self.keep_history:
+            messages = self._extend_history(messages)
 
-            return Response(text=content)
-        except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP error: {response}")
+        cached_response = self._cache_lookup(messages, max_tokens)
+        if cached_response is not None:
+            yield cached_response.text
+            return
 
-            if e.response.status_code == 401:
-                logger.warning(f"Double check your auth key: {self.api_key[:10]}...")
+        body = {
+            "messages": messages,
+            "openai_parameters": {
+                "max_tokens": max_tokens,
+                "stream": True,
+                "stream_options": {"include_usage": True},
+            },
+        }
+        client = self.client
 
-            raise e
-        except httpx.ReadTimeout as e:
-            if retries > 0:
-                await asyncio.sleep(backoff_factor * 2 ** (3 - retries))
-                return await self.async_generate(messages, max_tokens, retries - 1, backoff_factor)
-            else:
-                raise e
+        deltas = []
+        usage = None
+        try:
+            async with self._rate_limited(messages, max_tokens) as slot:
+                async with client.stream("POST", self.endpoint_url, headers=self.headers, json=body) as response:
+                    response.raise_for_status()
+
+                    if "text/event-stream" in response.headers.get("content-type", ""):
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                break
+
+                            chunk = json.loads(data)
+                            if chunk.get("usage"):
+                                usage = chunk["usage"]
+                            if chunk.get("choices") and chunk["choices"][0]["delta"].get("content"):
+                                delta = chunk["choices"][0]["delta"]["content"]
+                                deltas.append(delta)
+                                yield delta
+                    else:
+                        # endpoint didn't stream, fall back to the full completion
+                        completion = json.loads(await response.aread())
+                        usage = completion.get("usage")
+                        content = completion["choices"][0]["message"]["content"]
+                        deltas.append(content)
+                        yield content
+
+                if usage is not None:
+                    slot.record(usage["total_tokens"])
         except (httpx.ConnectTimeout, httpx.ConnectError) as e:
             logger.error("Connection error to NYU API: %s", e)
-            # logger.error(f"Error: {e}")
             logger.warning("Did you connect to NYU's VPN?")
             raise e
-        finally:
-            if self._httpx_client is None:
-                await client.aclose()
-    
+
+        content = "".join(deltas)
+        if self.keep_history:
+            self.messages.append({"role": "assistant", "content": content})
+        if usage is not None:
+            self._record_usage(usage["prompt_tokens"], usage["completion_tokens"], cached_prompt_tokens(usage))
+
+        self._cache_store(messages, max_tokens, Response(text=content))
+
+    @track_generate
     def generate(self, messages, max_tokens=2000):
-        return asyncio.run(self.async_generate(messages, max_tokens))
+        # the background loop keeps its connection pool warm between sync calls
+        return run_sync(self.async_generate(messages, max_tokens))
             
 
 class BaseEmbeddingModel(ABC, BaseModel):
     "Custom embedding model interface"
     model_config = ConfigDict(arbitrary_types_allowed=True)
+    coalesce: bool = True # concurrent requests for the same texts share one upstream call
 
     # @abstractmethod
     # def embed(self, text: List[str]) -> List[List[float]]:
@@ -234,102 +769,275 @@ class BaseEmbeddingModel(ABC, BaseModel):
     #     pass
 
     @abstractmethod
-    def async_embed(self, text: List[str]) -> List[List[float]]:
-        """embeds a list of strings asynchronously, and returns a list of embeddings"""
+    def async_embed(self, text: List[str]) -> np.ndarray:
+        """embeds a list of strings asynchronously, and returns a float32 array of shape (len(text), dim)"""
         raise NotImplementedError
 
     @abstractmethod
-    def embed(self, text: List[str]) -> List[List[float]]:
-        """embeds a list of strings, and returns a list of embeddings"""
+    def embed(self, text: List[str]) -> np.ndarray:
+        """embeds a list of strings, and returns a float32 array of shape (len(text), dim)"""
         raise NotImplementedError
 
+    @property
+    def embedding_dim(self) -> int | None:
+        """size of the returned vectors, if known without calling the model"""
+        return getattr(self, "dimensions", None) or EMBEDDING_DIMS.get(getattr(self, "model", None))
+
+    @property
+    def flight_scope(self) -> str:
+        """what decides the vectors besides the texts and output_space (endpoint, credentials). concurrent
+        requests are coalesced only within one scope; by default, within this instance"""
+        return f"{self.__class__.__name__}:{id(self)}"
+
+    @property
+    def output_space(self) -> str:
+        """names the vector space of the embeddings (model, plus dimensions if reduced), e.g. for cache keys"""
+        dimensions = getattr(self, "dimensions", None)
+        return f"{self.model}@{dimensions}" if dimensions else self.model
+
+def truncate_embeddings(embeddings: np.ndarray, dimensions: int) -> np.ndarray:
+    """shorten text-embedding-3 vectors by keeping the first `dimensions` and renormalizing,
+    which is what the api's `dimensions` parameter does"""
+    truncated = np.ascontiguousarray(embeddings[:, :dimensions])
+    norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+    np.divide(truncated, norms, out=truncated, where=norms > 0)
+    return truncated
+
+def decode_embeddings(data: List[Any]) -> np.ndarray:
+    """
+    Copies the embeddings of an openai response (`result.data`) into one contiguous float32 array.
+    Embeddings requested with encoding_format="base64" are decoded with np.frombuffer, so no
+    python floats are created; plain lists of floats are accepted too.
+    """
+    out = None
+    for i, item in enumerate(data):
+        if isinstance(item, dict):
+            embedding, index = item["embedding"], item.get("index")
+        else:
+            embedding, index = item.embedding, getattr(item, "index", None)
+        if isinstance(embedding, str):
+            row = np.frombuffer(base64.b64decode(embedding), dtype=np.float32)
+        else:
+            row = np.asarray(embedding, dtype=np.float32)
+        if out is None:
+            out = np.empty((len(data), row.shape[0]), dtype=np.float32)
+        out[index if index is not None else i] = row
+    return out if out is not None else np.empty((0, 0), dtype=np.float32)
+
+# openai embedding endpoint limits
+OPENAI_EMBEDDING_MAX_INPUTS = 2048 # inputs per request
+OPENAI_EMBEDDING_MAX_REQUEST_TOKENS = 300_000 # tokens per request, summed over inputs
+OPENAI_EMBEDDING_MAX_INPUT_TOKENS = 8191 # tokens per input
+
+@functools.lru_cache(maxsize=1)
+def _embedding_tokenizer():
+    """tiktoken encoding of the openai embedding models, or None without tiktoken (or its BPE file)"""
+    if importlib.util.find_spec("tiktoken") is None:
+        return None
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.debug("tiktoken unavailable, estimating embedding tokens from length: %s", e)
+        return None
+
+def count_embedding_tokens(text: str) -> int:
+    """exact with tiktoken, otherwise a conservative ~3 characters per token"""
+    encoding = _embedding_tokenizer()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return -(-len(text) // 3)
+
+def split_embedding_text(text: str, max_tokens: int) -> List[str]:
+    """cut `text` into consecutive pieces of at most `max_tokens` tokens"""
+    encoding = _embedding_tokenizer()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return [encoding.decode(tokens[i : i + max_tokens]) for i in range(0, len(tokens), max_tokens)] or [text]
+    size = max_tokens * 3
+    return [text[i : i + size] for i in range(0, len(text), size)] or [text]
+
 class OpenAIEmbeddingModel(BaseEmbeddingModel):
     model: Literal["text-embedding-3-small", "text-embedding-3-large"] = "text-embedding-3-small"
     api_key: str = Field(default_factory=lambda x: os.getenv("OPENAI_API_KEY"))
+    base_url: str | None = Field(default_factory=lambda: os.getenv("OPENAI_BASE_URL")) # e.g. a kruppe.mock_server
     sync_client: OpenAI = None
     async_client: AsyncOpenAI = None
+    # requests are packed by token count up to the endpoint limits
+    max_request_tokens: int = OPENAI_EMBEDDING_MAX_REQUEST_TOKENS
+    max_request_inputs: int = OPENAI_EMBEDDING_MAX_INPUTS
+    max_input_tokens: int = OPENAI_EMBEDDING_MAX_INPUT_TOKENS
+    overlong_inputs: Literal["truncate", "split"] = "truncate" # split = embed the pieces and average them
+    dimensions: int | None = None # shorter vectors from the api (text-embedding-3 models), None = full size
+    max_concurrent_requests: int = 8 # packs in flight at once in `async_embed`
 
     def model_post_init(self, __context):
         if self.sync_client is None:
-            self.sync_client = OpenAI(api_key=self.api_key)
+            self.sync_client = OpenAI(api_key=self.api_key, base_url=self.base_url)
         if self.async_client is None:
-            self.async_client = AsyncOpenAI(api_key=self.api_key)
-        
+            self.async_client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+
+    @property
+    def flight_scope(self) -> str:
+        return f"openai:{self.async_client.base_url}:{self.async_client.api_key}"
+
+    def _request_params(self) -> Dict[str, Any]:
+        params = {"model": self.model, "encoding_format": "base64"}
+        if self.dimensions:
+            params["dimensions"] = self.dimensions
+        return params
+
+    def _pack(self, texts: List[str]) -> Tuple[List[List[str]], List[int], List[int]]:
+        """
+        Greedily packs inputs, in order, into requests that stay under `max_request_tokens` and
+        `max_request_inputs`. Over-long inputs are truncated, or split into pieces.
+
+        Returns the packs, plus the index of the text each piece came from and its token count
+        (to put split inputs back together).
+        """
+        packs, owners, weights = [[]], [], []
+        pack_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = count_embedding_tokens(text)
+            pieces = [text]
+            if tokens > self.max_input_tokens:
+                pieces = split_embedding_text(text, self.max_input_tokens)
+                if self.overlong_inputs == "truncate":
+                    logger.warning("Truncating embedding input %d from %d to %d tokens", i, tokens, self.max_input_tokens)
+                    pieces = pieces[:1]
+
+            for piece in pieces:
+                piece_tokens = tokens if piece is text else count_embedding_tokens(piece)
+                if packs[-1] and (pack_tokens + piece_tokens > self.max_request_tokens or len(packs[-1]) >= self.max_request_inputs):
+                    packs.append([])
+                    pack_tokens = 0
+                packs[-1].append(piece)
+                pack_tokens += piece_tokens
+                owners.append(i)
+                weights.append(piece_tokens)
+        return packs, owners, weights
+
+    @staticmethod
+    def _unpack(n: int, owners: List[int], weights: List[int], embeddings: np.ndarray) -> np.ndarray:
+        if len(owners) == n:
+            return embeddings
+
+        # average the pieces of split inputs, weighted by length, and renormalize like the api does
+        combined = np.zeros((n, embeddings.shape[1]), dtype=np.float32)
+        np.add.at(combined, owners, embeddings * np.asarray(weights, dtype=np.float32)[:, None])
+        combined /= np.linalg.norm(combined, axis=1, keepdims=True)
+        return combined
 
     # TODO: work on "retry" when encountered error
-    def embed(self, text: List[str] | List[Embeddable]) -> List[List[float]]:
+    def embed(self, text: List[str] | List[Embeddable]) -> np.ndarray:
         if isinstance(text[0], Embeddable):
             text = [x.text for x in text]
 
-        embeddings = []
-        for i in range(0, len(text), 100):
-            result = self.sync_client.embeddings.create(input=text[i : i + 100], model=self.model)
-            embeddings.extend([x.embedding for x in result.data])
-
-        return embeddings
+        packs, owners, weights = self._pack(text)
+        embeddings = np.concatenate([
+            decode_embeddings(self.sync_client.embeddings.create(input=pack, **self._request_params()).data)
+            for pack in packs
+        ])
+        return self._unpack(len(text), owners, weights, embeddings)
     
-    async def async_embed(self, text: List[str] | List[Embeddable]) -> List[List[float]]:
+    @single_flight_embed
+    async def async_embed(self, text: List[str] | List[Embeddable]) -> np.ndarray:
         if isinstance(text[0], Embeddable):
             text = [x.text for x in text]
             
-        # batch requests so that we don't have a list that is too large
-        tasks = []
-        for i in range(0, len(text), 100):
-            tasks.append(self.async_client.embeddings.create(input=text[i : i + 100], model=self.model))
-        results = await asyncio.gather(*tasks)
-        return [x.embedding for result in results for x in result.data]
+        packs, owners, weights = self._pack(text)
+        semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+
+        async def send(pack: List[str]) -> np.ndarray:
+            async with semaphore:
+                result = await self.async_client.embeddings.create(input=pack, **self._request_params())
+            return decode_embeddings(result.data)
+
+        results = await asyncio.gather(*(send(pack) for pack in packs))
+        embeddings = np.concatenate(results) if len(results) > 1 else results[0]
+        return self._unpack(len(text), owners, weights, embeddings)
 
 class NYUOpenAIEmbeddingModel(BaseEmbeddingModel, BaseNYUModel):
     model: Literal['api-embedding-openai-text-embed-3-small'] = 'api-embedding-openai-text-embed-3-small'
     endpoint_url: str = Field(default_factory=lambda: os.getenv("NYU_ENDPOINT_URL_EMBEDDING"))
+    max_in_flight: int = 100 # the endpoint takes one text per request, so keep this many requests going at once
+    max_retries: int = 3 # per text, on read timeouts, 429s and 5xx responses
+    backoff_factor: float = 0.3
+    dimensions: int | None = None # the endpoint has no `dimensions` parameter, so vectors are truncated here
+    _last_embed_stats: Dict[str, Any] = PrivateAttr(default_factory=dict)
+
+    @property
+    def flight_scope(self) -> str:
+        return self._endpoint_scope()
+
+    @property
+    def last_embed_stats(self) -> Dict[str, Any]:
+        """throughput of the last `async_embed` call: texts, seconds, texts_per_second, retries"""
+        return dict(self._last_embed_stats)
     
-    async def async_embed(self, text: List[str] | List[Embeddable]) -> List[List[float]]:
+    @single_flight_embed
+    async def async_embed(self, text: List[str] | List[Embeddable]) -> np.ndarray:
+        if not text:
+            return np.empty((0, self.embedding_dim), dtype=np.float32)
         if isinstance(text[0], Embeddable):
             text = [x.text for x in text]
             
-        async def send_embedding_request(line: str, client: httpx.AsyncClient, retries=3, backoff_factor=0.3):
-            try:
-                response = await client.post(
-                    self.endpoint_url,
-                    headers=self.headers,
-                    json={"text": line},
-                )
-                response.raise_for_status()
-                data = response.json()
-                return data["embedding"]
-            except httpx.HTTPStatusError as e:
-                logger.error(f"HTTP error: {e}")
-                if e.response.status_code == 401:
-                    logger.warning(f"Double check your auth key: {self.api_key[:10]}...")
+        client = self.client
+        embeddings: List[np.ndarray | None] = [None] * len(text)
+        queue = iter(range(len(text)))
+        stats = {"texts": len(text), "done": 0, "retries": 0}
+        start = time.monotonic()
 
-                raise e
-            except httpx.ReadTimeout as e:
-                if retries > 0:
-                    await asyncio.sleep(backoff_factor * 2 ** (3 - retries))
-                    return await send_embedding_request(line, client, retries - 1, backoff_factor * 2)
-                else:
+        async def send_embedding_request(line: str) -> np.ndarray:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await self._post(client, {"text": line})
+                    return np.asarray(response.json()["embedding"], dtype=np.float32)
+                except httpx.HTTPStatusError as e:
+                    status = e.response.status_code
+                    if not (status == 429 or status >= 500) or attempt >= self.max_retries:
+                        logger.error(f"HTTP error: {e}")
+                        if status == 401:
+                            logger.warning(f"Double check your auth key: {self.api_key[:10]}...")
+                        raise e
+                except httpx.ReadTimeout as e:
+                    if attempt >= self.max_retries:
+                        raise e
+                except (httpx.ConnectTimeout, httpx.ConnectError) as e:
+                    logger.error("Connection error to NYU API: %s", e)
+                    logger.warning("Did you connect to NYU's VPN?")
                     raise e
-            except (httpx.ConnectTimeout, httpx.ConnectError) as e:
-                logger.error("Connection error to NYU API: %s", e)
-                # logger.error(f"Error: {e}")
-                logger.warning("Did you connect to NYU's VPN?")
-                raise e
-        
-         # init httpx client if not initialized in the model
-        client = self._httpx_client or init_httpx_client()
-        
-        try:
-            # batch requests so that we don't have a list that is too large
-            embeddings = []
-            for i in range(0, len(text), 100):
-                results = await asyncio.gather(*[send_embedding_request(line, client) for line in text[i : i + 100]])
-                embeddings.extend(results)
+                stats["retries"] += 1
+                await asyncio.sleep(self.backoff_factor * 2 ** attempt)
 
-            return embeddings
+        async def worker():
+            # sliding window: each worker takes the next text as soon as its last request is done,
+            # so one slow request doesn't hold up a whole wave
+            for i in queue:
+                embeddings[i] = await send_embedding_request(text[i])
+                stats["done"] += 1
+                if stats["done"] % 1000 == 0:
+                    logger.info("Embedded %d/%d texts (%.1f texts/s)", stats["done"], len(text), stats["done"] / (time.monotonic() - start))
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(min(self.max_in_flight, len(text)))]
+        try:
+            await asyncio.gather(*workers)
         finally:
-            if self._httpx_client is None:
-                await client.aclose()
+            for w in workers:
+                w.cancel()
+
+        elapsed = time.monotonic() - start
+        self._last_embed_stats = {
+            "texts": len(text),
+            "seconds": elapsed,
+            "texts_per_second": len(text) / elapsed if elapsed > 0 else float("inf"),
+            "retries": stats["retries"],
+            "max_in_flight": self.max_in_flight,
+        }
+        logger.info("Embedded %d texts in %.1fs (%.1f texts/s, %d retries)", len(text), elapsed, self._last_embed_stats["texts_per_second"], stats["retries"])
+        embeddings = np.stack(embeddings)
+        return truncate_embeddings(embeddings, self.dimensions) if self.dimensions else embeddings
 
-    def embed(self, text: List[str] | List[Embeddable]) -> List[List[float]]:
-        return asyncio.run(self.async_embed(text))
+    def embed(self, text: List[str] | List[Embeddable]) -> np.ndarray:
+        return run_sync(self.async_embed(text))
             
\ No newline at end of file
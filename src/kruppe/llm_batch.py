@@ -0,0 +1,364 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from uuid import uuid4
+from typing import List, Dict, Any, Callable, Literal
+from pydantic import BaseModel, ConfigDict, Field
+from openai import AsyncOpenAI
+
+from kruppe.llm import BaseLLM, OpenAILLM, cached_prompt_tokens
+from kruppe.llm_cache import _normalize_message
+from kruppe.llm_telemetry import track_llm_call
+from kruppe.models import Response
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_DIR = os.path.join(os.path.expanduser("~"), ".cache", "kruppe", "batches")
+
+BatchStatus = Literal["in_progress", "completed", "failed", "expired", "cancelled"]
+
+# --------------------------------------------
+# ------------ BATCH BACKENDS ------------
+# --------------------------------------------
+
+class BaseBatchBackend(ABC, BaseModel):
+    """Where batch files get submitted to. Input/output lines use the OpenAI batch JSONL format."""
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @abstractmethod
+    async def submit(self, input_path: str) -> str:
+        """submit a JSONL batch file, return the batch id"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def status(self, batch_id: str) -> BatchStatus:
+        """current status of the batch"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        """output lines of a finished batch (successes and errors). for a batch that didn't complete,
+        the lines of the requests it did finish"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def cancel(self, batch_id: str) -> None:
+        """stop the batch; requests it already finished are still returned by `results`"""
+        raise NotImplementedError
+
+
+class OpenAIBatchBackend(BaseBatchBackend):
+    """OpenAI Batch API (https://platform.openai.com/docs/guides/batch)"""
+    async_client: AsyncOpenAI = Field(default_factory=lambda: AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY")))
+    completion_window: str = "24h"
+
+    async def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            input_file = await self.async_client.files.create(file=f, purpose="batch")
+
+        batch = await self.async_client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    async def status(self, batch_id: str) -> BatchStatus:
+        batch = await self.async_client.batches.retrieve(batch_id)
+        if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            return "in_progress"
+        return batch.status
+
+    async def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        batch = await self.async_client.batches.retrieve(batch_id)
+
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id is None:
+                continue
+            content = await self.async_client.files.content(file_id)
+            lines.extend(json.loads(line) for line in content.text.splitlines() if line.strip())
+        return lines
+
+    async def cancel(self, batch_id: str) -> None:
+        await self.async_client.batches.cancel(batch_id)
+
+
+def echo_responder(body: Dict[str, Any]) -> str:
+    """default responder of the local stand-in: echoes the last message"""
+    return f"echo: {body['messages'][-1]['content']}"
+
+
+class LocalBatchBackend(BaseBatchBackend):
+    """
+    File-based stand-in for a batch server, for offline runs and tests.
+
+    Each batch is a directory under `directory` holding `input.jsonl`, `status.json` and, once
+    processed, `output.jsonl`. Bodies are answered by `responder`. With `auto_process` the batch is
+    processed on the first poll after `processing_delay` seconds; without it, something else has to
+    process the directory, e.g. `python -m kruppe.llm_batch <directory>`.
+    """
+    directory: str = Field(default_factory=lambda: os.path.join(DEFAULT_BATCH_DIR, "local"))
+    responder: Callable[[Dict[str, Any]], str] = echo_responder
+    processing_delay: float = 0.0
+    auto_process: bool = True
+
+    def _batch_dir(self, batch_id: str) -> str:
+        return os.path.join(self.directory, batch_id)
+
+    def _write_status(self, batch_id: str, status: str):
+        path = os.path.join(self._batch_dir(batch_id), "status.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"status": status, "updated_at": time.time()}, f)
+        os.replace(path + ".tmp", path) # atomic, so a poller never reads half a file
+
+    def _read_status(self, batch_id: str) -> Dict[str, Any]:
+        with open(os.path.join(self._batch_dir(batch_id), "status.json")) as f:
+            return json.load(f)
+
+    async def submit(self, input_path: str) -> str:
+        batch_id = f"batch_{uuid4().hex}"
+        os.makedirs(self._batch_dir(batch_id))
+        with open(input_path) as src, open(os.path.join(self._batch_dir(batch_id), "input.jsonl"), "w") as dst:
+            dst.write(src.read())
+        self._write_status(batch_id, "in_progress")
+        return batch_id
+
+    async def status(self, batch_id: str) -> BatchStatus:
+        status = self._read_status(batch_id)
+        if (
+            status["status"] == "in_progress"
+            and self.auto_process
+            and time.time() - status["updated_at"] >= self.processing_delay
+        ):
+            self.process(batch_id)
+            status = self._read_status(batch_id)
+        return status["status"]
+
+    async def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        path = os.path.join(self._batch_dir(batch_id), "output.jsonl")
+        if not os.path.exists(path): # cancelled before it was processed
+            return []
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    async def cancel(self, batch_id: str) -> None:
+        if self._read_status(batch_id)["status"] == "in_progress":
+            self._write_status(batch_id, "cancelled")
+
+    def process(self, batch_id: str) -> None:
+        """answer every request of the batch and mark it completed"""
+        with open(os.path.join(self._batch_dir(batch_id), "input.jsonl")) as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+
+        with open(os.path.join(self._batch_dir(batch_id), "output.jsonl"), "w") as f:
+            for request in requests:
+                try:
+                    content = self.responder(request["body"])
+                    prompt_tokens = sum(len(m["content"] or "") for m in request["body"]["messages"]) // 4
+                    completion_tokens = len(content) // 4
+                    line = {
+                        "id": f"batch_req_{uuid4().hex}",
+                        "custom_id": request["custom_id"],
+                        "response": {
+                            "status_code": 200,
+                            "body": {
+                                "model": request["body"].get("model"),
+                                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                                "usage": {
+                                    "prompt_tokens": prompt_tokens,
+                                    "completion_tokens": completion_tokens,
+                                    "total_tokens": prompt_tokens + completion_tokens,
+                                },
+                            },
+                        },
+                        "error": None,
+                    }
+                except Exception as e:
+                    line = {
+                        "id": f"batch_req_{uuid4().hex}",
+                        "custom_id": request["custom_id"],
+                        "response": None,
+                        "error": {"code": "responder_error", "message": str(e)},
+                    }
+                f.write(json.dumps(line) + "\n")
+
+        self._write_status(batch_id, "completed")
+
+    def process_pending(self) -> int:
+        """process every batch that is still in progress. returns number processed"""
+        if not os.path.isdir(self.directory):
+            return 0
+
+        processed = 0
+        for batch_id in os.listdir(self.directory):
+            if os.path.exists(os.path.join(self._batch_dir(batch_id), "status.json")) \
+                    and self._read_status(batch_id)["status"] == "in_progress":
+                self.process(batch_id)
+                processed += 1
+        return processed
+
+# --------------------------------------------
+# ------------ BATCH LLM ------------
+# --------------------------------------------
+
+class BatchLLM(BaseLLM):
+    """
+    Runs `batch_async_generate` through a provider batch API instead of one request per prompt.
+    Batches are cheaper and don't touch the interactive rate limits, but can take hours, so only
+    use this for bulk jobs (e.g. contextualizing chunks during ingest).
+
+    Single calls (`generate`, `async_generate`, `async_stream`) go to the wrapped `llm`. So do batch
+    items that fail or that a batch didn't finish (it failed, expired, or ran past `timeout` and was
+    cancelled), and batches smaller than `min_batch_size`. Cancelling the awaiting task cancels the
+    batch too, so it isn't billed for requests nobody will read.
+    """
+    llm: BaseLLM
+    model: str = None # taken from `llm`
+    backend: BaseBatchBackend = None # defaults to the OpenAI batch API for OpenAILLM
+    batch_dir: str = DEFAULT_BATCH_DIR # where input files are written
+    poll_interval: float = 30.0 # seconds
+    timeout: float | None = 24 * 60 * 60 # seconds
+    cancel_timeout: float = 10 * 60 # seconds to wait for a batch cancelled on timeout to hand back what it finished
+    min_batch_size: int = 1
+    retry_failed: bool = True # retry failed batch items with the interactive llm
+
+    def model_post_init(self, __context):
+        if self.model is None:
+            self.model = self.llm.model
+        if self.backend is None:
+            if not isinstance(self.llm, OpenAILLM):
+                raise ValueError(f"No default batch backend for {self.llm.__class__.__name__}. Pass `backend`.")
+            self.backend = OpenAIBatchBackend(async_client=self.llm.async_client)
+
+    async def async_generate(self, messages: List[Dict], max_tokens=2000) -> Response:
+        return await self.llm.async_generate(messages, max_tokens=max_tokens)
+
+    def generate(self, messages: List[Dict], max_tokens=2000) -> Response:
+        return self.llm.generate(messages, max_tokens=max_tokens)
+
+    async def async_stream(self, messages: List[Dict], max_tokens=2000):
+        async for delta in self.llm.async_stream(messages, max_tokens=max_tokens):
+            yield delta
+
+    async def batch_async_generate(self, messages_list: List[List[Dict]], max_tokens=2000) -> List[Response]:
+        responses: List[Response | None] = [self._cache_lookup(messages, max_tokens) for messages in messages_list]
+        pending = [i for i, response in enumerate(responses) if response is None]
+
+        if len(pending) < self.min_batch_size:
+            return await self._fill_interactively(responses, messages_list, pending, max_tokens)
+
+        # write requests to a JSONL file. custom_id maps results back to their position
+        os.makedirs(self.batch_dir, exist_ok=True)
+        input_path = os.path.join(self.batch_dir, f"input_{uuid4().hex}.jsonl")
+        with open(input_path, "w") as f:
+            for i in pending:
+                request = {
+                    "custom_id": f"request-{i}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": self.model,
+                        "messages": [_normalize_message(m) for m in messages_list[i]],
+                        "max_tokens": max_tokens,
+                    },
+                }
+                f.write(json.dumps(request) + "\n")
+
+        # one telemetry record for the whole batch, priced at the batch discount
+        failed = set(pending)
+        timed_out = False
+        try:
+            with track_llm_call(self, kind="batch"):
+                self._count_attempt()
+                batch_id = await self.backend.submit(input_path)
+                logger.info("Submitted batch %s with %d requests", batch_id, len(pending))
+
+                try:
+                    status = await self._wait(batch_id, self.timeout)
+                except asyncio.CancelledError:
+                    # nobody will read this batch any more, so stop it running up the bill
+                    await asyncio.shield(self._cancel(batch_id))
+                    raise
+                if status == "in_progress":
+                    timed_out = True
+                    logger.error("Batch %s did not finish within %s seconds, cancelling it", batch_id, self.timeout)
+                    await self._cancel(batch_id)
+                    status = await self._wait(batch_id, self.cancel_timeout)
+
+                # failed, expired and cancelled batches can still hold finished requests, which are paid for
+                for line in await self.backend.results(batch_id):
+                    i = int(line["custom_id"].split("-")[-1])
+                    response = line.get("response")
+                    if not response or response.get("status_code") != 200:
+                        logger.warning("Batch request %s failed: %s", line["custom_id"], line.get("error"))
+                        continue
+
+                    body = response["body"]
+                    responses[i] = Response(text=body["choices"][0]["message"]["content"])
+                    usage = body.get("usage")
+                    if usage:
+                        self._record_usage(usage["prompt_tokens"], usage["completion_tokens"], cached_prompt_tokens(usage))
+                    self._cache_store(messages_list[i], max_tokens, responses[i])
+                    failed.discard(i)
+        finally:
+            os.remove(input_path) # on timeouts and backend errors too
+
+        if status != "completed":
+            logger.error("Batch %s ended with status %s", batch_id, status)
+            if not self.retry_failed:
+                if timed_out:
+                    raise TimeoutError(f"Batch {batch_id} did not finish within {self.timeout} seconds")
+                raise RuntimeError(f"Batch {batch_id} ended with status {status}")
+
+        if failed:
+            if not self.retry_failed:
+                raise RuntimeError(f"{len(failed)} requests failed in batch {batch_id}")
+            logger.warning("Retrying %d failed batch requests interactively", len(failed))
+            return await self._fill_interactively(responses, messages_list, sorted(failed), max_tokens)
+        return responses
+
+    async def _wait(self, batch_id: str, timeout: float | None) -> BatchStatus:
+        """poll until the batch ends; "in_progress" if it is still running after `timeout` seconds"""
+        start = time.monotonic()
+        while True:
+            status = await self.backend.status(batch_id)
+            if status != "in_progress":
+                return status
+            if timeout is not None and time.monotonic() - start > timeout:
+                return status
+            await asyncio.sleep(self.poll_interval)
+
+    async def _cancel(self, batch_id: str) -> None:
+        try:
+            await self.backend.cancel(batch_id)
+        except Exception as e:
+            logger.warning("Could not cancel batch %s: %s", batch_id, e)
+
+    async def _fill_interactively(
+        self,
+        responses: List[Response | None],
+        messages_list: List[List[Dict]],
+        indices: List[int],
+        max_tokens: int
+    ) -> List[Response]:
+        results = await self.llm.batch_async_generate([messages_list[i] for i in indices], max_tokens=max_tokens)
+        for i, response in zip(indices, results):
+            responses[i] = response
+        return responses
+
+
+if __name__ == "__main__":
+    # run the local stand-in as a "server": python -m kruppe.llm_batch <directory> [poll seconds]
+    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join(DEFAULT_BATCH_DIR, "local")
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    server = LocalBatchBackend(directory=directory, auto_process=False)
+    print(f"Processing batches in {directory}")
+    while True:
+        if server.process_pending():
+            print("Processed pending batches")
+        time.sleep(interval)
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import List, Dict, Any
+from pydantic import BaseModel, Field, PrivateAttr, ConfigDict, computed_field
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LLM_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "kruppe", "llm_cache.sqlite")
+
+
+def _normalize_message(message: Dict | Any) -> Dict[str, Any]:
+    """keep only what changes the completion. history messages can be openai message objects"""
+    if isinstance(message, dict):
+        return {"role": message.get("role"), "content": message.get("content")}
+    return {"role": getattr(message, "role", None), "content": getattr(message, "content", None)}
+
+
+def make_cache_key(model: str, messages: List[Dict], max_tokens: int) -> str:
+    """content address of a request: sha256 over model, messages and max_tokens"""
+    payload = json.dumps(
+        {
+            "model": model,
+            "messages": [_normalize_message(m) for m in messages],
+            "max_tokens": max_tokens,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache(BaseModel):
+    """
+    Persistent, content-addressed cache for LLM completions, stored in a sqlite file.
+
+    Entries are keyed by `make_cache_key` (model, messages, max_tokens). Entries older than `ttl`
+    seconds are treated as misses and purged, and once the cache holds more than `max_entries`
+    the least recently used entries are evicted.
+
+    Setting `bypass` (or env var KRUPPE_LLM_CACHE_BYPASS=1) skips lookups, but fresh completions
+    are still written, so a bypassed run refreshes the cache.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    path: str = Field(default_factory=lambda: os.getenv("KRUPPE_LLM_CACHE_PATH", DEFAULT_LLM_CACHE_PATH))
+    ttl: float | None = None # seconds, None = never expire
+    max_entries: int | None = 100_000 # None = unbounded
+    bypass: bool = Field(default_factory=lambda: os.getenv("KRUPPE_LLM_CACHE_BYPASS", "") == "1")
+    _conn: sqlite3.Connection = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+    _evictions: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context):
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        # llm calls can come from different threads (gradio, sync wrappers), so guard with our own lock
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+        self._conn.commit()
+
+    @computed_field
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @computed_field
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @computed_field
+    @property
+    def hit_rate(self) -> float:
+        total = self._hits + self._misses
+        return self._hits / total if total else 0.0
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def get(self, key: str) -> str | None:
+        """returns cached response text, or None on a miss (or when bypassed)"""
+        if self.bypass:
+            return None
+
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                # expired, drop it now rather than waiting for the next eviction pass
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self._evictions += 1
+                row = None
+
+            if row is None:
+                self._misses += 1
+                return None
+
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._hits += 1
+            return row[0]
+
+    def set(self, key: str, response: str, model: str = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, response, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now),
+            )
+            self._conn.commit()
+        self.evict()
+
+    def evict(self) -> int:
+        """remove expired entries, then least recently used entries above `max_entries`. returns number removed"""
+        removed = 0
+        with self._lock:
+            if self.ttl is not None:
+                cur = self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+                removed += cur.rowcount
+
+            if self.max_entries is not None:
+                count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+                overflow = count - self.max_entries
+                if overflow > 0:
+                    cur = self._conn.execute(
+                        "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed_at ASC LIMIT ?)",
+                        (overflow,),
+                    )
+                    removed += cur.rowcount
+
+            if removed:
+                self._conn.commit()
+                self._evictions += removed
+                logger.debug("Evicted %d entries from LLM cache", removed)
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self._evictions,
+            "size": self.size(),
+        }
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
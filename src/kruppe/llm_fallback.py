@@ -0,0 +1,132 @@
+import logging
+from typing import List, Dict, AsyncGenerator
+from pydantic import Field
+import httpx
+from openai import APIConnectionError
+
+from kruppe.llm import BaseLLM
+from kruppe.circuit_breaker import CircuitBreaker, CircuitOpenError, get_circuit_breaker
+from kruppe.models import Response
+
+logger = logging.getLogger(__name__)
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    """connection errors, timeouts, 5xx and 429s, i.e. the backend is down or overloaded. anything
+    else (400/401/422, prompts that are too long, bugs in the caller) would fail on every backend"""
+    if isinstance(error, (httpx.TransportError, APIConnectionError, TimeoutError)):
+        return True
+    # openai errors carry `status_code`, httpx errors `response.status_code`
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+class FallbackLLM(BaseLLM):
+    """
+    Tries `llms` in order (e.g. NYU, then OpenAI) and returns the first answer. A call that fails on
+    one backend fails over to the next one within the same request.
+
+    Each backend has a circuit breaker, shared by every FallbackLLM in the process (see
+    kruppe.circuit_breaker). After `failure_threshold` consecutive failures the backend is skipped
+    for `cooldown` seconds, then a single trial request decides whether it is back. Breaker state
+    shows up in `get_telemetry().to_prometheus()`.
+
+    Only backend failures (see `is_backend_failure`) fail over and count against the breaker; other
+    errors, like a 400 for a malformed request, are raised as they are.
+
+    Retries, caching, rate limiting and telemetry are done by the wrapped llms.
+    """
+    llms: List[BaseLLM] = Field(min_length=1)
+    model: str = None # taken from the first llm
+    # breaker settings, used when a backend's breaker is first created (see `configure_circuit_breaker`)
+    failure_threshold: int = 5
+    cooldown: float = 30.0 # seconds
+
+    def model_post_init(self, __context):
+        if self.model is None:
+            self.model = self.llms[0].model
+
+    def breaker(self, llm: BaseLLM) -> CircuitBreaker:
+        return get_circuit_breaker(
+            f"{llm.provider}:{llm.model}",
+            failure_threshold=self.failure_threshold,
+            cooldown=self.cooldown,
+        )
+
+    def _available(self):
+        """(llm, breaker) pairs whose circuit lets a request through, in order"""
+        skipped = []
+        for llm in self.llms:
+            breaker = self.breaker(llm)
+            if breaker.allow():
+                yield llm, breaker
+            else:
+                skipped.append(breaker.name)
+        if skipped:
+            logger.debug("Skipped backends with open circuits: %s", ", ".join(skipped))
+
+    def _fail(self, breaker: CircuitBreaker, error: Exception):
+        breaker.record_failure()
+        logger.warning("%s failed (%s: %s), falling back", breaker.name, type(error).__name__, error)
+
+    def _raise(self, error: Exception | None):
+        if error is None:
+            raise CircuitOpenError(f"All backends have open circuits: {[self.breaker(llm).name for llm in self.llms]}")
+        raise error
+
+    async def async_generate(self, messages: List[Dict], max_tokens=2000) -> Response:
+        error = None
+        for llm, breaker in self._available():
+            try:
+                response = await llm.async_generate(messages, max_tokens=max_tokens)
+            except Exception as e:
+                if not is_backend_failure(e):
+                    raise
+                self._fail(breaker, e)
+                error = e
+                continue
+            breaker.record_success()
+            return response
+        self._raise(error)
+
+    def generate(self, messages: List[Dict], max_tokens=2000) -> Response:
+        error = None
+        for llm, breaker in self._available():
+            try:
+                response = llm.generate(messages, max_tokens=max_tokens)
+            except Exception as e:
+                if not is_backend_failure(e):
+                    raise
+                self._fail(breaker, e)
+                error = e
+                continue
+            breaker.record_success()
+            return response
+        self._raise(error)
+
+    async def async_stream(self, messages: List[Dict], max_tokens=2000) -> AsyncGenerator[str, None]:
+        """fails over only if the backend breaks before its first delta. a stream that breaks
+        halfway raises, since the caller has already seen part of the answer"""
+        error = None
+        for llm, breaker in self._available():
+            started = False
+            try:
+                async for delta in llm.async_stream(messages, max_tokens=max_tokens):
+                    started = True
+                    yield delta
+            except Exception as e:
+                if not is_backend_failure(e):
+                    raise
+                if started:
+                    breaker.record_failure()
+                    raise
+                self._fail(breaker, e)
+                error = e
+                continue
+            breaker.record_success()
+            return
+        self._raise(error)
+
+    def price(self):
+        """session cost in USD across all backends"""
+        return sum(llm.price() for llm in self.llms)
@@ -0,0 +1,88 @@
+import logging
+from typing import List, Dict, Callable, Any
+from pydantic import BaseModel, ConfigDict
+
+from kruppe.rate_limit import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# marks the system message that holds the summary of evicted turns, so the next trim can fold it in
+HISTORY_SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+def _role(message) -> str | None:
+    return message.get("role") if isinstance(message, dict) else getattr(message, "role", None)
+
+
+def _content(message) -> str:
+    content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+    return content or ""
+
+
+def _is_summary(message) -> bool:
+    return _role(message) == "system" and _content(message).startswith(HISTORY_SUMMARY_PREFIX)
+
+
+def split_turns(messages: List[Dict]) -> List[List[Dict]]:
+    """group messages into turns. a turn starts at a user message and holds the replies (and tool calls) after it"""
+    turns = []
+    for message in messages:
+        if _role(message) == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+class HistoryBudget(BaseModel):
+    """
+    Keeps a conversation within a token budget, so per-call prompt size stays flat as a session grows.
+
+    `trim` keeps the leading system messages and the most recent turns that fit in `max_tokens`
+    (and `max_turns`). The latest turn is always kept. Older turns are dropped, or, if `summarizer`
+    is set, folded into a summary message right after the system messages. The summarizer gets
+    the previous summary (if any) plus the evicted messages and returns the new summary text.
+
+    Tokens are estimated locally (~4 characters per token, see kruppe.rate_limit).
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+    max_tokens: int = 8000
+    max_turns: int | None = None
+    summarizer: Callable[[List[Dict]], str] | None = None
+
+    @staticmethod
+    def count_tokens(messages: List[Dict]) -> int:
+        return estimate_tokens(messages)
+
+    def trim(self, messages: List[Any]) -> List[Any]:
+        """returns `messages` cut down to the budget. does not modify `messages`"""
+        pinned = []
+        for message in messages:
+            if _role(message) != "system":
+                break
+            pinned.append(message)
+        summaries = [m for m in pinned if _is_summary(m)]
+        pinned = [m for m in pinned if not _is_summary(m)]
+        turns = split_turns(messages[len(pinned) + len(summaries):])
+
+        budget = self.max_tokens - self.count_tokens(pinned) - self.count_tokens(summaries)
+        kept = []
+        for turn in reversed(turns):
+            if kept and (
+                self.count_tokens(turn) > budget
+                or (self.max_turns is not None and len(kept) >= self.max_turns)
+            ):
+                break
+            kept.append(turn)
+            budget -= self.count_tokens(turn)
+        kept.reverse()
+
+        evicted = [message for turn in turns[:len(turns) - len(kept)] for message in turn]
+        if not evicted:
+            return list(messages)
+
+        logger.debug("Evicting %d of %d turns from the history", len(turns) - len(kept), len(turns))
+        if self.summarizer is not None:
+            summary = self.summarizer(summaries + evicted)
+            summaries = [{"role": "system", "content": HISTORY_SUMMARY_PREFIX + summary}]
+
+        return pinned + summaries + [message for turn in kept for message in turn]
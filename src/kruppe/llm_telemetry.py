@@ -0,0 +1,383 @@
+import json
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Any, Tuple
+from pydantic import BaseModel, PrivateAttr, computed_field
+
+from kruppe.circuit_breaker import circuit_breaker_stats
+
+logger = logging.getLogger(__name__)
+
+# USD per 1M tokens. models served through the NYU gateway are priced at the OpenAI list price
+# of the underlying model, so spend is comparable across providers
+PRICE_CATALOG: Dict[str, Dict[str, float]] = {
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "text-embedding-3-small": {"input": 0.02, "output": 0.0},
+    "text-embedding-3-large": {"input": 0.13, "output": 0.0},
+    "api-embedding-openai-text-embed-3-small": {"input": 0.02, "output": 0.0},
+}
+BATCH_DISCOUNT = 0.5 # batch api calls cost half
+
+DEFAULT_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0) # seconds
+
+
+def set_price(model: str, input: float, output: float, cached_input: float | None = None) -> None:
+    """add or override a catalog entry (USD per 1M tokens)"""
+    PRICE_CATALOG[model] = {"input": input, "output": output}
+    if cached_input is not None:
+        PRICE_CATALOG[model]["cached_input"] = cached_input
+
+
+def price_for(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0, batch: bool = False) -> float:
+    """cost in USD from the price catalog. unknown models cost 0 (and log a warning once)"""
+    prices = PRICE_CATALOG.get(model)
+    if prices is None:
+        if model not in _unpriced_models:
+            _unpriced_models.add(model)
+            logger.warning("No price catalog entry for model %s, cost is reported as 0", model)
+        return 0.0
+
+    # cached prompt tokens are part of prompt_tokens, billed at the cached rate when there is one
+    cached_tokens = min(cached_tokens, prompt_tokens)
+    cached_rate = prices.get("cached_input", prices["input"])
+    cost = (
+        (prompt_tokens - cached_tokens) * prices["input"]
+        + cached_tokens * cached_rate
+        + completion_tokens * prices["output"]
+    ) / 1_000_000
+    return cost * BATCH_DISCOUNT if batch else cost
+
+_unpriced_models = set()
+
+
+class LLMCallRecord(BaseModel):
+    """one llm call, as seen by the caller: retries are folded into the same record"""
+    model: str
+    provider: str
+    kind: str = "generate" # generate, stream or batch
+    caller: str | None = None
+    template: str | None = None
+    started_at: float
+    latency: float = 0.0 # seconds, including retries
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    attempts: int = 0 # upstream requests made, 0 when served from the response cache
+    error: str | None = None # exception class name if the call failed
+    cost: float = 0.0
+    _owner: int = PrivateAttr(default=None)
+
+    @computed_field
+    @property
+    def retries(self) -> int:
+        return max(0, self.attempts - 1)
+
+    @computed_field
+    @property
+    def cache_hit(self) -> bool:
+        return self.attempts == 0 and self.error is None
+
+
+class _Series:
+    """running aggregate of the records with the same labels"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.cost = 0.0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def add(self, record: LLMCallRecord):
+        self.count += 1
+        self.errors += record.error is not None
+        self.retries += record.retries
+        self.cache_hits += record.cache_hit
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.cached_tokens += record.cached_tokens
+        self.cost += record.cost
+        self.latency_sum += record.latency
+        self.latency_max = max(self.latency_max, record.latency)
+        for i, bound in enumerate(self.buckets):
+            if record.latency <= bound:
+                self.bucket_counts[i] += 1
+
+    def quantile(self, q: float) -> float | None:
+        """estimate from the histogram buckets (upper bound of the bucket holding the quantile)"""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            if count >= rank:
+                return bound
+        return self.latency_max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.count,
+            "errors": self.errors,
+            "retries": self.retries,
+            "cache_hits": self.cache_hits,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_token_ratio": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+            "cost": self.cost,
+            "latency_sum": self.latency_sum,
+            "latency_mean": self.latency_sum / self.count if self.count else None,
+            "latency_p50": self.quantile(0.5),
+            "latency_p95": self.quantile(0.95),
+            "latency_max": self.latency_max,
+            "latency_buckets": dict(zip([str(b) for b in self.buckets], self.bucket_counts)),
+        }
+
+
+LABELS = ("provider", "model", "caller", "template", "kind")
+
+
+class LLMTelemetry:
+    """
+    Collects an LLMCallRecord for every llm call and keeps per-label aggregates
+    (provider, model, caller, template, kind): call/error/retry counts, token counters,
+    cost and a latency histogram. The last `max_records` raw records are kept as well.
+
+    Export with `to_json` or `to_prometheus`; `summary(by=...)` rolls the series up, e.g.
+    by caller to see which stage dominates wall time and spend.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS, max_records: int = 10_000):
+        self.buckets = tuple(sorted(buckets))
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], _Series] = {}
+        self._records = deque(maxlen=max_records)
+
+    def record(self, record: LLMCallRecord) -> None:
+        if not self.enabled:
+            return
+        key = tuple(getattr(record, label) or "" for label in LABELS)
+        with self._lock:
+            if key not in self._series:
+                self._series[key] = _Series(self.buckets)
+            self._series[key].add(record)
+            self._records.append(record)
+
+    def records(self) -> List[LLMCallRecord]:
+        with self._lock:
+            return list(self._records)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._series.clear()
+            self._records.clear()
+
+    def summary(self, by: Tuple[str, ...] = ("caller",)) -> Dict[str, Dict[str, Any]]:
+        """series rolled up by the given labels, keyed by the label values joined with '/'"""
+        rolled: Dict[str, _Series] = {}
+        with self._lock:
+            for key, series in self._series.items():
+                labels = dict(zip(LABELS, key))
+                name = "/".join(labels[label] or "-" for label in by)
+                if name not in rolled:
+                    rolled[name] = _Series(self.buckets)
+                _merge(rolled[name], series)
+        return {name: series.to_dict() for name, series in sorted(rolled.items())}
+
+    def to_json(self, records: bool = False) -> str:
+        with self._lock:
+            payload = {
+                "series": [
+                    {"labels": dict(zip(LABELS, key)), **series.to_dict()}
+                    for key, series in sorted(self._series.items())
+                ],
+            }
+            if records:
+                payload["records"] = [r.model_dump() for r in self._records]
+
+        total = _Series(self.buckets)
+        with self._lock:
+            for series in self._series.values():
+                _merge(total, series)
+        payload["total"] = total.to_dict()
+        payload["circuit_breakers"] = circuit_breaker_stats()
+        return json.dumps(payload, indent=2)
+
+    def to_prometheus(self, prefix: str = "kruppe_llm") -> str:
+        """prometheus text exposition format"""
+        counters = [
+            ("calls_total", "LLM calls", lambda s: s.count),
+            ("errors_total", "LLM calls that raised", lambda s: s.errors),
+            ("retries_total", "Upstream retries", lambda s: s.retries),
+            ("cache_hits_total", "Calls served from the response cache", lambda s: s.cache_hits),
+            ("cost_usd_total", "Cost from the price catalog in USD", lambda s: s.cost),
+        ]
+
+        lines = []
+        with self._lock:
+            series_items = sorted(self._series.items())
+
+            for name, help_text, value in counters:
+                lines.append(f"# HELP {prefix}_{name} {help_text}")
+                lines.append(f"# TYPE {prefix}_{name} counter")
+                for key, series in series_items:
+                    lines.append(f"{prefix}_{name}{{{_labels(key)}}} {_number(value(series))}")
+
+            lines.append(f"# HELP {prefix}_tokens_total Tokens by type")
+            lines.append(f"# TYPE {prefix}_tokens_total counter")
+            for key, series in series_items:
+                for token_type, count in (
+                    ("input", series.prompt_tokens),
+                    ("output", series.completion_tokens),
+                    ("cached", series.cached_tokens),
+                ):
+                    lines.append(f"{prefix}_tokens_total{{{_labels(key, type=token_type)}}} {count}")
+
+            lines.append(f"# HELP {prefix}_latency_seconds Call latency including retries")
+            lines.append(f"# TYPE {prefix}_latency_seconds histogram")
+            for key, series in series_items:
+                for bound, count in zip(series.buckets, series.bucket_counts):
+                    lines.append(f"{prefix}_latency_seconds_bucket{{{_labels(key, le=_number(bound))}}} {count}")
+                lines.append(f"{prefix}_latency_seconds_bucket{{{_labels(key, le='+Inf')}}} {series.count}")
+                lines.append(f"{prefix}_latency_seconds_sum{{{_labels(key)}}} {_number(series.latency_sum)}")
+                lines.append(f"{prefix}_latency_seconds_count{{{_labels(key)}}} {series.count}")
+
+        # circuit breakers of FallbackLLM backends (see kruppe.circuit_breaker)
+        breakers = circuit_breaker_stats()
+        if breakers:
+            lines.append(f"# HELP {prefix}_circuit_state Circuit breaker state (1 for the current state)")
+            lines.append(f"# TYPE {prefix}_circuit_state gauge")
+            for backend, stats in breakers.items():
+                for state in ("closed", "open", "half_open"):
+                    lines.append(f'{prefix}_circuit_state{{backend="{backend}",state="{state}"}} {int(stats["state"] == state)}')
+            for name, help_text, field in (
+                ("circuit_opened_total", "Times the circuit opened", "times_opened"),
+                ("circuit_rejected_total", "Requests skipped because the circuit was open", "rejected"),
+            ):
+                lines.append(f"# HELP {prefix}_{name} {help_text}")
+                lines.append(f"# TYPE {prefix}_{name} counter")
+                for backend, stats in breakers.items():
+                    lines.append(f'{prefix}_{name}{{backend="{backend}"}} {stats[field]}')
+
+        return "\n".join(lines) + "\n"
+
+
+def _merge(into: _Series, series: _Series):
+    into.count += series.count
+    into.errors += series.errors
+    into.retries += series.retries
+    into.cache_hits += series.cache_hits
+    into.prompt_tokens += series.prompt_tokens
+    into.completion_tokens += series.completion_tokens
+    into.cached_tokens += series.cached_tokens
+    into.cost += series.cost
+    into.latency_sum += series.latency_sum
+    into.latency_max = max(into.latency_max, series.latency_max)
+    into.bucket_counts = [a + b for a, b in zip(into.bucket_counts, series.bucket_counts)]
+
+
+def _labels(key: Tuple[str, ...], **extra) -> str:
+    pairs = list(zip(LABELS, key)) + list(extra.items())
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return ",".join(f'{name}="{value}"' for name, value in escaped)
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# process-wide collector, every llm reports here
+TELEMETRY = LLMTelemetry()
+
+
+def get_telemetry() -> LLMTelemetry:
+    return TELEMETRY
+
+# --------------------------------------------
+# ------------ CALL TRACKING ------------
+# --------------------------------------------
+
+_telemetry_tags: ContextVar[Dict[str, str]] = ContextVar("kruppe_telemetry_tags", default={})
+_current_call: ContextVar[LLMCallRecord | None] = ContextVar("kruppe_current_llm_call", default=None)
+
+
+@contextmanager
+def telemetry_tags(caller: str | None = None, template: str | None = None):
+    """tag every llm call made inside the block (including in tasks started inside it)"""
+    tags = {**_telemetry_tags.get()}
+    if caller is not None:
+        tags["caller"] = caller
+    if template is not None:
+        tags["template"] = template
+    token = _telemetry_tags.set(tags)
+    try:
+        yield
+    finally:
+        _telemetry_tags.reset(token)
+
+
+def current_llm_call(llm) -> LLMCallRecord | None:
+    """the record of the call `llm` is currently serving in this context, if any"""
+    record = _current_call.get()
+    if record is not None and record._owner == id(llm):
+        return record
+    return None
+
+
+@contextmanager
+def track_llm_call(llm, kind: str = "generate"):
+    """
+    Time one llm call and report it to TELEMETRY. Token usage and upstream attempts are added to
+    the record by the llm while the block runs. Nested calls on the same llm (e.g. retries that
+    call async_generate again) are folded into the outer record.
+    """
+    if current_llm_call(llm) is not None:
+        yield current_llm_call(llm)
+        return
+
+    tags = _telemetry_tags.get()
+    record = LLMCallRecord(
+        model=str(llm.model),
+        provider=llm.provider,
+        kind=kind,
+        caller=tags.get("caller"),
+        template=tags.get("template"),
+        started_at=time.time(),
+    )
+    record._owner = id(llm)
+    token = _current_call.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except GeneratorExit:
+        # a stream the consumer stopped reading, not a failure
+        raise
+    except BaseException as e:
+        record.error = type(e).__name__
+        raise
+    finally:
+        record.latency = time.perf_counter() - start
+        try:
+            _current_call.reset(token)
+        except ValueError:
+            # async generators closed from another context (e.g. abandoned streams)
+            pass
+        record.cost = price_for(
+            record.model, record.prompt_tokens, record.completion_tokens, record.cached_tokens, batch=kind == "batch"
+        )
+        TELEMETRY.record(record)
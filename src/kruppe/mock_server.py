@@ -0,0 +1,413 @@
+import sys
+import json
+import math
+import time
+import uuid
+import base64
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from typing import List, Dict, Any
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pydantic import BaseModel
+import numpy as np
+
+from kruppe.llm import OpenAILLM, NYUOpenAILLM, OpenAIEmbeddingModel, NYUOpenAIEmbeddingModel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_DIM = 1536
+
+
+class MockServerConfig(BaseModel):
+    """behaviour of the mock server. can be changed while the server runs"""
+    latency: float = 0.0 # median seconds per request
+    latency_sigma: float = 0.0 # lognormal spread around the median, 0 = always `latency`
+    latency_per_token: float = 0.0 # extra seconds per completion token
+    slow_rate: float = 0.0 # fraction of requests that take `slow_latency` instead (a long tail)
+    slow_latency: float = 0.0
+    error_rate: float = 0.0 # fraction of requests answered with 500
+    rate_limit_rate: float = 0.0 # fraction of requests answered with 429
+    retry_after: float | None = 1.0 # retry-after header on 429s
+    max_concurrency: int | None = None # requests beyond this many in flight get 429
+    embedding_dim: int = DEFAULT_EMBEDDING_DIM
+    seed: int | None = None # seed for latency/error sampling
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def mock_completion(messages: List[Dict], max_tokens: int | None = None) -> str:
+    """deterministic completion: same messages, same text"""
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    last = (messages[-1].get("content") or "") if messages else ""
+    text = f"Mock completion {digest}: {last[:200]}"
+    if max_tokens is not None:
+        text = text[: max_tokens * 4]
+    return text
+
+
+def mock_embedding(text: str, dim: int = DEFAULT_EMBEDDING_DIM) -> np.ndarray:
+    """deterministic unit vector derived from the hash of the text"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, so client connection pooling behaves like production
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        mock: MockLLMServer = self.server.mock
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        routes = {
+            "/v1/chat/completions": self._openai_chat,
+            "/v1/embeddings": self._openai_embeddings,
+            "/nyu/chat": self._nyu_chat,
+            "/nyu/embeddings": self._nyu_embeddings,
+        }
+        route = routes.get(self.path.rstrip("/"))
+        if route is None:
+            return self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        if self.path.startswith("/nyu") and "rit_access" not in self.headers:
+            return self._send_json(401, {"error": {"message": "Missing rit_access header"}})
+
+        status = mock._admit(self.path)
+        try:
+            if status == 429:
+                headers = {} if mock.config.retry_after is None else {"retry-after": str(mock.config.retry_after)}
+                return self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}}, headers)
+
+            time.sleep(mock._sample_latency())
+            if mock._roll(mock.config.error_rate):
+                mock._count("errors")
+                return self._send_json(500, {"error": {"message": "Mock server error", "type": "server_error"}})
+            route(body)
+        finally:
+            mock._release()
+
+    # -------- openai --------
+
+    def _openai_chat(self, body: Dict[str, Any]):
+        self._chat(body["messages"], body.get("max_tokens") or body.get("max_completion_tokens"), body.get("model"), body.get("stream", False))
+
+    def _openai_embeddings(self, body: Dict[str, Any]):
+        mock: MockLLMServer = self.server.mock
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dim = body.get("dimensions") or mock.config.embedding_dim
+
+        data = []
+        for i, text in enumerate(texts):
+            vector = mock_embedding(text, dim)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+        tokens = sum(estimate_tokens(text) for text in texts)
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": body.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    # -------- nyu --------
+
+    def _nyu_chat(self, body: Dict[str, Any]):
+        params = body.get("openai_parameters", {})
+        model = self.headers["rit_access"].split("|")[-1]
+        self._chat(body["messages"], params.get("max_tokens"), model, params.get("stream", False))
+
+    def _nyu_embeddings(self, body: Dict[str, Any]):
+        mock: MockLLMServer = self.server.mock
+        self._send_json(200, {"embedding": mock_embedding(body["text"], mock.config.embedding_dim).tolist()})
+
+    # -------- shared --------
+
+    def _chat(self, messages: List[Dict], max_tokens: int | None, model: str, stream: bool):
+        mock: MockLLMServer = self.server.mock
+        content = mock_completion(messages, max_tokens)
+        prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in messages)
+        completion_tokens = estimate_tokens(content)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        if mock.config.latency_per_token:
+            time.sleep(mock.config.latency_per_token * completion_tokens)
+
+        if not stream:
+            return self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                    "logprobs": None,
+                }],
+                "usage": usage,
+            })
+
+        # server-sent events, one word per chunk, usage in the last chunk
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        words = content.split(" ")
+        for i, word in enumerate(words):
+            delta = word if i == 0 else " " + word
+            self._send_event({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
+            })
+        self._send_event({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [],
+            "usage": usage,
+        })
+        self._send_chunk(b"data: [DONE]\n\n")
+        self._send_chunk(b"")
+
+    def _send_event(self, payload: Dict[str, Any]):
+        self._send_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def _send_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024 # load tests open hundreds of connections at once
+
+    def handle_error(self, request, client_address):
+        # clients drop connections mid-response when a request is cancelled (e.g. a lost hedge)
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class MockLLMServer:
+    """
+    Local stand-in for the OpenAI chat/embeddings API and the NYU `rit_access` API, for tests and
+    offline load testing. Completions are deterministic and embeddings are derived from a hash of
+    the text. Latency, 500s and 429s are drawn according to `config`.
+
+    Routes:
+        POST /v1/chat/completions, /v1/embeddings  (point OpenAI clients at `openai_base_url`)
+        POST /nyu/chat, /nyu/embeddings            (use as NYU `endpoint_url`)
+
+    Use as a context manager (runs in a background thread), or from the command line:
+    `python -m kruppe.mock_server --port 8000 --latency 0.5`.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, config: MockServerConfig | None = None):
+        self.config = config or MockServerConfig()
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.mock = self
+        self._thread = None
+        self._lock = threading.Lock()
+        self._random = random.Random(self.config.seed)
+        self.reset_stats()
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def openai_base_url(self) -> str:
+        return f"{self.url}/v1"
+
+    @property
+    def nyu_chat_url(self) -> str:
+        return f"{self.url}/nyu/chat"
+
+    @property
+    def nyu_embedding_url(self) -> str:
+        return f"{self.url}/nyu/embeddings"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="kruppe-mock-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    # -------- models pointed at this server --------
+
+    def openai_llm(self, **kwargs) -> OpenAILLM:
+        return OpenAILLM(api_key="mock", base_url=self.openai_base_url, **kwargs)
+
+    def nyu_llm(self, **kwargs) -> NYUOpenAILLM:
+        return NYUOpenAILLM(**self._nyu_credentials(), endpoint_url=self.nyu_chat_url, **kwargs)
+
+    def openai_embedding_model(self, **kwargs) -> OpenAIEmbeddingModel:
+        return OpenAIEmbeddingModel(api_key="mock", base_url=self.openai_base_url, **kwargs)
+
+    def nyu_embedding_model(self, **kwargs) -> NYUOpenAIEmbeddingModel:
+        return NYUOpenAIEmbeddingModel(**self._nyu_credentials(), endpoint_url=self.nyu_embedding_url, **kwargs)
+
+    def model_for(self, model_cls: type, **kwargs):
+        """instance of any of the four model classes, pointed at this server"""
+        builders = {
+            OpenAILLM: self.openai_llm,
+            NYUOpenAILLM: self.nyu_llm,
+            OpenAIEmbeddingModel: self.openai_embedding_model,
+            NYUOpenAIEmbeddingModel: self.nyu_embedding_model,
+        }
+        if model_cls not in builders:
+            raise ValueError(f"No mock endpoint for {model_cls.__name__}")
+        return builders[model_cls](**kwargs)
+
+    @staticmethod
+    def _nyu_credentials() -> Dict[str, str]:
+        return {"api_key": "mock", "project_id": "mock", "net_id": "mock"}
+
+    # -------- stats --------
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = time.monotonic() - self._stats_started
+            return {
+                **self._stats,
+                "by_path": dict(self._by_path),
+                "in_flight": self._in_flight,
+                "requests_per_second": self._stats["requests"] / elapsed if elapsed > 0 else 0.0,
+            }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {"requests": 0, "rate_limited": 0, "errors": 0, "peak_in_flight": 0}
+            self._by_path: Dict[str, int] = {}
+            self._in_flight = 0
+            self._stats_started = time.monotonic()
+
+    # -------- used by the handler --------
+
+    def _admit(self, path: str) -> int:
+        """count the request, and decide whether it gets a 429 (returns 429 or 200)"""
+        with self._lock:
+            self._stats["requests"] += 1
+            self._by_path[path] = self._by_path.get(path, 0) + 1
+            self._in_flight += 1
+            self._stats["peak_in_flight"] = max(self._stats["peak_in_flight"], self._in_flight)
+
+            over_capacity = self.config.max_concurrency is not None and self._in_flight > self.config.max_concurrency
+            if over_capacity or self._random.random() < self.config.rate_limit_rate:
+                self._stats["rate_limited"] += 1
+                return 429
+        return 200
+
+    def _release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def _roll(self, rate: float) -> bool:
+        with self._lock:
+            return self._random.random() < rate
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def _sample_latency(self) -> float:
+        if self.config.slow_rate and self._roll(self.config.slow_rate):
+            return self.config.slow_latency
+        if self.config.latency <= 0:
+            return 0.0
+        if self.config.latency_sigma <= 0:
+            return self.config.latency
+        with self._lock:
+            return self.config.latency * math.exp(self.config.latency_sigma * self._random.gauss(0.0, 1.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the OpenAI and NYU LLM/embedding APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="median seconds per request")
+    parser.add_argument("--latency-sigma", type=float, default=0.0, help="lognormal spread of the latency")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests that take --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", type=int, default=None)
+    parser.add_argument("--embedding-dim", type=int, default=DEFAULT_EMBEDDING_DIM)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = MockServerConfig(
+        latency=args.latency,
+        latency_sigma=args.latency_sigma,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        max_concurrency=args.max_concurrency,
+        embedding_dim=args.embedding_dim,
+        seed=args.seed,
+    )
+    server = MockLLMServer(args.host, args.port, config)
+    print(f"Mock LLM server on {server.url}")
+    print(f"  OPENAI_BASE_URL={server.openai_base_url}")
+    print(f"  NYU_ENDPOINT_URL_CHAT={server.nyu_chat_url}")
+    print(f"  NYU_ENDPOINT_URL_EMBEDDING={server.nyu_embedding_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
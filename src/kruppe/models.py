@@ -6,6 +6,12 @@ from dateutil.parser import parse, ParserError
 from datetime import datetime
 
 OPENAI_TEXT_EMBEDDING_SMALL_DIM = 1536
+# native output size of each embedding model (text-embedding-3 models can return fewer, see `dimensions`)
+EMBEDDING_DIMS = {
+    "text-embedding-3-small": OPENAI_TEXT_EMBEDDING_SMALL_DIM,
+    "text-embedding-3-large": 3072,
+    "api-embedding-openai-text-embed-3-small": OPENAI_TEXT_EMBEDDING_SMALL_DIM,
+}
 
 def validate_metadata(v: Dict[str, Any]):
 
@@ -3,6 +3,7 @@ from tqdm import tqdm
 import os
 
 from kruppe.llm import BaseLLM, BaseEmbeddingModel, NYUOpenAIEmbeddingModel, OpenAIEmbeddingModel
+from kruppe.embedding_cache import CachedEmbeddingModel
 from kruppe.data_source.news.ft import FinancialTimesData
 from kruppe.data_source.utils import WebScraper
 from kruppe.functional.rag.vectorstore.base_store import BaseVectorStore
@@ -130,7 +131,8 @@ async def ask_simple_rag(
 
 
 if __name__ == "__main__":
-    embedding_model = OpenAIEmbeddingModel()
+    # rebuilding the collection re-embeds the same articles, so cache the vectors on disk
+    embedding_model = CachedEmbeddingModel(embedding_model=OpenAIEmbeddingModel())
     vectorstore = ChromaVectorStore(
         embedding_model=embedding_model,
         collection_name="financial-times",
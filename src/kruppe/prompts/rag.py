@@ -15,16 +15,29 @@ RAG_STANDARD_SYSTEM = dedent(
     """
 )
 
-SPLITTER_CONTEXTUALIZE_USER = dedent(
+# contextualization prompts are split so the static parts (instructions, whole document) form a
+# prefix shared by every chunk of the document, which the provider's prompt cache can reuse.
+# only the chunk message at the end changes between requests
+SPLITTER_CONTEXTUALIZE_SYSTEM = dedent(
+    """\
+    You situate chunks of a document within the overall document. You will be given the whole document, and then a chunk of it. Please give a short succinct context to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk. Answer only with the succinct context and nothing else.
+    """
+)
+
+SPLITTER_CONTEXTUALIZE_DOCUMENT = dedent(
     """\
     <document> 
     {WHOLE_DOCUMENT}
     </document> 
+    """
+)
+
+SPLITTER_CONTEXTUALIZE_CHUNK = dedent(
+    """\
     Here is the chunk we want to situate within the whole document 
     <chunk> 
     {CHUNK_CONTENT}
     </chunk> 
-    Please give a short succinct context to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk. Answer only with the succinct context and nothing else.
     """
 )
 
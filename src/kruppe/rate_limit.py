@@ -0,0 +1,301 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, List, Any
+
+logger = logging.getLogger(__name__)
+
+# default provider budgets (requests per minute, tokens per minute). override with `configure_rate_limiter`
+DEFAULT_RATE_LIMITS = {
+    "openai": {"rpm": 500, "tpm": 200_000},
+    "nyu": {"rpm": 300, "tpm": None},
+}
+
+
+def estimate_tokens(messages: List[Dict], max_tokens: int = 0) -> int:
+    """rough token count for budgeting (~4 characters per token), plus the completion budget"""
+    chars = 0
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+        chars += len(content or "")
+    return chars // 4 + max_tokens
+
+
+class _TokenBucket:
+    """continuously refilling bucket. `capacity` per minute, can go into debt when usage is corrected upward"""
+
+    def __init__(self, per_minute: float | None):
+        self.capacity = per_minute
+        self.level = per_minute or 0.0
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if self.capacity is None:
+            return
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """seconds until `amount` is available (0 if available now)"""
+        if self.capacity is None:
+            return 0.0
+        # never ask for more than the whole bucket, otherwise huge requests would wait forever
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.capacity
+
+    def take(self, amount: float):
+        if self.capacity is not None:
+            self.level -= amount
+
+
+class RateLimitSlot:
+    """handle for one admitted request. call `record` with the actual token usage once known"""
+
+    def __init__(self, limiter: "RateLimiter", tokens: int):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.actual_tokens = None
+        self.started = time.monotonic()
+        self.retry_after = None
+
+    def record(self, total_tokens: int):
+        self.actual_tokens = total_tokens
+
+
+class RateLimiter:
+    """
+    Requests-per-minute / tokens-per-minute budget with adaptive (AIMD) concurrency.
+
+    Every request takes one request and its estimated tokens from the buckets, and one concurrency slot.
+    When a request finishes, its estimate is corrected to the actual usage. The concurrency limit grows
+    by roughly one slot per window of successful requests (additive increase) and is cut by
+    `decrease_factor` when the provider returns 429 or latency exceeds `latency_target`
+    (multiplicative decrease). Only requests started after the last cut can trigger another one,
+    so a burst of 429s from the same window shrinks the limit once.
+
+    The limiter keeps no loop-bound asyncio primitives, so one instance can be shared across event
+    loops and threads (e.g. sync wrappers that use `asyncio.run`).
+    """
+
+    def __init__(
+        self,
+        rpm: int | None = None,
+        tpm: int | None = None,
+        initial_concurrency: int = 16,
+        min_concurrency: int = 1,
+        max_concurrency: int = 128,
+        decrease_factor: float = 0.5,
+        latency_target: float | None = None,
+        is_rate_limit_error: Callable[[BaseException], bool] | None = None,
+    ):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.is_rate_limit_error = is_rate_limit_error or is_rate_limit_error_default
+
+        self._lock = threading.Lock()
+        self._requests = _TokenBucket(rpm)
+        self._tokens = _TokenBucket(tpm)
+        self._concurrency = float(initial_concurrency)
+        self._in_flight = 0
+        self._waiters = deque() # (loop, future) pairs waiting for a concurrency slot
+        self._blocked_until = 0.0 # set from retry-after on 429
+        self._last_decrease = 0.0
+
+        # stats
+        self._completed = 0
+        self._rate_limited = 0
+        self._latency_ewma = None
+
+    @property
+    def concurrency_limit(self) -> int:
+        return max(self.min_concurrency, int(self._concurrency))
+
+    def _try_take(self, tokens: int) -> float | None:
+        """under lock. returns 0 if admitted, seconds to sleep if a budget is empty,
+        or None if all concurrency slots are in use"""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._in_flight >= self.concurrency_limit:
+            return None
+
+        self._requests.refill(now)
+        self._tokens.refill(now)
+        wait = max(self._requests.wait_time(1), self._tokens.wait_time(tokens))
+        if wait > 0:
+            return wait
+
+        self._requests.take(1)
+        self._tokens.take(tokens)
+        self._in_flight += 1
+        return 0.0
+
+    def _wake_waiters(self):
+        """under lock. wake as many waiters as there are free slots"""
+        free = self.concurrency_limit - self._in_flight
+        while self._waiters and free > 0:
+            loop, future = self._waiters.popleft()
+            if future.done():
+                continue
+            loop.call_soon_threadsafe(_set_future_result, future)
+            free -= 1
+
+    async def acquire(self, tokens: int = 0) -> RateLimitSlot:
+        while True:
+            future = None
+            with self._lock:
+                wait = self._try_take(tokens)
+                if wait == 0:
+                    return RateLimitSlot(self, tokens)
+                if wait is None:
+                    loop = asyncio.get_running_loop()
+                    future = loop.create_future()
+                    self._waiters.append((loop, future))
+
+            if future is not None:
+                try:
+                    await future
+                except asyncio.CancelledError:
+                    # if we were woken up right before being cancelled, pass the wake-up on
+                    if future.done() and not future.cancelled():
+                        with self._lock:
+                            self._wake_waiters()
+                    raise
+            else:
+                await asyncio.sleep(wait)
+
+    def acquire_sync(self, tokens: int = 0) -> RateLimitSlot:
+        while True:
+            with self._lock:
+                wait = self._try_take(tokens)
+            if wait == 0:
+                return RateLimitSlot(self, tokens)
+            time.sleep(wait if wait is not None else 0.05)
+
+    def release(self, slot: RateLimitSlot, error: BaseException | None = None) -> None:
+        now = time.monotonic()
+        latency = now - slot.started
+        rate_limited = error is not None and self.is_rate_limit_error(error)
+
+        with self._lock:
+            self._in_flight -= 1
+
+            # correct the token estimate with actual usage
+            if slot.actual_tokens is not None:
+                self._tokens.take(slot.actual_tokens - slot.tokens)
+
+            congested = rate_limited or (
+                self.latency_target is not None and error is None and latency > self.latency_target
+            )
+            if congested:
+                if rate_limited:
+                    self._rate_limited += 1
+                    if slot.retry_after:
+                        self._blocked_until = max(self._blocked_until, now + slot.retry_after)
+                if slot.started >= self._last_decrease:
+                    self._concurrency = max(self.min_concurrency, self._concurrency * self.decrease_factor)
+                    self._last_decrease = now
+                    logger.info("Rate limiter backing off: concurrency limit=%d", self.concurrency_limit)
+            elif error is None:
+                # additive increase: about +1 slot per full window of successes
+                self._concurrency = min(self.max_concurrency, self._concurrency + 1 / self._concurrency)
+                self._completed += 1
+                self._latency_ewma = latency if self._latency_ewma is None else 0.9 * self._latency_ewma + 0.1 * latency
+
+            self._wake_waiters()
+
+    @asynccontextmanager
+    async def limit(self, tokens: int = 0):
+        slot = await self.acquire(tokens)
+        try:
+            yield slot
+        except BaseException as e:
+            slot.retry_after = slot.retry_after or _retry_after(e)
+            self.release(slot, error=e)
+            raise
+        else:
+            self.release(slot)
+
+    @contextmanager
+    def limit_sync(self, tokens: int = 0):
+        slot = self.acquire_sync(tokens)
+        try:
+            yield slot
+        except BaseException as e:
+            slot.retry_after = slot.retry_after or _retry_after(e)
+            self.release(slot, error=e)
+            raise
+        else:
+            self.release(slot)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "concurrency_limit": self.concurrency_limit,
+                "in_flight": self._in_flight,
+                "waiting": len(self._waiters),
+                "completed": self._completed,
+                "rate_limited": self._rate_limited,
+                "latency_ewma": self._latency_ewma,
+            }
+
+
+def _set_future_result(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+def is_rate_limit_error_default(error: BaseException) -> bool:
+    """429 from either the openai sdk (`status_code`) or httpx (`response.status_code`)"""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+
+def _retry_after(error: BaseException) -> float | None:
+    """reads the retry-after header off an httpx/openai error, if there is one"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# process-wide registry, so every llm instance talking to the same provider shares one budget
+_rate_limiters: Dict[str, RateLimiter] = {}
+_registry_lock = threading.Lock()
+
+
+def get_rate_limiter(key: str, **kwargs) -> RateLimiter:
+    """returns the shared limiter for `key` (e.g. "openai:gpt-4o-mini"), creating it on first use.
+    defaults come from DEFAULT_RATE_LIMITS for the provider prefix of the key"""
+    with _registry_lock:
+        if key not in _rate_limiters:
+            provider = key.split(":")[0]
+            config = {**DEFAULT_RATE_LIMITS.get(provider, {}), **kwargs}
+            _rate_limiters[key] = RateLimiter(**config)
+        return _rate_limiters[key]
+
+
+def configure_rate_limiter(key: str, **kwargs) -> RateLimiter:
+    """replace the shared limiter for `key` with one built from `kwargs` (rpm, tpm, max_concurrency, ...)"""
+    with _registry_lock:
+        provider = key.split(":")[0]
+        config = {**DEFAULT_RATE_LIMITS.get(provider, {}), **kwargs}
+        _rate_limiters[key] = RateLimiter(**config)
+        return _rate_limiters[key]
@@ -0,0 +1,204 @@
+"""
+Recall/memory/latency trade-offs of vector search, measured against exact full-dimension search.
+
+    python -m kruppe.vector_benchmark                          # synthetic embeddings
+    python -m kruppe.vector_benchmark --embeddings corpus.npy  # real embeddings, (n, dim) float array
+    python -m kruppe.vector_benchmark --ivf --n 200000         # IVF approximate search instead
+    python -m kruppe.vector_benchmark --quantize --rerank 100  # int8 / product-quantized codes instead
+
+Synthetic embeddings put most of their variance in the leading coordinates, like text-embedding-3
+vectors (trained so that prefixes are usable embeddings). On real data from other models,
+truncation does much worse than PCA.
+"""
+import time
+import argparse
+from typing import List, Dict, Any, Callable
+import numpy as np
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+def synthetic_embeddings(n: int, dim: int = 1536, rank: int = 64, noise: float = 0.3, seed: int = 0) -> np.ndarray:
+    """n unit vectors: a low-rank signal (decaying spectrum, leading coordinates first) plus isotropic noise"""
+    rng = np.random.default_rng(seed)
+    scale = 1.0 / np.sqrt(1 + np.arange(dim))
+    basis = rng.standard_normal((rank, dim)) * scale
+    signal = rng.standard_normal((n, rank)) @ basis
+    return normalize(signal + noise * rng.standard_normal((n, dim)) * scale)
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """ids of the k highest inner products per query, best first"""
+    scores = queries @ corpus.T
+    k = min(k, corpus.shape[0])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    """fraction of the true top-k that was found, averaged over queries"""
+    k = truth.shape[1]
+    return float(np.mean([len(np.intersect1d(f[:k], t)) / k for f, t in zip(found, truth)]))
+
+
+def truncate(corpus: np.ndarray, queries: np.ndarray, dim: int):
+    return normalize(corpus[:, :dim]), normalize(queries[:, :dim])
+
+
+def pca(corpus: np.ndarray, queries: np.ndarray, dim: int, sample: int = 20_000, seed: int = 0):
+    """pca fitted on a sample of the corpus, as PCAEmbeddingModel does"""
+    rng = np.random.default_rng(seed)
+    fit_on = corpus[rng.choice(len(corpus), min(sample, len(corpus)), replace=False)].astype(np.float64)
+    mean = fit_on.mean(axis=0)
+    _, _, vt = np.linalg.svd(fit_on - mean, full_matrices=False)
+    components = vt[:dim].astype(np.float32)
+    return normalize((corpus - mean) @ components.T), normalize((queries - mean) @ components.T)
+
+
+REDUCTIONS: Dict[str, Callable] = {"truncate": truncate, "pca": pca}
+
+
+def benchmark_dimensions(corpus: np.ndarray, queries: np.ndarray, dims: List[int], k: int = 10,
+                         methods: List[str] = ("truncate", "pca")) -> List[Dict[str, Any]]:
+    """recall@k, memory and search time of reduced-dimension search, per method and dimension"""
+    corpus, queries = normalize(corpus), normalize(queries)
+    start = time.perf_counter()
+    truth = exact_top_k(corpus, queries, k)
+    full_ms = 1000 * (time.perf_counter() - start) / len(queries)
+
+    rows = [{"method": "exact", "dim": corpus.shape[1], "recall": 1.0, "memory_mb": corpus.nbytes / 2**20, "ms_per_query": full_ms}]
+    for method in methods:
+        for dim in dims:
+            if dim >= corpus.shape[1]:
+                continue
+            reduced_corpus, reduced_queries = REDUCTIONS[method](corpus, queries, dim)
+            start = time.perf_counter()
+            found = exact_top_k(reduced_corpus, reduced_queries, k)
+            ms = 1000 * (time.perf_counter() - start) / len(queries)
+            rows.append({
+                "method": method,
+                "dim": dim,
+                "recall": recall_at_k(found, truth),
+                "memory_mb": reduced_corpus.nbytes / 2**20,
+                "ms_per_query": ms,
+            })
+    return rows
+
+
+def benchmark_ivf(corpus: np.ndarray, queries: np.ndarray, nlist: int, nprobes: List[int], k: int = 10) -> List[Dict[str, Any]]:
+    """recall@k and latency of IVFIndex at several nprobe, against exact search"""
+    from kruppe.functional.rag.vectorstore.ivf import IVFIndex
+
+    corpus, queries = normalize(corpus), normalize(queries)
+    start = time.perf_counter()
+    truth = np.concatenate([exact_top_k(corpus, query[None], k) for query in queries])
+    full_ms = 1000 * (time.perf_counter() - start) / len(queries)
+
+    start = time.perf_counter()
+    index = IVFIndex(nlist=nlist, min_train_size=0, background=False).fit(corpus)
+    build_s = time.perf_counter() - start
+
+    rows = [{"method": "exact", "nprobe": nlist, "recall": 1.0, "ms_per_query": full_ms, "build_s": 0.0}]
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        found = []
+        for query in queries: # one at a time, as the store is queried
+            rows_found, _ = index.search(corpus, query[None], k, nprobe=nprobe)[0]
+            # too few rows in the probed lists: the store falls back to exact search
+            found.append(rows_found if rows_found is not None else exact_top_k(corpus, query[None], k)[0])
+        found = np.stack(found)
+        ms = 1000 * (time.perf_counter() - start) / len(queries)
+        rows.append({"method": f"ivf{nlist}", "nprobe": nprobe, "recall": recall_at_k(found, truth), "ms_per_query": ms, "build_s": build_s})
+    return rows
+
+
+def benchmark_quantization(corpus: np.ndarray, queries: np.ndarray, k: int = 10, rerank: int = 100) -> List[Dict[str, Any]]:
+    """recall@k, bytes per vector and latency of searching compressed codes, with and without
+    reranking the top `rerank` candidates with the float32 vectors"""
+    from kruppe.functional.rag.vectorstore.quantization import ScalarQuantizer, ProductQuantizer
+
+    corpus, queries = normalize(corpus), normalize(queries)
+    dim = corpus.shape[1]
+    start = time.perf_counter()
+    truth = exact_top_k(corpus, queries, k)
+    full_ms = 1000 * (time.perf_counter() - start) / len(queries)
+    rows = [{"method": "float32", "rerank": 0, "bytes": 4 * dim, "compression": 1.0, "recall": 1.0, "ms_per_query": full_ms, "build_s": 0.0}]
+
+    quantizers = {"int8": ScalarQuantizer(min_train_size=0)}
+    for dims_per_byte in (8, 16):
+        if dim % dims_per_byte == 0:
+            quantizers[f"pq{dim // dims_per_byte}"] = ProductQuantizer(dims_per_byte=dims_per_byte, min_train_size=0)
+    for name, quantizer in quantizers.items():
+        start = time.perf_counter()
+        codes = quantizer.fit(corpus).encode(corpus)
+        build_s = time.perf_counter() - start
+        for depth in (0, rerank):
+            start = time.perf_counter()
+            scores = quantizer.scores(codes, quantizer.prepare(queries))
+            candidates = min(max(k, depth), len(corpus))
+            found = np.argpartition(-scores, candidates - 1, axis=1)[:, :candidates]
+            if depth:
+                # rescore the candidates with the full vectors, as the store does from its memory-mapped file
+                exact_scores = np.einsum("qcd,qd->qc", corpus[found], queries)
+                found = np.take_along_axis(found, np.argsort(-exact_scores, axis=1), axis=1)
+            else:
+                found = np.take_along_axis(found, np.argsort(-np.take_along_axis(scores, found, axis=1), axis=1), axis=1)
+            ms = 1000 * (time.perf_counter() - start) / len(queries)
+            rows.append({
+                "method": name,
+                "rerank": depth,
+                "bytes": codes.shape[1],
+                "compression": 4 * dim / codes.shape[1],
+                "recall": recall_at_k(found[:, :k], truth),
+                "ms_per_query": ms,
+                "build_s": build_s,
+            })
+    return rows
+
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    columns = list(rows[0])
+    print("  ".join(f"{c:>12}" for c in columns))
+    for row in rows:
+        print("  ".join(f"{row[c]:>12.3f}" if isinstance(row[c], float) else f"{row[c]:>12}" for c in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall/memory/latency of reduced-dimension vector search")
+    parser.add_argument("--embeddings", default=None, help=".npy file of (n, dim) embeddings; synthetic if omitted")
+    parser.add_argument("--n", type=int, default=20_000, help="synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=1536, help="synthetic embedding dimension")
+    parser.add_argument("--queries", type=int, default=200, help="queries, held out from the corpus")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dims", type=int, nargs="+", default=[64, 128, 256, 512, 1024])
+    parser.add_argument("--ivf", action="store_true", help="benchmark IVF approximate search instead of reduced dimensions")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists, default 4 * sqrt(n)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--quantize", action="store_true", help="benchmark int8 and product-quantized codes instead")
+    parser.add_argument("--rerank", type=int, default=100, help="candidates rescored with float32 vectors when quantized")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.embeddings:
+        vectors = np.load(args.embeddings, mmap_mode="r")
+    else:
+        vectors = synthetic_embeddings(args.n + args.queries, args.dim, seed=args.seed)
+    corpus, queries = np.asarray(vectors[: -args.queries]), np.asarray(vectors[-args.queries :])
+    print(f"corpus {corpus.shape}, {len(queries)} queries, recall@{args.k} against exact search")
+    if args.ivf:
+        nlist = args.nlist or int(4 * np.sqrt(len(corpus)))
+        print_table(benchmark_ivf(corpus, queries, nlist, args.nprobe, args.k))
+    elif args.quantize:
+        print_table(benchmark_quantization(corpus, queries, args.k, args.rerank))
+    else:
+        print_table(benchmark_dimensions(corpus, queries, args.dims, args.k))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,26 @@ from kruppe.functional.rag.vectorstore.chroma import ChromaVectorStore
 from kruppe.functional.docstore.mongo_store import MongoDBStore
 from kruppe.llm import OpenAIEmbeddingModel, OpenAILLM
 # from kruppe.llm import NYUOpenAIEmbeddingModel, NYUOpenAILLM
+from kruppe.mock_server import MockLLMServer
 from kruppe.models import Query, Document
 
 nest_asyncio.apply()
 
+# KRUPPE_MOCK_LLM=1 points the llm/embedding fixtures at a local mock server (no keys or network needed)
+USE_MOCK_LLM = os.getenv("KRUPPE_MOCK_LLM") == "1"
+
+@pytest.fixture(scope="session")
+def mock_llm_server():
+    with MockLLMServer() as server:
+        yield server
+
+@pytest.fixture(scope="session")
+def make_model(request):
+    """builds an llm or embedding model from its class, pointed at the mock server if USE_MOCK_LLM"""
+    if not USE_MOCK_LLM:
+        return lambda model_cls, **kwargs: model_cls(**kwargs)
+    return request.getfixturevalue("mock_llm_server").model_for
+
 @pytest.mark.asyncio
 async def sanity_check():
     import httpx
@@ -120,14 +136,14 @@ def text_splitter():
 
 
 @pytest.fixture(scope="module")
-def embedding_model():
+def embedding_model(make_model):
     # return OpenAIEmbeddingModel()
-    return OpenAIEmbeddingModel()
+    return make_model(OpenAIEmbeddingModel)
 
 @pytest.fixture(scope="module")
-def llm():
+def llm(make_model):
     # return OpenAILLM()
-    return OpenAILLM()
+    return make_model(OpenAILLM)
 
 @pytest.fixture(scope="function")
 def vector_storage(embedding_model, text_splitter, documents2):
@@ -1,21 +1,62 @@
 import pytest
+import time
+import json
+import asyncio
+import httpx
+import numpy as np
+from typing import List, Dict
 
 from kruppe.llm import (
+    BaseLLM,
+    BaseEmbeddingModel,
+    single_flight_generate,
+    track_generate,
     OpenAIEmbeddingModel,
     NYUOpenAIEmbeddingModel,
     OpenAILLM,
     NYUOpenAILLM,
 )
+from kruppe.llm_cache import LLMCache
+from kruppe.llm_batch import BatchLLM, LocalBatchBackend
+from kruppe.llm_fallback import FallbackLLM
+from kruppe.circuit_breaker import configure_circuit_breaker, CircuitOpenError
+from kruppe.llm_history import HistoryBudget, HISTORY_SUMMARY_PREFIX
+from kruppe.llm_telemetry import get_telemetry, telemetry_tags, price_for
 from kruppe.models import Response
 
 
+class EchoLLM(BaseLLM):
+    """offline llm that echoes the last message, and counts upstream calls"""
+    model: str = "echo"
+    calls: int = 0
+    delay: float = 0.0
+
+    @single_flight_generate
+    @track_generate
+    async def async_generate(self, messages: List[Dict], max_tokens=2000) -> Response:
+        cached_response = self._cache_lookup(messages, max_tokens)
+        if cached_response is not None:
+            return cached_response
+
+        self.calls += 1
+        self._count_attempt()
+        await asyncio.sleep(self.delay)
+        response = Response(text=f"echo: {messages[-1]['content']}")
+        self._record_usage(10, 5)
+        self._cache_store(messages, max_tokens, response)
+        return response
+
+    def generate(self, messages: List[Dict], max_tokens=2000) -> Response:
+        raise NotImplementedError
+
+
 @pytest.fixture(params=[OpenAIEmbeddingModel, NYUOpenAIEmbeddingModel])
-def embedding_model(request):
-    return request.param()
+def embedding_model(request, make_model):
+    return make_model(request.param)
 
 @pytest.fixture(params=[OpenAILLM, NYUOpenAILLM])
-def llm(request):
-    return request.param()
+def llm(request, make_model):
+    return make_model(request.param)
 
 
 @pytest.mark.asyncio
@@ -37,4 +78,779 @@ async def test_llm(llm):
     assert isinstance(response, Response)
     assert response is not None
     assert len(response.text) > 0
-    
\ No newline at end of file
+
+
+@pytest.mark.asyncio
+async def test_llm_stream(llm):
+    message = [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": "Count from one to ten in words."},
+    ]
+    deltas = [delta async for delta in llm.async_stream(message)]
+
+    assert len(deltas) > 0
+    assert len("".join(deltas)) > 0
+    assert llm._output_token_usage > 0
+    
+
+@pytest.mark.asyncio
+async def test_stream_report_resets_between_reports():
+    import importlib.util
+    from pathlib import Path
+    from kruppe.algorithm.agents import Researcher
+
+    path = Path(__file__).parents[3] / "gradio_app" / "stream_report.py"
+    spec = importlib.util.spec_from_file_location("stream_report", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    class TwoReports(Researcher):
+        async def execute(self):
+            first = await self._generate_streamed([{"role": "user", "content": "first report"}])
+            second = await self._generate_streamed([{"role": "user", "content": "second report"}])
+            return first, second
+
+    researcher = TwoReports(llm=EchoLLM(delay=0.01))
+    task = asyncio.ensure_future(researcher.execute())
+    texts = [text async for text in module.stream_report(researcher, task)]
+    assert texts[-1] == "echo: second report"
+    assert all(text in ("", "echo: first report", "echo: second report") for text in texts)
+    assert researcher.stream_handler is None
+
+
+@pytest.mark.asyncio
+async def test_llm_cache(tmp_path):
+    cache = LLMCache(path=str(tmp_path / "llm_cache.sqlite"))
+    llm = EchoLLM(cache=cache)
+    messages = [{"role": "user", "content": "Hello!"}]
+
+    first = await llm.async_generate(messages)
+    second = await llm.async_generate(messages)
+    assert first.text == second.text
+    assert llm.calls == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # max_tokens is part of the key
+    await llm.async_generate(messages, max_tokens=10)
+    assert llm.calls == 2
+
+    # bypass skips the lookup but still refreshes the entry
+    cache.bypass = True
+    await llm.async_generate(messages)
+    assert llm.calls == 3
+    cache.bypass = False
+
+    # cache survives across instances
+    reopened = LLMCache(path=str(tmp_path / "llm_cache.sqlite"))
+    llm2 = EchoLLM(cache=reopened)
+    await llm2.async_generate(messages)
+    assert llm2.calls == 0
+
+
+def test_llm_cache_eviction(tmp_path):
+    cache = LLMCache(path=str(tmp_path / "llm_cache.sqlite"), max_entries=2)
+    for i in range(3):
+        cache.set(f"key{i}", f"value{i}")
+    assert cache.size() == 2
+    assert cache.get("key0") is None
+    assert cache.get("key2") == "value2"
+
+    cache = LLMCache(path=str(tmp_path / "llm_cache_ttl.sqlite"), ttl=0.05)
+    cache.set("key", "value")
+    assert cache.get("key") == "value"
+    time.sleep(0.1)
+    assert cache.get("key") is None
+    assert cache.size() == 0
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_concurrency_and_backoff():
+    import asyncio
+    import httpx
+    from kruppe.rate_limit import RateLimiter
+
+    limiter = RateLimiter(rpm=None, tpm=None, initial_concurrency=4, max_concurrency=4)
+    in_flight, peak = 0, 0
+
+    async def call():
+        nonlocal in_flight, peak
+        async with limiter.limit(tokens=10):
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+    await asyncio.gather(*(call() for _ in range(20)))
+    assert peak == 4
+    assert limiter.stats()["completed"] == 20
+
+    # a 429 halves the concurrency limit
+    request = httpx.Request("POST", "http://test")
+    error = httpx.HTTPStatusError("rate limited", request=request, response=httpx.Response(429, request=request))
+    with pytest.raises(httpx.HTTPStatusError):
+        async with limiter.limit():
+            raise error
+    assert limiter.concurrency_limit == 2
+    assert limiter.stats()["rate_limited"] == 1
+
+
+@pytest.mark.asyncio
+async def test_single_flight_generate():
+    llm = EchoLLM(delay=0.05)
+    messages = [{"role": "user", "content": "Hello!"}]
+
+    responses = await asyncio.gather(*(llm.async_generate(messages) for _ in range(5)))
+    assert llm.calls == 1
+    assert all(r.text == "echo: Hello!" for r in responses)
+    # every caller gets its own Response object
+    assert len({id(r) for r in responses}) == 5
+
+    # different requests are not coalesced
+    await asyncio.gather(llm.async_generate(messages), llm.async_generate(messages, max_tokens=10))
+    assert llm.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_single_flight_is_scoped_to_the_backend(mock_llm_server):
+    from openai import APIConnectionError
+
+    # both backends serve "gpt-4o-mini"; the unreachable one must not hand its error to the other
+    messages = [{"role": "user", "content": "scoped flight"}]
+    down = OpenAILLM(api_key="mock", base_url="http://127.0.0.1:9/v1", max_retries=0, rate_limit=False)
+    up = mock_llm_server.nyu_llm(hedge=False, rate_limit=False)
+    failed, response = await asyncio.gather(down.async_generate(messages), up.async_generate(messages), return_exceptions=True)
+    assert isinstance(failed, APIConnectionError)
+    assert response.text.startswith("Mock completion")
+
+    # instances pointed at the same backend still share a flight
+    first, second = mock_llm_server.openai_llm(rate_limit=False), mock_llm_server.openai_llm(rate_limit=False)
+    assert first.flight_scope == second.flight_scope != down.flight_scope
+    responses = await asyncio.gather(first.async_generate(messages), second.async_generate(messages))
+    assert responses[0].text == responses[1].text
+    assert first._output_token_usage + second._output_token_usage == max(first._output_token_usage, second._output_token_usage)
+
+
+@pytest.mark.asyncio
+async def test_batch_llm_local_backend(tmp_path):
+    interactive = EchoLLM()
+    backend = LocalBatchBackend(
+        directory=str(tmp_path / "server"),
+        responder=lambda body: f"batch: {body['messages'][-1]['content']}",
+        processing_delay=0.05,
+    )
+    llm = BatchLLM(llm=interactive, backend=backend, batch_dir=str(tmp_path / "input"), poll_interval=0.02)
+
+    messages_list = [[{"role": "user", "content": f"question {i}"}] for i in range(10)]
+    responses = await llm.batch_async_generate(messages_list)
+
+    # results come back in request order, without touching the interactive llm
+    assert [r.text for r in responses] == [f"batch: question {i}" for i in range(10)]
+    assert interactive.calls == 0
+    assert llm._input_token_usage > 0
+
+    # single calls still go to the interactive llm
+    response = await llm.async_generate(messages_list[0])
+    assert response.text == "echo: question 0"
+    assert interactive.calls == 1
+
+    # a batch that times out is cancelled, and the input file is removed too
+    def statuses(directory):
+        return [json.loads((batch / "status.json").read_text())["status"] for batch in directory.iterdir()]
+
+    stuck = LocalBatchBackend(directory=str(tmp_path / "stuck"), auto_process=False)
+    llm = BatchLLM(llm=interactive, backend=stuck, batch_dir=str(tmp_path / "stuck_input"), poll_interval=0.01,
+                   timeout=0.05, retry_failed=False)
+    with pytest.raises(TimeoutError):
+        await llm.batch_async_generate(messages_list)
+    assert list((tmp_path / "stuck_input").iterdir()) == []
+    assert statuses(tmp_path / "stuck") == ["cancelled"]
+
+    # with retry_failed, its items are answered interactively instead
+    llm.retry_failed = True
+    responses = await llm.batch_async_generate(messages_list)
+    assert [r.text for r in responses] == [f"echo: question {i}" for i in range(10)]
+    assert statuses(tmp_path / "stuck") == ["cancelled", "cancelled"]
+
+    # so is a batch whose caller is cancelled
+    llm.timeout = None
+    task = asyncio.ensure_future(llm.batch_async_generate(messages_list))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert statuses(tmp_path / "stuck") == ["cancelled"] * 3
+
+
+@pytest.mark.asyncio
+async def test_batch_llm_retries_failed_items(tmp_path):
+    def responder(body):
+        if body["messages"][-1]["content"] == "bad":
+            raise ValueError("responder failed")
+        return "ok"
+
+    interactive = EchoLLM()
+    backend = LocalBatchBackend(directory=str(tmp_path / "server"), responder=responder)
+    llm = BatchLLM(llm=interactive, backend=backend, batch_dir=str(tmp_path / "input"), poll_interval=0.01)
+
+    messages_list = [[{"role": "user", "content": content}] for content in ["a", "bad", "b"]]
+    responses = await llm.batch_async_generate(messages_list)
+    assert [r.text for r in responses] == ["ok", "echo: bad", "ok"]
+    assert interactive.calls == 1
+
+    # an expired batch's finished items are used, not paid for twice
+    class ExpiringBackend(LocalBatchBackend):
+        async def status(self, batch_id):
+            await super().status(batch_id)
+            return "expired"
+
+    llm.backend = ExpiringBackend(directory=str(tmp_path / "expiring"), responder=responder)
+    messages_list = [[{"role": "user", "content": content}] for content in ["c", "bad", "d"]]
+    responses = await llm.batch_async_generate(messages_list)
+    assert [r.text for r in responses] == ["ok", "echo: bad", "ok"]
+    assert interactive.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_llm_telemetry():
+    telemetry = get_telemetry()
+    telemetry.reset()
+    llm = EchoLLM()
+
+    with telemetry_tags(caller="Librarian", template="REQUEST_TO_QUERY_USER"):
+        await llm.async_generate([{"role": "user", "content": "a"}])
+        await llm.async_generate([{"role": "user", "content": "b"}])
+    await llm.async_generate([{"role": "user", "content": "c"}])
+
+    summary = telemetry.summary(by=("caller", "template"))
+    assert summary["Librarian/REQUEST_TO_QUERY_USER"]["calls"] == 2
+    assert summary["Librarian/REQUEST_TO_QUERY_USER"]["prompt_tokens"] == 20
+    assert summary["Librarian/REQUEST_TO_QUERY_USER"]["completion_tokens"] == 10
+    assert summary["-/-"]["calls"] == 1
+
+    prometheus = telemetry.to_prometheus()
+    assert 'kruppe_llm_calls_total{provider="openai",model="echo",caller="Librarian",template="REQUEST_TO_QUERY_USER",kind="generate"} 2' in prometheus
+    assert 'kruppe_llm_latency_seconds_count{provider="openai",model="echo",caller="",template="",kind="generate"} 1' in prometheus
+    assert json.loads(telemetry.to_json())["total"]["calls"] == 3
+
+    # prices come from the catalog (USD per 1M tokens)
+    assert price_for("gpt-4o-mini", 1_000_000, 1_000_000) == pytest.approx(0.75)
+    assert price_for("gpt-4o-mini", 1_000_000, 0, batch=True) == pytest.approx(0.075)
+
+
+@pytest.mark.asyncio
+async def test_mock_server_models(mock_llm_server):
+    messages = [{"role": "user", "content": "Hello!"}]
+    for llm in (mock_llm_server.openai_llm(), mock_llm_server.nyu_llm()):
+        response = await llm.async_generate(messages)
+        assert response.text.startswith("Mock completion")
+        # deterministic, streamed or not
+        assert (await llm.async_generate(messages)).text == response.text
+        assert "".join([delta async for delta in llm.async_stream(messages)]) == response.text
+        assert llm._output_token_usage > 0
+
+    texts = ["apple", "banana"]
+    openai_embeddings = await mock_llm_server.openai_embedding_model().async_embed(texts)
+    nyu_embeddings = await mock_llm_server.nyu_embedding_model().async_embed(texts)
+    assert len(openai_embeddings[0]) == 1536
+    assert np.allclose(openai_embeddings, nyu_embeddings, atol=1e-6)
+    assert not np.allclose(openai_embeddings[0], openai_embeddings[1])
+
+
+@pytest.mark.asyncio
+async def test_mock_server_rate_limits(mock_llm_server):
+    llm = mock_llm_server.nyu_llm(rate_limit=False)
+    mock_llm_server.reset_stats()
+    mock_llm_server.config.rate_limit_rate = 1.0
+    try:
+        with pytest.raises(httpx.HTTPStatusError):
+            await llm.async_generate([{"role": "user", "content": "Hello!"}], backoff_factor=0.001)
+    finally:
+        mock_llm_server.config.rate_limit_rate = 0.0
+
+    # first attempt + 3 retries
+    assert mock_llm_server.stats()["rate_limited"] == 4
+
+
+@pytest.mark.asyncio
+async def test_llm_retries_go_through_rate_limiter(mock_llm_server):
+    # openai: the sdk doesn't retry on its own, so every 429 reaches the limiter and backs it off
+    llm = mock_llm_server.openai_llm(backoff_factor=0.001)
+    limiter = llm.rate_limiter
+    before = limiter.stats()["rate_limited"]
+    mock_llm_server.reset_stats()
+    mock_llm_server.config.rate_limit_rate = 1.0
+    try:
+        with pytest.raises(Exception):
+            await llm.async_generate([{"role": "user", "content": "Hello!"}])
+    finally:
+        mock_llm_server.config.rate_limit_rate = 0.0
+    assert mock_llm_server.stats()["rate_limited"] == 3 # first attempt + 2 retries
+    assert limiter.stats()["rate_limited"] - before == 3
+
+    # nyu: a retried request in keep_history mode adds the turn to the history once
+    statuses = [429, 200]
+    sent = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append(json.loads(request.content)["messages"])
+        if statuses.pop(0) == 429:
+            return httpx.Response(429, json={"error": "slow down"})
+        usage = {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5}
+        return httpx.Response(200, json={"choices": [{"message": {"content": "hi there"}}], "usage": usage})
+
+    llm = mock_llm_server.nyu_llm(keep_history=True, rate_limit=False, hedge=False)
+    llm._httpx_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    response = await llm.async_generate([{"role": "user", "content": "Hello!"}], backoff_factor=0.001)
+    assert response.text == "hi there" and len(sent) == 2
+    assert sent[0] == sent[1] == [{"role": "user", "content": "Hello!"}]
+    assert [m["role"] for m in llm.messages] == ["user", "assistant"]
+
+
+@pytest.mark.asyncio
+async def test_nyu_connection_pool_reuse(mock_llm_server):
+    embedding_model = mock_llm_server.nyu_embedding_model(hedge=False) # hedges would add requests
+    before = embedding_model.pool_stats()
+    await embedding_model.async_embed([f"text {i}" for i in range(200)])
+    after = embedding_model.pool_stats()
+
+    assert after["requests"] - before["requests"] == 200
+    assert after["connections_opened"] - before["connections_opened"] < 200
+    await embedding_model.aclose()
+
+
+@pytest.mark.asyncio
+async def test_nyu_pool_metrics_and_close(mock_llm_server):
+    # closing one model leaves the shared pool to the others
+    first, second = mock_llm_server.nyu_embedding_model(hedge=False), mock_llm_server.nyu_embedding_model(hedge=False)
+    pool = second.client
+    async with first:
+        await first.async_embed(["alpha"])
+    assert not pool.is_closed
+    assert (await second.async_embed(["alpha"])).shape == (1, 1536)
+    assert second.client is pool
+
+    # failed and cancelled requests leave in_flight where it was
+    in_flight = second.pool_stats()["in_flight"]
+    unreachable = NYUOpenAIEmbeddingModel(api_key="mock", project_id="mock", net_id="mock", hedge=False,
+                                          endpoint_url="http://127.0.0.1:9/nyu/embeddings")
+    with pytest.raises(httpx.ConnectError):
+        await unreachable.async_embed(["alpha"])
+    assert second.pool_stats()["in_flight"] == in_flight
+
+    slow = mock_llm_server.nyu_embedding_model(hedge=False, coalesce=False) # a shared flight would outlive the caller
+    mock_llm_server.config.latency = 5.0
+    try:
+        task = asyncio.ensure_future(slow.async_embed(["slow"]))
+        await asyncio.sleep(0.2)
+        assert slow.pool_stats()["in_flight"] == in_flight + 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    finally:
+        mock_llm_server.config.latency = 0.0
+    assert second.pool_stats()["in_flight"] == in_flight
+
+
+@pytest.mark.asyncio
+async def test_hedger():
+    from kruppe.hedge import Hedger
+
+    hedger = Hedger(percentile=0.95, budget=1.0, min_samples=5, min_delay=0.01)
+    calls = 0
+
+    async def fast():
+        await asyncio.sleep(0.01)
+        return "fast"
+
+    for _ in range(5):
+        await hedger.run(fast)
+    assert hedger.hedge_delay() is not None
+
+    async def first_call_hangs():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(5 if calls == 1 else 0.01)
+        return f"call {calls}"
+
+    start = time.monotonic()
+    assert await hedger.run(first_call_hangs) == "call 2"
+    assert time.monotonic() - start < 1
+    assert hedger.stats()["hedge_wins"] == 1
+
+    # no budget -> wait for the slow request instead of hedging
+    hedger = Hedger(budget=0.0, min_samples=1, min_delay=0.01)
+    await hedger.run(fast)
+
+    async def slow():
+        await asyncio.sleep(0.2)
+        return "slow"
+
+    assert await hedger.run(slow) == "slow"
+    assert hedger.stats()["hedged"] == 0
+    assert hedger.stats()["over_budget"] == 1
+
+
+class FlakyLLM(EchoLLM):
+    """echo llm that can't connect while `down` is set"""
+    down: bool = False
+
+    async def async_generate(self, messages: List[Dict], max_tokens=2000) -> Response:
+        if self.down:
+            self.calls += 1
+            raise httpx.ConnectError("no route to host")
+        return await super().async_generate(messages, max_tokens)
+
+
+@pytest.mark.asyncio
+async def test_fallback_llm_circuit_breaker():
+    primary, secondary = FlakyLLM(model="flaky-primary", down=True), EchoLLM(model="flaky-secondary")
+    primary_breaker = configure_circuit_breaker("openai:flaky-primary", failure_threshold=2, cooldown=0.2)
+    configure_circuit_breaker("openai:flaky-secondary")
+    llm = FallbackLLM(llms=[primary, secondary])
+    messages = [{"role": "user", "content": "hi"}]
+
+    # fails over within the call, and the circuit opens after 2 failures
+    for _ in range(3):
+        assert (await llm.async_generate(messages)).text == "echo: hi"
+    assert primary.calls == 2
+    assert primary_breaker.state == "open"
+    assert 'kruppe_llm_circuit_state{backend="openai:flaky-primary",state="open"} 1' in get_telemetry().to_prometheus()
+
+    # half open after the cooldown: one trial request, which closes the circuit again
+    primary.down = False
+    await asyncio.sleep(0.25)
+    assert primary_breaker.state == "half_open"
+    await llm.async_generate([{"role": "user", "content": "back?"}])
+    assert primary_breaker.state == "closed"
+
+    # streams fail over before the first delta too
+    primary.down = True
+    assert [d async for d in llm.async_stream(messages)] == ["echo: hi"]
+
+    # every backend down
+    all_down = FallbackLLM(llms=[FlakyLLM(model="flaky-primary", down=True)])
+    with pytest.raises(httpx.ConnectError):
+        await all_down.async_generate(messages)
+    assert primary_breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        await all_down.async_generate(messages)
+
+
+class RejectingLLM(EchoLLM):
+    """echo llm that answers every request with a 400"""
+
+    async def async_generate(self, messages: List[Dict], max_tokens=2000) -> Response:
+        self.calls += 1
+        request = httpx.Request("POST", "http://llm.test/chat")
+        raise httpx.HTTPStatusError("bad request", request=request, response=httpx.Response(400, request=request))
+
+
+@pytest.mark.asyncio
+async def test_fallback_llm_ignores_client_errors():
+    primary, secondary = RejectingLLM(model="rejecting-primary"), EchoLLM(model="rejecting-secondary")
+    primary_breaker = configure_circuit_breaker("openai:rejecting-primary", failure_threshold=2)
+    llm = FallbackLLM(llms=[primary, secondary])
+
+    # a malformed request would fail anywhere: it is raised, without failing over or opening the circuit
+    for _ in range(3):
+        with pytest.raises(httpx.HTTPStatusError):
+            await llm.async_generate([{"role": "user", "content": "hi"}])
+    assert primary.calls == 3 and secondary.calls == 0
+    assert primary_breaker.state == "closed"
+
+
+def test_history_budget():
+    system = {"role": "system", "content": "be brief"}
+    turns = [
+        [{"role": "user", "content": f"question {i} " + "x" * 400}, {"role": "assistant", "content": f"answer {i}"}]
+        for i in range(20)
+    ]
+    messages = [system] + [m for turn in turns for m in turn]
+
+    budget = HistoryBudget(max_tokens=500)
+    trimmed = budget.trim(messages)
+    assert trimmed[0] == system
+    assert trimmed[-2:] == turns[-1]
+    assert budget.count_tokens(trimmed) <= 500
+    assert len(trimmed) < len(messages)
+
+    assert HistoryBudget(max_tokens=10_000, max_turns=3).trim(messages) == [system] + [m for t in turns[-3:] for m in t]
+
+    # the latest turn is kept even if it alone is over budget
+    assert HistoryBudget(max_tokens=10).trim(messages)[-2:] == turns[-1]
+
+    # evicted turns are folded into a rolling summary
+    summarized = []
+    def summarizer(evicted):
+        summarized.append(evicted)
+        return f"{len(evicted)} messages"
+
+    budget = HistoryBudget(max_tokens=10_000, max_turns=2, summarizer=summarizer)
+    trimmed = budget.trim(messages)
+    assert trimmed[1] == {"role": "system", "content": HISTORY_SUMMARY_PREFIX + "36 messages"}
+    trimmed = budget.trim(trimmed + turns[0])
+    assert summarized[-1][0]["content"] == HISTORY_SUMMARY_PREFIX + "36 messages"
+    assert len(trimmed) == 2 + 4
+
+    # keep_history mode: prompt size stays flat as the session grows
+    llm = EchoLLM(keep_history=True, history_budget=HistoryBudget(max_tokens=500))
+    sizes = []
+    for turn in turns:
+        sent = llm._extend_history([turn[0]])
+        sizes.append(len(sent))
+        llm.messages.append(turn[1])
+    assert max(sizes[5:]) == sizes[-1] < 10
+
+
+def test_sync_wrappers_share_background_loop(mock_llm_server):
+    from kruppe.background_loop import get_background_loop, run_sync
+
+    embedding_model = mock_llm_server.nyu_embedding_model(hedge=False)
+    embedding_model.embed(["warm up"])
+    before = embedding_model.pool_stats()
+    for i in range(5):
+        assert len(embedding_model.embed([f"text {i}"])[0]) == 1536
+    after = embedding_model.pool_stats()
+    # same loop, same pool: no new pools or connections
+    assert after["pools_created"] == before["pools_created"]
+    assert after["connections_opened"] == before["connections_opened"]
+
+    # sync calls are reported once, with the caller's tags
+    llm = mock_llm_server.nyu_llm(hedge=False)
+    telemetry = get_telemetry()
+    telemetry.reset()
+    with telemetry_tags(caller="sync-test"):
+        llm.generate([{"role": "user", "content": "hi"}])
+    records = telemetry.records()
+    assert len(records) == 1 and records[0].caller == "sync-test"
+
+    async def nested():
+        return llm.generate([{"role": "user", "content": "hi"}])
+    with pytest.raises(RuntimeError):
+        run_sync(nested())
+    assert get_background_loop().loop.is_running()
+
+
+@pytest.mark.asyncio
+async def test_nyu_embedding_sliding_window(mock_llm_server):
+    from kruppe.mock_server import mock_embedding
+
+    embedding_model = mock_llm_server.nyu_embedding_model(hedge=False, max_in_flight=16, backoff_factor=0.001)
+    texts = [f"text {i}" for i in range(300)]
+    mock_llm_server.reset_stats()
+    mock_llm_server.config.error_rate = 0.1
+    try:
+        embeddings = await embedding_model.async_embed(texts)
+    finally:
+        mock_llm_server.config.error_rate = 0.0
+
+    # order is preserved, and failed requests were retried per text
+    assert len(embeddings) == len(texts)
+    for text, embedding in zip(texts[:20], embeddings[:20]):
+        assert np.allclose(embedding, mock_embedding(text, 1536), atol=1e-6)
+    stats = embedding_model.last_embed_stats
+    assert stats["texts"] == 300 and stats["retries"] > 0
+    assert stats["texts_per_second"] > 0
+
+    # no texts, no requests: an empty (0, dim) array
+    empty = await embedding_model.async_embed([])
+    assert empty.shape == (0, 1536) and empty.dtype == np.float32
+
+
+class CountingEmbeddingModel(BaseEmbeddingModel):
+    """offline embedding model that counts the texts it is asked to embed"""
+    model: str = "counting"
+    embedded: int = 0
+
+    async def async_embed(self, text):
+        from kruppe.mock_server import mock_embedding
+        self.embedded += len(text)
+        return [mock_embedding(t, 8).tolist() for t in text]
+
+    def embed(self, text):
+        raise NotImplementedError
+
+
+@pytest.mark.asyncio
+async def test_embedding_cache(tmp_path):
+    from kruppe.embedding_cache import EmbeddingCache, CachedEmbeddingModel
+
+    inner = CountingEmbeddingModel()
+    model = CachedEmbeddingModel(embedding_model=inner, cache=EmbeddingCache(directory=str(tmp_path), lru_size=2))
+    texts = ["a", "b", "c", "a"]
+
+    first = await model.async_embed(texts)
+    assert inner.embedded == 3 # duplicates are embedded once
+    assert np.array_equal(first[0], first[3])
+
+    second = await model.async_embed(texts)
+    assert inner.embedded == 3
+    assert np.allclose(first, second)
+
+    # survives a restart, read back from the memory-mapped file
+    reopened = CachedEmbeddingModel(embedding_model=inner, cache=EmbeddingCache(directory=str(tmp_path)))
+    assert np.allclose(await reopened.async_embed(["c", "d", "b"]), [first[2], (await inner.async_embed(["d"]))[0], first[1]])
+    assert inner.embedded == 5
+    assert reopened.cache.size() == 4
+    assert reopened.cache.stats()["hits"] == 2
+
+    # nothing to look up
+    assert (await reopened.async_embed([])).shape[0] == 0
+    assert reopened.cache.stats()["hits"] == 2
+
+
+def _write_embeddings(directory: str, writer: int):
+    from kruppe.embedding_cache import EmbeddingCache
+
+    cache = EmbeddingCache(directory=directory)
+    for i in range(100):
+        texts = [f"{writer}-{i}-{j}" for j in range(3)]
+        cache.put_many("m", texts, np.array([[writer, i, j, 0] for j in range(3)], dtype=np.float32))
+
+
+def test_embedding_cache_concurrent_writers(tmp_path, monkeypatch):
+    import multiprocessing
+    from kruppe.embedding_cache import EmbeddingCache, CachedEmbeddingModel, get_embedding_cache
+
+    # processes with their own cache on one directory never share rows
+    context = multiprocessing.get_context("fork")
+    writers = [context.Process(target=_write_embeddings, args=(str(tmp_path), w)) for w in range(4)]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join()
+    texts = [f"{w}-{i}-{j}" for w in range(4) for i in range(100) for j in range(3)]
+    found = EmbeddingCache(directory=str(tmp_path)).get_many("m", texts)
+    assert [tuple(vector[:3]) for vector in found] == [(w, i, j) for w in range(4) for i in range(100) for j in range(3)]
+
+    # models share one cache per directory
+    monkeypatch.setenv("KRUPPE_EMBEDDING_CACHE_DIR", str(tmp_path / "shared"))
+    first, second = CachedEmbeddingModel(embedding_model=CountingEmbeddingModel()), CachedEmbeddingModel(embedding_model=CountingEmbeddingModel())
+    assert first.cache is second.cache is get_embedding_cache(str(tmp_path / "shared"))
+
+
+@pytest.mark.asyncio
+async def test_openai_embedding_packing(mock_llm_server):
+    embedding_model = mock_llm_server.openai_embedding_model(max_request_tokens=1000, max_input_tokens=100)
+    texts = ["short"] * 50 + ["x" * 2000] + ["y" * 600] * 5
+
+    packs, owners, _ = embedding_model._pack(texts)
+    assert all(len(pack) <= embedding_model.max_request_inputs for pack in packs)
+    assert len(packs) < 10 # short texts share requests
+    assert owners == list(range(len(texts))) # truncated, not split
+
+    mock_llm_server.reset_stats()
+    embeddings = await embedding_model.async_embed(texts)
+    assert len(embeddings) == len(texts)
+    assert mock_llm_server.stats()["requests"] == len(packs)
+
+    embedding_model.overlong_inputs = "split"
+    packs, owners, _ = embedding_model._pack(texts)
+    assert len(owners) > len(texts)
+    embeddings = await embedding_model.async_embed(texts)
+    assert len(embeddings) == len(texts)
+    assert np.isclose(np.linalg.norm(embeddings[50]), 1.0)
+
+
+@pytest.mark.asyncio
+async def test_embeddings_are_float32_arrays(mock_llm_server):
+    from kruppe.llm import decode_embeddings
+    from kruppe.mock_server import mock_embedding
+
+    texts = ["alpha", "beta", "gamma"]
+    for embedding_model in (mock_llm_server.openai_embedding_model(), mock_llm_server.nyu_embedding_model()):
+        embeddings = await embedding_model.async_embed(texts)
+        assert isinstance(embeddings, np.ndarray)
+        assert embeddings.dtype == np.float32 and embeddings.shape == (3, 1536)
+        assert embeddings.flags["C_CONTIGUOUS"]
+        assert np.allclose(embeddings[1], mock_embedding("beta", 1536))
+
+    # base64 payloads and plain lists decode the same, placed by `index`
+    import base64
+    vectors = np.arange(6, dtype=np.float32).reshape(2, 3)
+    data = [
+        {"embedding": base64.b64encode(vectors[1].tobytes()).decode(), "index": 1},
+        {"embedding": vectors[0].tolist(), "index": 0},
+    ]
+    assert np.array_equal(decode_embeddings(data), vectors)
+
+
+@pytest.mark.asyncio
+async def test_hashing_embedding_model():
+    from kruppe.hashing_embedding import HashingEmbeddingModel
+    from kruppe.functional.rag.vectorstore.in_memory import InMemoryVectorStore
+    from kruppe.models import Document
+
+    model = HashingEmbeddingModel(dim=256)
+    texts = ["Apple beats earnings estimates", "apple earnings beat the estimates", "Fed raises interest rates", ""]
+    embeddings = model.embed(texts)
+    assert embeddings.shape == (4, 256) and embeddings.dtype == np.float32
+    assert np.allclose(np.linalg.norm(embeddings[:3], axis=1), 1.0)
+    assert not embeddings[3].any()
+    assert embeddings[0] @ embeddings[1] > embeddings[0] @ embeddings[2]
+    # stable, and batching doesn't change the result
+    assert np.array_equal(HashingEmbeddingModel(dim=256, batch_size=1).embed(texts), embeddings)
+    assert np.array_equal(await model.async_embed(texts), embeddings)
+
+    # tf-idf downweights words every document has
+    corpus = [f"market update {word}" for word in ["apple", "tesla", "rates", "oil"]]
+    tfidf = HashingEmbeddingModel(dim=256, tfidf=True, ngram_range=(1, 1)).fit(corpus)
+    plain = HashingEmbeddingModel(dim=256, ngram_range=(1, 1))
+    query = ["market update apple"]
+    assert (tfidf.embed(query) @ tfidf.embed(["apple"]).T)[0, 0] > (plain.embed(query) @ plain.embed(["apple"]).T)[0, 0]
+
+    # works as a no-network backend for the vector stores
+    store = InMemoryVectorStore(embedding_model=model)
+    await store.async_insert_documents([Document(text=t, metadata={}) for t in texts[:3]])
+    found = store.search(model.embed(["Fed interest rates"])[0], top_k=1)
+    assert found[0].text == "Fed raises interest rates"
+
+
+@pytest.mark.asyncio
+async def test_reduced_embedding_dimensions(mock_llm_server):
+    from kruppe.embedding_projection import PCAEmbeddingModel
+    from kruppe.hashing_embedding import HashingEmbeddingModel
+    from kruppe.functional.rag.vectorstore.in_memory import InMemoryVectorStore
+    from kruppe.mock_server import mock_embedding
+    from kruppe.models import Document
+    from kruppe.vector_benchmark import synthetic_embeddings, exact_top_k, recall_at_k, pca
+
+    # the api shortens the vectors; the nyu endpoint can't, so they're truncated locally, which matches
+    texts = ["alpha", "beta"]
+    openai_model = mock_llm_server.openai_embedding_model(dimensions=256)
+    nyu_model = mock_llm_server.nyu_embedding_model(dimensions=256)
+    assert openai_model.embedding_dim == nyu_model.embedding_dim == 256
+    assert mock_llm_server.openai_embedding_model().embedding_dim == 1536
+    short = await openai_model.async_embed(texts)
+    assert short.shape == (2, 256) and np.allclose(short[0], mock_embedding("alpha", 256), atol=1e-6)
+    assert np.allclose(await nyu_model.async_embed(texts), short, atol=1e-6)
+    assert openai_model.output_space == "text-embedding-3-small@256"
+
+    # concurrent calls for different output sizes don't share a flight
+    full_model = mock_llm_server.nyu_embedding_model()
+    reduced, full = await asyncio.gather(nyu_model.async_embed(["gamma"]), full_model.async_embed(["gamma"]))
+    assert reduced.shape == (1, 256) and full.shape == (1, 1536)
+
+    # pca projection for models that can't shorten their own vectors
+    base = HashingEmbeddingModel(dim=512)
+    projected = PCAEmbeddingModel(embedding_model=base, dimensions=16)
+    with pytest.raises(RuntimeError):
+        projected.embed(texts)
+    corpus = [f"company {i} reports {word} earnings" for i in range(40) for word in ("strong", "weak")]
+    projected.fit(corpus)
+    embeddings = await projected.async_embed(corpus[:5])
+    assert embeddings.shape == (5, 16) and np.allclose(np.linalg.norm(embeddings, axis=1), 1.0, atol=1e-5)
+    assert projected.embedding_dim == 16
+    # low-rank data keeps its neighbours under pca
+    vectors = synthetic_embeddings(2000, dim=256, rank=16)
+    reduced_corpus, reduced_queries = pca(vectors[:1900], vectors[1900:], 32)
+    truth = exact_top_k(vectors[:1900], vectors[1900:], 10)
+    assert recall_at_k(exact_top_k(reduced_corpus, reduced_queries, 10), truth) > 0.8
+
+    # stores record the dimension they were built with and refuse others
+    store = InMemoryVectorStore(embedding_model=base)
+    await store.async_insert_documents([Document(text=t, metadata={}) for t in corpus[:3]])
+    assert store.dimension == 512
+    store.embedding_model = projected
+    with pytest.raises(ValueError):
+        await store.async_insert_documents([Document(text=corpus[3], metadata={})])
@@ -71,3 +71,61 @@ async def test_fusion_retriever(vector_storage, llm, mode, query):
     end_time = time.time()
     elapsed_time = end_time - start_time
     print(f"\033[34mFusion Retriever [{mode}]: Elapsed time-{elapsed_time:.2f} seconds; Number of documents-{len(relevant_documents)}\033[0m")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["simple", "rrf"])
+async def test_fusion_retriever_batches_queries(mode):
+    from typing import List, Dict
+    from kruppe.llm import BaseLLM
+    from kruppe.hashing_embedding import HashingEmbeddingModel
+    from kruppe.functional.rag.vectorstore.in_memory import InMemoryVectorStore
+    from kruppe.models import Document, Response
+
+    class QueriesLLM(BaseLLM):
+        """offline llm that answers with fixed generated queries"""
+        model: str = "queries"
+
+        async def async_generate(self, messages: List[Dict], max_tokens=2000) -> Response:
+            return Response(text="apple earnings\ntesla deliveries\nfed rates\noil prices\ngold demand")
+
+        def generate(self, messages: List[Dict], max_tokens=2000) -> Response:
+            return Response(text="apple earnings\ntesla deliveries\nfed rates\noil prices\ngold demand")
+
+    class CountingHashingModel(HashingEmbeddingModel):
+        calls: int = 0
+
+        def embed(self, text):
+            self.calls += 1
+            return super().embed(text)
+
+    class CountingStore(InMemoryVectorStore):
+        searches: int = 0
+
+        def search_batch(self, vectors, top_k=3, filter=None):
+            self.searches += 1
+            return super().search_batch(vectors, top_k, filter)
+
+    embedding_model = CountingHashingModel(dim=256)
+    store = CountingStore(embedding_model=embedding_model)
+    topics = ["apple earnings", "tesla deliveries", "fed rates", "oil prices", "gold demand", "bond yields"]
+    store.insert_documents([Document(text=f"{topic} report {i}", metadata={}) for topic in topics for i in range(3)])
+    embedding_model.calls = 0
+
+    llm = QueriesLLM()
+    retriever = SimpleRetriever(index=VectorStoreIndex(llm=llm, vectorstore=store), top_k=2)
+    fusion_retriever = QueryFusionRetriever(retrievers=[retriever], llm=llm, num_queries=5, top_k=10, mode=mode)
+
+    # five generated queries: one embed round-trip and one search round-trip
+    for relevant_documents in (fusion_retriever.retrieve("markets"), await fusion_retriever.async_retrieve("markets")):
+        assert len(relevant_documents) == 10
+        assert len({doc.id for doc in relevant_documents}) == 10
+        assert not any("bond" in doc.text for doc in relevant_documents)
+    assert embedding_model.calls == 2 and store.searches == 2
+
+    # batched results match one query at a time
+    batched = retriever.retrieve_batch(["fed rates", "oil prices"])
+    assert [[doc.text for doc in results] for results in batched] == [
+        [doc.text for doc in store.search(embedding_model.embed([q])[0], 2)] for q in ["fed rates", "oil prices"]
+    ]
+    assert all(doc.score is not None for results in batched for doc in results)
@@ -1,12 +1,29 @@
 from numpy import isin
 from kruppe.functional.rag.text_splitters import RecursiveTextSplitter, ContextualTextSplitter
-from kruppe.models import Chunk
+from kruppe.llm import BaseLLM
+from kruppe.models import Chunk, Document, Response
+from typing import List, Dict
 from uuid import UUID
 import pytest
 
 CHUNK_SIZE = 128
 CHUNK_OVERLAP = 8
 
+class RecordingLLM(BaseLLM):
+    """offline llm that records the batches it is sent"""
+    model: str = "recording"
+    batches: List[List[List[Dict]]] = []
+
+    async def batch_async_generate(self, messages_list: List[List[Dict]], max_tokens=2000) -> List[Response]:
+        self.batches.append(messages_list)
+        return [Response(text="context") for _ in messages_list]
+
+    async def async_generate(self, messages: List[Dict], max_tokens=2000) -> Response:
+        raise NotImplementedError
+
+    def generate(self, messages: List[Dict], max_tokens=2000) -> Response:
+        raise NotImplementedError
+
 def test_splitter(documents, text_splitter):
     text_splitter = RecursiveTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
     # test chunk multiple documents at once
@@ -66,4 +83,27 @@ async def test_contextual_splitter(documents, llm):
             assert chunk.prev_chunk_id == chunked_documents[i-1].id
         if (i < len(chunked_documents) - 1):
             assert isinstance(chunk.next_chunk_id, UUID)
-            assert chunk.next_chunk_id == chunked_documents[i+1].id
\ No newline at end of file
+            assert chunk.next_chunk_id == chunked_documents[i+1].id
+
+
+@pytest.mark.asyncio
+async def test_contextual_splitter_prompt_layout():
+    documents = [
+        Document(text=" ".join(f"sentence {i} of document {d}." for i in range(40)), metadata={})
+        for d in range(2)
+    ]
+    llm = RecordingLLM()
+    text_splitter = ContextualTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, llm=llm)
+    chunked_documents = await text_splitter.async_split_documents(documents)
+
+    # the first chunk of each document goes out first to warm the prompt cache, then the rest
+    assert len(llm.batches) == 2
+    assert len(llm.batches[0]) == 2
+    assert sum(len(batch) for batch in llm.batches) == len(chunked_documents)
+
+    # every request for a document shares everything but the last (chunk) message
+    requests = [messages for batch in llm.batches for messages in batch]
+    document_requests = [messages for messages in requests if documents[0].text in messages[1]["content"]]
+    assert len(document_requests) > 1
+    assert all(messages[:2] == document_requests[0][:2] for messages in document_requests)
+    assert all(chunk.text.startswith("-CONTEXT-\ncontext") for chunk in chunked_documents)
@@ -117,4 +117,243 @@ async def test_search_vectorstore(vector_storage, embedding_model, query, docume
     assert documents3[1].metadata in metadata
     assert documents3[2].metadata in metadata
     assert documents3[1].id in ids
-    assert documents3[2].id in ids
\ No newline at end of file
+    assert documents3[2].id in ids
+
+@pytest.mark.asyncio
+async def test_in_memory_vectorstore_buffer():
+    import numpy as np
+    from kruppe.hashing_embedding import HashingEmbeddingModel
+    from kruppe.models import Document
+
+    model = HashingEmbeddingModel(dim=64)
+    store = InMemoryVectorStore(embedding_model=model, initial_capacity=2)
+    texts = [f"note {i} about {word}" for i, word in enumerate(["apple", "tesla", "rates", "oil", "gold"] * 4)]
+
+    # one at a time, as the librarian inserts; the buffer doubles instead of copying every time
+    for i, text in enumerate(texts):
+        assert await store.async_insert_documents([Document(text=text, metadata={})]) == [i]
+    assert store.size() == 20 and store._buffer.shape[0] == 32
+    assert np.allclose(np.linalg.norm(store._embeddings_matrix, axis=1), 1.0, atol=1e-5)
+
+    # same ranking as brute force cosine similarity over unnormalized vectors
+    query = model.embed(["note about gold"])[0] * 3
+    found = store.search(query, top_k=5)
+    scores = [doc.score for doc in found]
+    expected = np.sort(model.embed(texts) @ query / np.linalg.norm(query))[::-1][:5]
+    assert np.allclose(scores, expected, atol=1e-5)
+    assert all("gold" in doc.text for doc in found[:4])
+    assert store.search(query, top_k=0) == []
+
+    assert store.remove_documents([0, 1]) == 2
+    assert store.size() == 18 and store._embeddings_matrix.shape == (18, 64)
+    found = store.search(model.embed([texts[2]])[0], top_k=1)
+    assert found[0].text == texts[2]
+
+
+@pytest.mark.asyncio
+async def test_in_memory_vectorstore_filters():
+    import numpy as np
+    from kruppe.hashing_embedding import HashingEmbeddingModel
+    from kruppe.models import Document
+
+    model = HashingEmbeddingModel(dim=64)
+    store = InMemoryVectorStore(embedding_model=model, initial_capacity=4)
+    months = [1609459200 + 2_629_800 * i for i in range(12)] # 2021, month by month
+    documents = [
+        Document(text=f"market report {i}", metadata={"publication_time": t, "datasource": ["ft", "wsj", "nyt"][i % 3]})
+        for i, t in enumerate(months)
+    ]
+    documents.append(Document(text="market report undated", metadata={"datasource": "ft"}))
+    store.insert_documents(documents)
+    query = model.embed(["market report"])[0]
+
+    def texts(filter, top_k=20):
+        return {doc.text for doc in store.search(query, top_k=top_k, filter=filter)}
+
+    # librarian's time window
+    window = {"$and": [{"publication_time": {"$gte": months[2]}}, {"publication_time": {"$lte": months[5]}}]}
+    assert texts(window) == {f"market report {i}" for i in range(2, 6)}
+    assert len(store.search(query, top_k=2, filter=window)) == 2
+    assert texts({"datasource": "ft"}) == {"market report 0", "market report 3", "market report 6", "market report 9", "market report undated"}
+    assert texts({"datasource": {"$in": ["wsj", "nyt"]}, "publication_time": {"$lt": months[3]}}) == {"market report 1", "market report 2"}
+    assert texts({"$or": [{"datasource": "nyt"}, {"publication_time": {"$gt": months[10]}}]}) == {
+        "market report 2", "market report 5", "market report 8", "market report 11"
+    }
+    assert "market report undated" in texts({"publication_time": {"$ne": months[0]}})
+    assert texts({"datasource": "reuters"}) == set()
+    assert texts({}) == {doc.text for doc in documents}
+    with pytest.raises(ValueError):
+        store.search(query, filter={"publication_time": {"$regex": "2021"}})
+
+    # filtered batch search, and columns stay aligned through removals
+    assert [len(results) for results in store.search_batch(np.stack([query, query]), top_k=3, filter=window)] == [3, 3]
+    store.remove_documents([2, 3])
+    assert texts(window) == {"market report 4", "market report 5"}
+    store.insert_documents([Document(text="market report late", metadata={"publication_time": months[4], "datasource": "ft"})])
+    assert texts({"$and": [window, {"datasource": "ft"}]}) == {"market report late"}
+
+
+def test_in_memory_vectorstore_directory(tmp_path):
+    import os
+    import numpy as np
+    from kruppe.hashing_embedding import HashingEmbeddingModel
+    from kruppe.models import Document
+    from kruppe.functional.rag.vectorstore.store_directory import EMBEDDINGS, DOCUMENTS
+
+    model = HashingEmbeddingModel(dim=32)
+    store = InMemoryVectorStore(embedding_model=model)
+    store.insert_documents([
+        Document(text=f"report on {topic}", metadata={"datasource": source, "publication_time": 1609459200 + i})
+        for i, (topic, source) in enumerate([("apple", "ft"), ("tesla", "wsj"), ("rates", "ft"), ("oil", "nyt")])
+    ])
+    path = tmp_path / "store"
+    store.save(path)
+    query = model.embed(["report on rates"])[0]
+
+    # loads memory-mapped; results, scores and filters match the original
+    loaded = InMemoryVectorStore.load(path, embedding_model=model)
+    assert isinstance(loaded._base, np.memmap) and loaded.size() == 4 and loaded.dimension == 32
+    assert np.array_equal(np.load(path / EMBEDDINGS), store._embeddings_matrix)
+    for filter in (None, {"datasource": "ft"}, {"publication_time": {"$gte": 1609459201}}):
+        expected, found = store.search(query, 3, filter), loaded.search(query, 3, filter)
+        assert [(d.id, d.text, d.metadata, d.score) for d in found] == [(d.id, d.text, d.metadata, d.score) for d in expected]
+
+    # the model has to embed into the saved space: no silent fallback to a default model
+    with pytest.raises(ValueError):
+        InMemoryVectorStore.load(path) # HashingEmbeddingModel isn't in kruppe.llm
+    with pytest.raises(ValueError):
+        InMemoryVectorStore.load(path, embedding_model=HashingEmbeddingModel(dim=16))
+
+    # saving again appends: earlier bytes are untouched
+    embeddings_before, documents_before = (path / EMBEDDINGS).read_bytes(), (path / DOCUMENTS).read_bytes()
+    loaded.insert_documents([Document(text="report on gold", metadata={"datasource": "ft"})])
+    # the loaded rows stay memory-mapped, only the new one is in memory
+    assert isinstance(loaded._base, np.memmap) and len(loaded._base) == 4
+    assert loaded._buffer.shape[0] == loaded.initial_capacity and not isinstance(loaded._buffer, np.memmap)
+    assert loaded.search(model.embed(["report on gold"])[0], 1)[0].text == "report on gold"
+    found = loaded.search(query, 5, {"datasource": "ft"})
+    assert found[0].text == "report on rates" and {d.text for d in found} == {"report on rates", "report on apple", "report on gold"}
+    loaded.save(path)
+    assert (path / EMBEDDINGS).read_bytes()[128:].startswith(embeddings_before[128:])
+    assert (path / DOCUMENTS).read_bytes().startswith(documents_before)
+    reloaded = InMemoryVectorStore.load(path, embedding_model=model)
+    assert reloaded.size() == 5
+    assert reloaded.search(model.embed(["report on gold"])[0], 1, {"datasource": "ft"})[0].text == "report on gold"
+
+    # after a removal the directory is rewritten
+    reloaded.remove_documents([0])
+    reloaded.save(path)
+    assert [d.text for d in InMemoryVectorStore.load(path, embedding_model=model, mmap=False).documents] == [
+        "report on tesla", "report on rates", "report on oil", "report on gold"
+    ]
+    assert os.path.getsize(path / EMBEDDINGS) == 128 + 4 * 32 * 4
+
+
+def test_in_memory_vectorstore_ivf():
+    import numpy as np
+    from kruppe.hashing_embedding import HashingEmbeddingModel
+    from kruppe.models import Document
+    from kruppe.functional.rag.vectorstore.ivf import IVFIndex
+
+    # clustered vectors, like embeddings of an archive on a few dozen topics
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((30, 32))
+    vectors = (centers[rng.integers(0, 30, 3000)] + 0.3 * rng.standard_normal((3000, 32))).astype(np.float32)
+    documents = [Document(text=f"doc {i}", metadata={"datasource": "ft" if i % 50 else "wsj"}) for i in range(3000)]
+
+    exact = InMemoryVectorStore(embedding_model=HashingEmbeddingModel(dim=32))
+    ivf = IVFIndex(nlist=30, nprobe=5, min_train_size=1000, n_iter=30)
+    approximate = InMemoryVectorStore(embedding_model=HashingEmbeddingModel(dim=32), ivf=ivf)
+    exact._append(vectors, documents)
+    approximate._append(vectors[:500], documents[:500])
+    assert not ivf.trained # too small to bother
+    approximate._append(vectors[500:], documents[500:]) # trains in the background
+    ivf.wait()
+
+    queries = vectors[rng.integers(0, 3000, 50)] + 0.1 * rng.standard_normal((50, 32)).astype(np.float32)
+    def ids(store, **kwargs):
+        return [[doc.text for doc in results] for results in store.search_batch(queries, top_k=10, **kwargs)]
+
+    found, truth = ids(approximate), ids(exact)
+    assert ivf.trained and ivf.stats()["rows"] == 3000
+    assert np.mean([len(set(f) & set(t)) / 10 for f, t in zip(found, truth)]) > 0.9
+    ivf.nprobe = 30 # every list: exact
+    assert ids(approximate) == truth
+
+    # selective filters fall back to exact search when the probed lists come up short
+    ivf.nprobe = 1
+    assert ids(approximate, filter={"datasource": "wsj"}) == ids(exact, filter={"datasource": "wsj"})
+
+    # rows added later are assigned to lists; removed rows leave them
+    approximate._append(queries, [Document(text=f"new {i}", metadata={}) for i in range(50)])
+    assert ivf.stats()["rows"] == 3050
+    ivf.nprobe = 5
+    assert approximate.search(queries[7], top_k=1)[0].text == "new 7"
+    approximate.remove_documents(list(range(3000, 3050)))
+    assert ivf.stats()["rows"] == 3000 and ids(approximate)[0][0] != "new 0"
+
+
+def test_in_memory_vectorstore_quantization(tmp_path):
+    import numpy as np
+    from kruppe.hashing_embedding import HashingEmbeddingModel
+    from kruppe.models import Document
+    from kruppe.functional.rag.vectorstore.ivf import IVFIndex
+    from kruppe.functional.rag.vectorstore.quantization import ScalarQuantizer, ProductQuantizer
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((30, 64))
+    vectors = (centers[rng.integers(0, 30, 3000)] + 0.5 * rng.standard_normal((3000, 64))).astype(np.float32)
+    documents = [Document(text=f"doc {i}", metadata={"datasource": "ft" if i % 50 else "wsj"}) for i in range(3000)]
+    queries = vectors[rng.integers(0, 3000, 50)] + 0.1 * rng.standard_normal((50, 64)).astype(np.float32)
+
+    def ids(store, **kwargs):
+        return [[doc.text for doc in results] for results in store.search_batch(queries, top_k=10, **kwargs)]
+
+    def recall(found, truth):
+        return np.mean([len(set(f) & set(t)) / 10 for f, t in zip(found, truth)])
+
+    exact = InMemoryVectorStore(embedding_model=HashingEmbeddingModel(dim=64))
+    exact._append(vectors, documents)
+    truth = ids(exact)
+
+    # int8: 4x smaller codes, nearly exact
+    int8 = InMemoryVectorStore(embedding_model=HashingEmbeddingModel(dim=64), quantizer=ScalarQuantizer())
+    int8._append(vectors, documents)
+    assert int8._codes.dtype == np.int8 and int8._codes[:3000].nbytes * 4 == int8._embeddings_matrix.nbytes
+    assert recall(ids(int8), truth) > 0.9
+
+    # pq: 32x smaller codes, rough on its own, close to exact once the top candidates are reranked
+    pq = ProductQuantizer(min_train_size=1000, n_iter=20)
+    store = InMemoryVectorStore(embedding_model=HashingEmbeddingModel(dim=64), quantizer=pq)
+    store._append(vectors[:500], documents[:500])
+    assert not pq.trained and store._codes is None # searched exactly until there are enough rows
+    store._append(vectors[500:], documents[500:])
+    assert pq.trained and store._codes[:3000].nbytes * 32 == store._embeddings_matrix.nbytes
+    approximate = recall(ids(store), truth)
+    store.rerank = 100
+    assert recall(ids(store), truth) > max(0.9, approximate)
+    assert ids(store, filter={"datasource": "wsj"}) == ids(exact, filter={"datasource": "wsj"})
+
+    # saving with release frees the float32 rows: only the codes stay in memory
+    before = ids(store)
+    store.save(tmp_path / "released", release=True)
+    assert store._buffer is None and isinstance(store._base, np.memmap) and ids(store) == before
+
+    # codes follow removals
+    store.remove_documents(list(range(0, 3000, 2)))
+    exact.remove_documents(list(range(0, 3000, 2)))
+    assert store._coded == 1500 and recall(ids(store), ids(exact)) > 0.9
+
+    # a loaded store keeps the embeddings on disk and rereads only the reranked rows; works with ivf too
+    exact.save(tmp_path / "store")
+    loaded = InMemoryVectorStore.load(tmp_path / "store", embedding_model=HashingEmbeddingModel(dim=64),
+                                      quantizer=ProductQuantizer(min_train_size=1000, n_iter=20), rerank=100,
+                                      ivf=IVFIndex(nlist=30, nprobe=10, min_train_size=1000, background=False))
+    assert isinstance(loaded._base, np.memmap) and loaded._coded == 1500
+    assert recall(ids(loaded), ids(exact)) > 0.9
+
+    # clearing forgets the training, including the m derived from the old dimension
+    store.clear()
+    assert not pq.trained and pq.m is None and pq.codebooks is None
+    store._append(rng.standard_normal((1000, 32)).astype(np.float32), documents[:1000])
+    assert pq.trained and pq.m == 4 and store._codes.shape[1] == 4